@@ -1,404 +1,4224 @@
 import sys
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import re
 import datetime
 import time
-import traceback
+import calendar
+import random
+from collections import namedtuple
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import uuid
 import json
 import smtplib
 import sqlite3
+import hashlib
+import hmac
+import struct
+import operator
+import zlib
+import gzip
+import io
+import bisect
+import contextlib
+import types
+import urllib.request
 import threading
-import atexit
+import socket
+import signal
+import functools
+import logging
+import cProfile
+import pstats
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
-from flask import Flask, jsonify, request, send_file, redirect, session, url_for
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, send_file, redirect, session
 from flask_cors import CORS
 import os
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient import discovery_cache
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 import base64
-from email.mime.base import MIMEBase
-from email import encoders
+from email import policy as email_policy
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
 
 sys.stdout.reconfigure(encoding='utf-8')
 
-CHANNEL_USERNAME = 'DeJob_official'
-PROXY = None
+CHANNEL_USERNAME = 'DeJob_official'
+# 抓取的频道列表：CHANNELS_FILE 指向的 JSON 文件
+# ([{"name": "DeJob_official", "priority": 2, "min_interval": 30, "max_interval": 3600}, ...])，
+# 或逗号分隔的环境变量 SCRAPE_CHANNELS ("频道名:优先级,...")；都没有时只抓 CHANNEL_USERNAME
+CHANNELS_FILE = os.environ.get("CHANNELS_FILE", "channels.json")
+PROXY = None
+
+# ================= OAuth2 配置 =================
+# Gmail OAuth2 配置 - 用户需要从Google Cloud Console获取
+# 创建项目：https://console.cloud.google.com/
+# 启用Gmail API，创建OAuth2客户端凭证（桌面应用类型）
+# 将客户端ID和密钥保存在本地配置文件中
+OAUTH_CLIENT_CONFIG = {
+    "web": {
+        "client_id": os.environ.get("GMAIL_CLIENT_ID", ""),
+        "client_secret": os.environ.get("GMAIL_CLIENT_SECRET", ""),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "redirect_uris": ["http://localhost:5000/oauth2callback"]
+    }
+}
+
+# 本地存储令牌的文件
+TOKEN_FILE = 'gmail_token.json'
+SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+# 测试时可指向本地的假 Gmail 服务，例如 http://127.0.0.1:8030/
+GMAIL_API_ROOT = os.environ.get("GMAIL_API_ROOT")
+GMAIL_DISCOVERY_URL = 'https://gmail.googleapis.com/$discovery/rest?version=v1'
+# access token 剩余有效期不足该秒数时提前刷新
+GMAIL_REFRESH_MARGIN = 300
+
+# ================= 日志与指标 =================
+# LOG_LEVEL 控制 easyjob logger 的级别；LOG_FORMAT=json 时每条日志输出一行 JSON，
+# extra={...} 传入的字段 (channel、post_id 等) 会原样带上，方便日志系统检索
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+log = logging.getLogger('easyjob')
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging():
+    """给 easyjob logger 挂上输出到 stdout 的 handler；重复调用不会重复挂载"""
+    if log.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+# 进程内指标，/metrics 以 Prometheus 文本格式导出。只实现用到的 counter / histogram / gauge，
+# 不引入 prometheus_client；每个进程 (web、--worker) 各自导出自己的指标
+METRICS = []
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# PROFILING_ENABLED=1 时，带 X-Profile: 1 请求头的请求返回该请求的性能分析报告而不是正常响应；
+# 安装了 pyinstrument 用它 (采样，开销小)，否则用 cProfile
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED") == "1"
+PROFILE_HEADER = 'X-Profile'
+# 工作进程单独监听的指标端口，默认 0 不开；指标不做鉴权，默认只监听本机，需要给外部抓取时再改 METRICS_HOST
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labels, key), value
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        # 每组标签: [各桶计数 (非累计，最后一格是 +Inf), 总和, 次数]
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][slot] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), total, n)) for key, (counts, total, n) in self.values.items()]
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(self.labels, key, [('le', _format_value(bound))]), cumulative
+            yield self.name + '_sum', _format_labels(self.labels, key), total
+            yield self.name + '_count', _format_labels(self.labels, key), n
+
+class Gauge:
+    """抓取时才计算的 gauge：collect() 返回一个数，或 {标签值元组: 数}"""
+    kind = 'gauge'
+
+    def __init__(self, name, doc, collect, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.collect = collect
+        METRICS.append(self)
+
+    def samples(self):
+        try:
+            value = self.collect()
+        except Exception as e:
+            log.debug(f"指标 {self.name} 采集失败: {e}")
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, v in value.items():
+            if v is not None:
+                yield self.name, _format_labels(self.labels, key), v
+
+def timed(histogram, **labels):
+    """函数耗时计入 histogram 的装饰器"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.doc}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in metric.samples())
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port, host=None):
+    """工作进程没有 Flask，用标准库起一个只有 /metrics 的 HTTP 服务"""
+    server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+FETCH_SECONDS = Histogram('easyjob_scrape_fetch_seconds', '抓取一页的耗时 (含限速等待和重试)', ('result',))
+FETCH_RETRIES = Counter('easyjob_scrape_fetch_retries_total', '抓取重试次数')
+PARSE_PAGE_SECONDS = Histogram('easyjob_scrape_parse_seconds', '解析一页的耗时', ('backend',))
+PARSE_MESSAGES = Counter('easyjob_parse_messages_total', '逐条消息的解析结果 (job / skipped / error)', ('result',))
+SAVE_SECONDS = Histogram('easyjob_db_save_seconds', '一批职位写库的耗时')
+SAVED_JOBS = Counter('easyjob_jobs_saved_total', '写库的职位数 (inserted / updated / unchanged)', ('result',))
+DB_QUERY_SECONDS = Histogram('easyjob_db_query_seconds', '只读查询耗时', ('query',))
+HTTP_REQUEST_SECONDS = Histogram('easyjob_http_request_seconds', 'HTTP 请求处理耗时', ('endpoint', 'method', 'status'))
+HTTP_RESPONSE_BYTES = Histogram('easyjob_http_response_bytes', 'HTTP 响应体大小 (流式响应不计)', ('endpoint',), SIZE_BUCKETS)
+ARCHIVED_JOBS = Counter('easyjob_jobs_archived_total', '移入归档库的职位数')
+MAINTENANCE_SECONDS = Histogram('easyjob_maintenance_seconds', '定期维护 (归档、增量 VACUUM、optimize) 的耗时')
+SEND_SECONDS = Histogram('easyjob_send_seconds', '单个投递任务的发送耗时', ('provider', 'result'))
+# 依赖后面定义的全局对象，采集时才求值
+Gauge('easyjob_snapshot_jobs', '内存快照中的职位数', lambda: len(_snapshot.jobs) if _snapshot else None)
+Gauge('easyjob_snapshot_change_version', '内存快照对应的变更版本', lambda: _snapshot.change_version if _snapshot else None)
+Gauge('easyjob_send_tasks', '投递任务数', lambda: send_task_counts(), ('status',))
+Gauge('easyjob_channel_poll_interval_seconds', '各频道当前的轮询间隔', lambda: channel_status_gauge('interval'), ('channel',))
+Gauge('easyjob_channel_last_poll_timestamp_seconds', '各频道最近一次轮询时间', lambda: channel_status_gauge('last_poll'), ('channel',))
+
+# ================= 数据库配置 =================
+# 基准测试和多实例部署时可以指向其他文件
+DB_PATH = os.environ.get("DB_PATH", "jobs.db")
+
+# 结构化字段：薪资区间 (原币种、原周期)、换算成美元的月薪、远程/混合/现场
+STRUCTURED_COLUMNS = (
+    ('salary_min', 'REAL'),
+    ('salary_max', 'REAL'),
+    ('salary_currency', 'TEXT'),
+    ('salary_period', 'TEXT'),
+    ('salary_usd_month', 'REAL'),
+    ('is_remote', 'INTEGER'),
+    ('work_mode', 'TEXT'),
+)
+STRUCTURED_FIELDS = tuple(name for name, _ in STRUCTURED_COLUMNS)
+# /api/facets 汇总的维度：jobs 上的列，另加 tag
+FACET_COLUMNS = ('type', 'company', 'title')
+FACETS = FACET_COLUMNS + ('tag',)
+# 解析规则变化时加一，旧行会在后台按批重新解析
+PARSED_FIELDS_VERSION = 1
+# 1 单位货币折合多少美元，可用环境变量 SALARY_RATES='{"CNY": 0.139}' 覆盖或补充
+SALARY_RATES = {'USD': 1.0, 'USDT': 1.0, 'CNY': 0.14, 'HKD': 0.128, 'EUR': 1.08, 'SGD': 0.74}
+SALARY_RATES.update({k.upper(): float(v) for k, v in json.loads(os.environ.get("SALARY_RATES", "{}")).items()})
+DEFAULT_SALARY_CURRENCY = os.environ.get("DEFAULT_SALARY_CURRENCY", "CNY")
+# 各周期折算成月：按每月 21.75 个工作日、每天 8 小时
+PERIOD_TO_MONTH = {'month': 1.0, 'year': 1 / 12, 'week': 52 / 12, 'day': 21.75, 'hour': 21.75 * 8}
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    # 新建的库打开增量 VACUUM，删除/归档后的空闲页可以由维护任务分批还给文件系统；
+    # auto_vacuum 必须在建表前设置，老库需要执行一次 --vacuum 才能切换
+    if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # WAL 模式记录在数据库文件中，设置一次后所有连接生效：读不阻塞写，写不阻塞读
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate(conn)
+    # FTS5 是否可用取决于运行时的 SQLite 版本，每次启动都检查，不作为迁移
+    init_fts(conn)
+    init_bigram(conn)
+    conn.close()
+
+def init_jobs_table(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            company TEXT,
+            title TEXT,
+            salary TEXT,
+            date TEXT,
+            email TEXT,
+            location TEXT,
+            raw_content TEXT,
+            tags TEXT,
+            type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_date ON jobs(date DESC)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_company ON jobs(company)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_type ON jobs(type)
+    ''')
+    columns = {row[1] for row in c.execute('PRAGMA table_info(jobs)')}
+    if 'content_hash' not in columns:
+        c.execute('ALTER TABLE jobs ADD COLUMN content_hash TEXT')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def get_scrape_state(key, default=None):
+    with db_reader.connection() as conn:
+        row = conn.execute('SELECT value FROM scrape_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def set_scrape_state(key, value):
+    job_writer.set_state(key, value)
+
+# ================= 全文检索 (FTS5) =================
+# 招聘信息以中文为主，unicode61 分词无法切分中文，这里使用 trigram 分词。
+# trigram 只能检索 3 个字符及以上的词，"运营"、"前端" 这类两字词由 jobs_bigram 索引：
+# 内容是每个职位所有字母/数字连续段的重叠二元组 (小写、去重、空格分隔)，每个二元组是一个 unicode61 词元，
+# 两字词的查询就是一次词元查找。二元组在 JobWriter.save 里计算写入，删除由触发器跟随 jobs。
+_search_indexes = None
+_BIGRAM_RUN = re.compile(r'[^\W_]{2,}')
+_BIGRAM_TERM = re.compile(r'[^\W_]{2}')
+
+def search_indexes():
+    """库里已经建好的检索索引 ('jobs_fts'、'jobs_bigram' 的子集)
+
+    只有执行 init_db 的进程会建索引，web worker 从 sqlite_master 读一次后缓存。
+    """
+    global _search_indexes
+    if _search_indexes is None:
+        with db_reader.connection() as conn:
+            _search_indexes = frozenset(row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('jobs_fts', 'jobs_bigram')"))
+    return _search_indexes
+
+def job_bigrams(*texts):
+    """jobs_bigram 的内容：各段文本里字母/数字连续段的全部重叠二元组"""
+    grams = set()
+    for text in texts:
+        for run in _BIGRAM_RUN.findall((text or '').lower()):
+            grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return ' '.join(sorted(grams))
+
+def init_fts(c):
+    """创建与 jobs 表同步的 FTS5 外部内容索引，由触发器维护"""
+    global _search_indexes
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs_fts'").fetchone()
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+                company, title, raw_content,
+                content='jobs', content_rowid='rowid', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite < 3.34 没有 trigram 分词器，退化为 LIKE 搜索
+        log.warning(f"FTS5 不可用，搜索将使用 LIKE: {e}")
+        return
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_ai AFTER INSERT ON jobs BEGIN
+            INSERT INTO jobs_fts(rowid, company, title, raw_content)
+            VALUES (new.rowid, new.company, new.title, new.raw_content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_ad AFTER DELETE ON jobs BEGIN
+            INSERT INTO jobs_fts(jobs_fts, rowid, company, title, raw_content)
+            VALUES ('delete', old.rowid, old.company, old.title, old.raw_content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_au AFTER UPDATE OF company, title, raw_content ON jobs BEGIN
+            INSERT INTO jobs_fts(jobs_fts, rowid, company, title, raw_content)
+            VALUES ('delete', old.rowid, old.company, old.title, old.raw_content);
+            INSERT INTO jobs_fts(rowid, company, title, raw_content)
+            VALUES (new.rowid, new.company, new.title, new.raw_content);
+        END
+    ''')
+    if not exists:
+        # 已有数据的库第一次建索引时，全量重建一次
+        c.execute("INSERT INTO jobs_fts(jobs_fts) VALUES ('rebuild')")
+    _search_indexes = None
+
+def init_bigram(c):
+    """创建两字词索引 jobs_bigram；第一次创建时为已有的职位补齐二元组"""
+    global _search_indexes
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        # 拿到写锁后再检查，多个进程同时启动时只有一个补齐
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs_bigram'").fetchone()
+        if not exists:
+            c.execute('CREATE VIRTUAL TABLE jobs_bigram USING fts5(grams, detail=none)')
+            rows = c.execute('SELECT rowid, company, title, raw_content FROM jobs').fetchall()
+            c.executemany('INSERT INTO jobs_bigram (rowid, grams) VALUES (?, ?)',
+                          ((rowid, job_bigrams(*texts)) for rowid, *texts in rows))
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS jobs_bigram_ad AFTER DELETE ON jobs BEGIN
+                DELETE FROM jobs_bigram WHERE rowid = old.rowid;
+            END
+        ''')
+    except sqlite3.OperationalError as e:
+        c.execute('ROLLBACK')
+        log.warning(f"FTS5 不可用，两字词搜索将使用 LIKE: {e}")
+        return
+    except BaseException:
+        c.execute('ROLLBACK')
+        raise
+    c.execute('COMMIT')
+    _search_indexes = None
+
+def init_dedup(c):
+    """去重所需的列和 LSH 桶表：canonical_id 为空的是簇的代表行，重复行指向代表行"""
+    columns = {row[1] for row in c.execute('PRAGMA table_info(jobs)')}
+    if 'canonical_id' not in columns:
+        c.execute('ALTER TABLE jobs ADD COLUMN canonical_id TEXT')
+    if 'minhash' not in columns:
+        c.execute('ALTER TABLE jobs ADD COLUMN minhash BLOB')
+    # 列表默认只看代表行 (canonical_id IS NULL) 并按 (date, id) 倒序分页：复合索引按等值前缀 + 排序列顺序扫描，
+    # LIMIT 读够即停，不用先取出全部代表行再排序；合并簇时按 canonical_id 查重复行也走这个索引
+    c.execute('CREATE INDEX IF NOT EXISTS idx_canonical_date ON jobs(canonical_id, date DESC, id DESC)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_lsh (
+            bucket INTEGER NOT NULL,
+            job_id TEXT NOT NULL,
+            PRIMARY KEY (bucket, job_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_job_lsh_job ON job_lsh(job_id)')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_lsh_ad AFTER DELETE ON jobs BEGIN
+            DELETE FROM job_lsh WHERE job_id = old.id;
+        END
+    ''')
+
+def init_structured_fields(c):
+    """从正文解析出的结构化薪资/地点列；parsed_version 落后于 PARSED_FIELDS_VERSION 的行会被重新解析
+
+    (is_remote, date) 上的索引在 migrate_date_ts 中改建到 date_ts 上。
+    """
+    columns = {row[1] for row in c.execute('PRAGMA table_info(jobs)')}
+    for name, decl in STRUCTURED_COLUMNS + (('parsed_version', 'INTEGER'),):
+        if name not in columns:
+            c.execute(f'ALTER TABLE jobs ADD COLUMN {name} {decl}')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_salary_usd ON jobs(salary_usd_month)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_salary_max ON jobs(salary_max)')
+
+def init_send_queue(c):
+    """投递队列：send_batches 记录一次投递 (简历和发信配置)，send_tasks 每个收件人一行"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS send_batches (
+            id TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            file_name TEXT,
+            resume BLOB,
+            smtp_host TEXT,
+            smtp_port INTEGER,
+            smtp_user TEXT,
+            smtp_pass TEXT,  -- Fernet 密文，密钥不在库里 (见 secret_box)
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS send_tasks (
+            id INTEGER PRIMARY KEY,
+            batch_id TEXT NOT NULL,
+            job_id TEXT,
+            email TEXT,
+            title TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_send_tasks_due ON send_tasks(status, next_attempt_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_send_tasks_batch ON send_tasks(batch_id)')
+
+def migrate_date_ts(c):
+    """date 文本列之外增加 date_ts (UTC 零点的 epoch 秒)，分页、时间范围和清理都改用它"""
+    columns = {row[1] for row in c.execute('PRAGMA table_info(jobs)')}
+    if 'date_ts' not in columns:
+        c.execute('ALTER TABLE jobs ADD COLUMN date_ts INTEGER')
+    c.execute("UPDATE jobs SET date_ts = CAST(strftime('%s', date) AS INTEGER) WHERE date_ts IS NULL")
+    c.execute('DROP INDEX IF EXISTS idx_date')
+    c.execute('DROP INDEX IF EXISTS idx_remote_date')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_date_ts ON jobs(date_ts, id)')
+    # 列表默认查询 (canonical_id IS NULL ORDER BY date_ts DESC, id DESC) 按等值前缀 + 排序列顺序扫描，LIMIT 读够即停
+    c.execute('DROP INDEX IF EXISTS idx_canonical_date')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_canonical_date_ts ON jobs(canonical_id, date_ts DESC, id DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_remote_date_ts ON jobs(is_remote, date_ts)')
+
+def migrate_job_tags(c):
+    """把 tags JSON 拆成 job_tags 表 (pos 保留原顺序)，由触发器与 jobs.tags 保持同步"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_tags (
+            job_id TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (job_id, pos)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_job_tags_tag ON job_tags(tag, job_id)')
+    # tags 不是合法 JSON 数组时按无标签处理，不能让一行坏数据导致写入失败
+    tags_source = "json_each(CASE WHEN json_valid(new.tags) THEN new.tags ELSE '[]' END)"
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_tags_ai AFTER INSERT ON jobs BEGIN
+            INSERT OR IGNORE INTO job_tags (job_id, pos, tag)
+            SELECT new.id, key, value FROM {tags_source} WHERE type = 'text';
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_tags_au AFTER UPDATE OF tags ON jobs BEGIN
+            DELETE FROM job_tags WHERE job_id = old.id;
+            INSERT OR IGNORE INTO job_tags (job_id, pos, tag)
+            SELECT new.id, key, value FROM {tags_source} WHERE type = 'text';
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_tags_ad AFTER DELETE ON jobs BEGIN
+            DELETE FROM job_tags WHERE job_id = old.id;
+        END
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO job_tags (job_id, pos, tag)
+        SELECT jobs.id, t.key, t.value
+        FROM jobs, json_each(CASE WHEN json_valid(jobs.tags) THEN jobs.tags ELSE '[]' END) AS t
+        WHERE t.type = 'text'
+    ''')
+
+def _facet_delta_sql(row, delta):
+    """触发器语句：把 row (new/old) 在各维度上的计数加上 delta，四个维度都用 upsert"""
+    day = f"COALESCE({row}.date_ts, 0)"
+    dup = f"({row}.canonical_id IS NOT NULL)"
+    upsert = 'ON CONFLICT(facet, day, value, dup) DO UPDATE SET n = n + excluded.n;'
+    statements = [f'''
+            INSERT INTO job_facets (facet, day, value, dup, n)
+            VALUES ('{column}', {day}, COALESCE({row}.{column}, ''), {dup}, {delta}) {upsert}'''
+                  for column in FACET_COLUMNS]
+    # 同一条职位的重复标签只计一次
+    statements.append(f'''
+            INSERT INTO job_facets (facet, day, value, dup, n)
+            SELECT DISTINCT 'tag', {day}, value, {dup}, {delta}
+            FROM json_each(CASE WHEN json_valid({row}.tags) THEN {row}.tags ELSE '[]' END)
+            WHERE type = 'text' {upsert}''')
+    return ''.join(statements)
+
+def migrate_facets(c):
+    """按 (维度, 日期, 取值, 是否重复行) 汇总的计数表，由 jobs 上的触发器在写入事务中增量维护"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_facets (
+            facet TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            dup INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (facet, day, value, dup)
+        ) WITHOUT ROWID
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_facets_ai AFTER INSERT ON jobs BEGIN{_facet_delta_sql('new', 1)}
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_facets_ad AFTER DELETE ON jobs BEGIN{_facet_delta_sql('old', -1)}
+        END
+    ''')
+    # 去重改写 canonical_id 时只有代表行/重复行的身份变化，也要挪动计数
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_facets_au AFTER UPDATE OF type, company, title, tags, date_ts, canonical_id ON jobs
+        WHEN old.type IS NOT new.type OR old.company IS NOT new.company OR old.title IS NOT new.title
+             OR old.tags IS NOT new.tags OR old.date_ts IS NOT new.date_ts
+             OR (old.canonical_id IS NULL) != (new.canonical_id IS NULL)
+        BEGIN{_facet_delta_sql('old', -1)}{_facet_delta_sql('new', 1)}
+        END
+    ''')
+    c.execute('DELETE FROM job_facets')
+    for column in FACET_COLUMNS:
+        c.execute(f'''
+            INSERT INTO job_facets (facet, day, value, dup, n)
+            SELECT '{column}', COALESCE(date_ts, 0), COALESCE({column}, ''), canonical_id IS NOT NULL, COUNT(*)
+            FROM jobs GROUP BY 2, 3, 4
+        ''')
+    c.execute('''
+        INSERT INTO job_facets (facet, day, value, dup, n)
+        SELECT 'tag', day, value, dup, COUNT(*) FROM (
+            SELECT DISTINCT jobs.id, COALESCE(jobs.date_ts, 0) AS day, t.value AS value,
+                   jobs.canonical_id IS NOT NULL AS dup
+            FROM jobs, json_each(CASE WHEN json_valid(jobs.tags) THEN jobs.tags ELSE '[]' END) AS t
+            WHERE t.type = 'text'
+        ) GROUP BY day, value, dup
+    ''')
+
+def migrate_change_feed(c):
+    """job_changes 记录每次插入/修改/删除的职位 id，AUTOINCREMENT 的 version 单调递增且不复用"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_job_changes_time ON job_changes(changed_at)')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_changes_ai AFTER INSERT ON jobs BEGIN
+            INSERT INTO job_changes (job_id, op) VALUES (new.id, 'insert');
+        END
+    ''')
+    # 只关心客户端能看到的列：写签名 (minhash) 之类的内部更新不产生变更
+    visible = ', '.join(HASHED_FIELDS + ('canonical_id',) + STRUCTURED_FIELDS)
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS jobs_changes_au AFTER UPDATE OF {visible} ON jobs BEGIN
+            INSERT INTO job_changes (job_id, op) VALUES (new.id, 'update');
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_changes_ad AFTER DELETE ON jobs BEGIN
+            INSERT INTO job_changes (job_id, op) VALUES (old.id, 'delete');
+        END
+    ''')
+
+def migrate_worker_leases(c):
+    """进程间的租约：同一时刻只有一个进程持有 scheduler 租约，负责抓取和投递"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS worker_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    # send_tasks.claimed_by 记录认领任务的调度进程 (租约 owner)，崩溃恢复据此判断任务是否还有人在发
+    columns = {row[1] for row in c.execute('PRAGMA table_info(send_tasks)')}
+    if 'claimed_by' not in columns:
+        c.execute('ALTER TABLE send_tasks ADD COLUMN claimed_by TEXT')
+
+def migrate_channels(c):
+    """多频道：jobs.channel 记录来源频道，抓取游标按频道存放，channel_status 保存调度器的统计"""
+    columns = {row[1] for row in c.execute('PRAGMA table_info(jobs)')}
+    if 'channel' not in columns:
+        c.execute('ALTER TABLE jobs ADD COLUMN channel TEXT')
+    # 消息 id 形如 "频道名/序号"
+    c.execute("UPDATE jobs SET channel = substr(id, 1, instr(id, '/') - 1) WHERE channel IS NULL AND instr(id, '/') > 1")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_channel_date_ts ON jobs(channel, date_ts)')
+    # 之前只有一个频道，游标没有频道后缀
+    for key in (STATE_LAST_POST_ID, STATE_BACKFILL_BEFORE):
+        c.execute('UPDATE OR IGNORE scrape_state SET key = ? WHERE key = ?', (f'{key}:{CHANNEL_USERNAME}', key))
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS channel_status (
+            channel TEXT PRIMARY KEY,
+            priority REAL,
+            interval REAL,
+            post_rate REAL,
+            jobs_per_hour REAL,
+            polls INTEGER NOT NULL DEFAULT 0,
+            jobs_total INTEGER NOT NULL DEFAULT 0,
+            last_poll_at REAL,
+            last_success_at REAL,
+            next_poll_at REAL,
+            last_error TEXT
+        )
+    ''')
+
+# ================= 数据库迁移 =================
+# PRAGMA user_version 记录已执行到第几个迁移，新迁移只能追加到末尾。
+# 前四个是引入版本号之前就有的建表/ALTER，老库已经执行过，所以它们必须可以重复执行。
+SCHEMA_MIGRATIONS = [
+    init_jobs_table,
+    init_dedup,
+    init_structured_fields,
+    init_send_queue,
+    migrate_date_ts,
+    migrate_job_tags,
+    migrate_facets,
+    migrate_change_feed,
+    migrate_worker_leases,
+    migrate_channels,
+]
+
+def migrate(conn):
+    """在启动时按顺序执行未执行过的迁移，每个迁移连同版本号在一个事务里提交
+
+    conn 需要是 isolation_level=None 的连接，事务由这里显式控制。返回迁移后的版本号。
+    """
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 拿到写锁后重新读版本号：多个进程同时启动时，后来者会看到前者已经完成的迁移
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version > len(SCHEMA_MIGRATIONS):
+                raise RuntimeError(f"数据库版本 {version} 比程序支持的 {len(SCHEMA_MIGRATIONS)} 新，请升级程序")
+            if version == len(SCHEMA_MIGRATIONS):
+                conn.execute('COMMIT')
+                break
+            migration = SCHEMA_MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+        except BaseException:
+            if conn.in_transaction: conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        log.info(f"数据库已迁移到版本 {version + 1} ({migration.__name__})")
+    return len(SCHEMA_MIGRATIONS)
+
+# ================= 去重 (MinHash / LSH) =================
+# 频道经常换个消息 id 重发同一条招聘。raw_content 归一化后取 5 字符 shingle 计算 MinHash，
+# 按 LSH 分桶找候选，估计的 Jaccard 相似度达到阈值即视为同一簇。
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+MINHASH_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERM // LSH_BANDS
+SHINGLE_SIZE = 5
+# 只对撞桶 band 数最多的几个候选算相似度：真正的重复 (相似度 >= 0.8) 平均会撞上 16 个 band 中的 6 个以上
+MAX_DEDUP_CANDIDATES = 8
+_MERSENNE_PRIME = (1 << 61) - 1
+# 固定种子：签名会持久化，各进程、各次启动必须使用同一组哈希函数
+_minhash_rng = random.Random(0x5EED)
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1, _MERSENNE_PRIME), _minhash_rng.randrange(_MERSENNE_PRIME))
+                   for _ in range(MINHASH_PERM)]
+_MINHASH_STRUCT = struct.Struct(f'<{MINHASH_PERM}I')
+DEDUP_URL_RE = re.compile(r'https?://\S+|www\.\S+|t\.me/\S+')
+DEDUP_STRIP_RE = re.compile(r'[\W_]+')
+
+def normalize_for_dedup(text):
+    """小写、去掉链接、标点、空白和 emoji，只保留文字和数字"""
+    return DEDUP_STRIP_RE.sub('', DEDUP_URL_RE.sub('', (text or '').lower()))
+
+def job_minhash(text):
+    """返回 MinHash 签名 (打包成 bytes)，正文为空时返回 None 不参与去重"""
+    text = normalize_for_dedup(text)
+    if not text: return None
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return _MINHASH_STRUCT.pack(*[min([(a * h + b) % _MERSENNE_PRIME for h in hashes]) & 0xffffffff
+                                  for a, b in _MINHASH_PARAMS])
+
+def minhash_similarity(a, b):
+    """两个签名相同位置取值一致的比例，即 Jaccard 相似度的估计"""
+    return sum(map(operator.eq, _MINHASH_STRUCT.unpack(a), _MINHASH_STRUCT.unpack(b))) / MINHASH_PERM
+
+def lsh_buckets(signature):
+    """每个 band 的取值连同 band 序号哈希成一个 64 位桶号"""
+    buckets = []
+    for band in range(LSH_BANDS):
+        chunk = signature[band * LSH_ROWS * 4:(band + 1) * LSH_ROWS * 4]
+        digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+def _cluster_order(date, job_id):
+    # 簇内日期最新 (同日取消息序号最大) 的一条作为代表行，清理旧数据时代表行最后才会被删
+    return (date or '', post_number(job_id) or 0)
+
+def job_fingerprint(job):
+    """(签名, LSH 桶号)，在写锁外计算；正文为空的职位返回 (None, [])，不参与去重"""
+    signature = signature_of(job)
+    return signature, (lsh_buckets(signature) if signature is not None else [])
+
+def assign_cluster(conn, job_id, date, signature, buckets):
+    """在写事务中为一行写入签名和 LSH 桶，并与最相似的已有职位合并成簇
+
+    signature/buckets 由 job_fingerprint 在锁外算好，这里只查候选、比较少量签名和写簇。
+    """
+    conn.execute('UPDATE jobs SET minhash = ? WHERE id = ?', (signature, job_id))
+    if signature is None: return
+    candidates = [row[0] for row in conn.execute(f'''
+        SELECT job_id FROM job_lsh WHERE bucket IN ({','.join('?' * len(buckets))}) AND job_id != ?
+        GROUP BY job_id ORDER BY COUNT(*) DESC LIMIT ?
+    ''', buckets + [job_id, MAX_DEDUP_CANDIDATES])]
+    conn.executemany('INSERT OR IGNORE INTO job_lsh (bucket, job_id) VALUES (?, ?)', [(b, job_id) for b in buckets])
+    if not candidates: return
+
+    best, best_score = None, DEDUP_THRESHOLD
+    for other_id, other_canonical, other_hash in conn.execute(
+            f"SELECT id, canonical_id, minhash FROM jobs WHERE id IN ({','.join('?' * len(candidates))})", candidates):
+        if other_hash is None: continue
+        score = minhash_similarity(signature, other_hash)
+        if score >= best_score:
+            best, best_score = other_canonical or other_id, score
+    if best is None: return
+
+    row = conn.execute('SELECT date FROM jobs WHERE id = ?', (best,)).fetchone()
+    if row is None or _cluster_order(date, job_id) > _cluster_order(row[0], best):
+        # 新来的这条更新，成为代表行，原簇整体改为指向它
+        conn.execute('UPDATE jobs SET canonical_id = ? WHERE id = ? OR canonical_id = ?', (job_id, best, best))
+        conn.execute('UPDATE jobs SET canonical_id = NULL WHERE id = ?', (job_id,))
+    else:
+        conn.execute('UPDATE jobs SET canonical_id = ? WHERE id = ?', (best, job_id))
+
+def refresh_fingerprint(conn, job_id, signature, buckets):
+    """内容被编辑过的行只更新签名和桶，不改变所属的簇"""
+    conn.execute('UPDATE jobs SET minhash = ? WHERE id = ?', (signature, job_id))
+    conn.execute('DELETE FROM job_lsh WHERE job_id = ?', (job_id,))
+    conn.executemany('INSERT OR IGNORE INTO job_lsh (bucket, job_id) VALUES (?, ?)', [(b, job_id) for b in buckets])
+
+# ================= 写库 =================
+# 内容哈希覆盖的字段：只有这些字段变化时才更新行 (以及 updated_at、索引)
+HASHED_FIELDS = ('company', 'title', 'salary', 'date', 'email', 'location', 'raw_content', 'tags', 'type')
+
+def job_content_hash(row):
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()
+
+def date_to_ts(value):
+    """YYYY-MM-DD -> 当天 UTC 零点的 epoch 秒，与 SQLite strftime('%s', date) 一致；无法解析时返回 None"""
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+    except (TypeError, ValueError):
+        return None
+
+def days_ago_ts(days):
+    return date_to_ts((datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d'))
+
+def salary_usd_month(amount, currency, period):
+    """按 SALARY_RATES 和 PERIOD_TO_MONTH 折算成美元月薪，币种未知时返回 None"""
+    if amount is None or currency not in SALARY_RATES: return None
+    return round(amount * SALARY_RATES[currency] * PERIOD_TO_MONTH.get(period or 'month', 1.0), 2)
+
+def salary_rates_fingerprint():
+    return json.dumps({'rates': SALARY_RATES, 'periods': PERIOD_TO_MONTH}, sort_keys=True)
+
+def signature_of(job):
+    # 回填流水线在解析进程里已经算好签名，这里只补算增量抓取的少量职位
+    if 'minhash' in job: return job['minhash']
+    return job_minhash(job.get('raw_content', ''))
+
+class JobWriter:
+    """持久化的单写连接：WAL 模式下读连接不会被写入阻塞，每批职位在一个事务里 executemany 写入"""
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # WAL 下 NORMAL 只在检查点时 fsync，断电最多丢最后几个事务，不会损坏数据库
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA cache_size = -20000')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            self.conn = conn
+        return self.conn
+
+    def save(self, jobs):
+        """写入一批职位，返回 {'inserted': n, 'updated': n, 'unchanged': n}"""
+        rows = {}
+        jobs_by_id = {}
+        for job in jobs:
+            # 将tags列表转换为JSON字符串
+            tags_json = json.dumps(job.get('tags', []), ensure_ascii=False)
+            values = (
+                job.get('company', ''),
+                job.get('title', ''),
+                job.get('salary', ''),
+                job.get('date', ''),
+                job.get('email', ''),
+                job.get('location', ''),
+                job.get('raw_content', ''),
+                tags_json,
+                job.get('type', '')
+            )
+            structured = tuple(job.get(name) for name in STRUCTURED_FIELDS)
+            channel = job.get('channel') or post_channel(str(job['id']))
+            rows[str(job['id'])] = values + structured + (channel, date_to_ts(values[3]), job_content_hash(values))
+            jobs_by_id[str(job['id'])] = job
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if not rows: return counts
+
+        # 去重签名和 LSH 桶号在拿写锁之前算好，只算新增和内容变化的行。
+        # 写锁同时保护投递队列和抓取状态，锁内只留下比对哈希、写行和归簇
+        with db_reader.connection() as conn:
+            known = self._content_hashes(conn, list(rows))
+        fingerprints = {job_id: job_fingerprint(jobs_by_id[job_id])
+                        for job_id, values in rows.items() if known.get(job_id) != values[-1]}
+
+        with SAVE_SECONDS.time(), self.transaction() as conn:
+            # 锁外读到的哈希可能已经过时 (其他进程刚写过)，以事务内的为准
+            existing = self._content_hashes(conn, list(rows))
+            changed = []
+            inserted = []
+            updated = []
+            for job_id, values in rows.items():
+                if job_id not in existing:
+                    counts['inserted'] += 1
+                    inserted.append(job_id)
+                elif existing[job_id] != values[-1]:
+                    counts['updated'] += 1
+                    updated.append(job_id)
+                else:
+                    counts['unchanged'] += 1
+                    continue
+                changed.append((job_id,) + values)
+            conn.executemany(f'''
+                INSERT INTO jobs
+                (id, company, title, salary, date, email, location, raw_content, tags, type,
+                 {', '.join(STRUCTURED_FIELDS)}, channel, date_ts, content_hash, parsed_version, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(STRUCTURED_FIELDS))}, ?, ?, ?, {PARSED_FIELDS_VERSION}, CURRENT_TIMESTAMP)
+                ON CONFLICT(id) DO UPDATE SET
+                    company = excluded.company,
+                    title = excluded.title,
+                    salary = excluded.salary,
+                    date = excluded.date,
+                    date_ts = excluded.date_ts,
+                    channel = excluded.channel,
+                    email = excluded.email,
+                    location = excluded.location,
+                    raw_content = excluded.raw_content,
+                    tags = excluded.tags,
+                    type = excluded.type,
+                    {', '.join(f'{name} = excluded.{name}' for name in STRUCTURED_FIELDS)},
+                    content_hash = excluded.content_hash,
+                    parsed_version = excluded.parsed_version,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE jobs.content_hash IS NOT excluded.content_hash
+            ''', changed)
+            if changed and 'jobs_bigram' in search_indexes():
+                # upsert 不改变 rowid，更新的行先删掉旧的二元组
+                rowids = {}
+                for i in range(0, len(changed), 500):
+                    chunk = [row[0] for row in changed[i:i + 500]]
+                    rowids.update(conn.execute(
+                        f"SELECT id, rowid FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+                conn.executemany('DELETE FROM jobs_bigram WHERE rowid = ?', [(rowids[job_id],) for job_id in updated])
+                conn.executemany('INSERT INTO jobs_bigram (rowid, grams) VALUES (?, ?)', [
+                    (rowids[row[0]], job_bigrams(row[1], row[2], row[7])) for row in changed])
+            # 去重按批内顺序逐条进行，同一批里的重复也能互相匹配；
+            # 锁外判断为未变化、锁内才发现变化的行很少，签名就地补算
+            for job_id in inserted:
+                signature, buckets = fingerprints.get(job_id) or job_fingerprint(jobs_by_id[job_id])
+                assign_cluster(conn, job_id, jobs_by_id[job_id].get('date', ''), signature, buckets)
+            for job_id in updated:
+                refresh_fingerprint(conn, job_id, *(fingerprints.get(job_id) or job_fingerprint(jobs_by_id[job_id])))
+        for result, n in counts.items():
+            if n: SAVED_JOBS.inc(n, result=result)
+        return counts
+
+    @staticmethod
+    def _content_hashes(conn, ids):
+        hashes = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            hashes.update(conn.execute(
+                f"SELECT id, content_hash FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        return hashes
+
+    def backfill_structured_fields(self, batch_size=500):
+        """按批重新解析 parsed_version 落后的旧行，写入结构化字段；汇率表变化时重算美元月薪
+
+        每批单独一个短事务，期间抓取写入可以穿插进行。返回重新解析的行数。
+        """
+        total = 0
+        last_rowid = 0
+        while True:
+            with db_reader.connection() as conn:
+                rows = conn.execute(f'''
+                    SELECT rowid, {', '.join(HASHED_FIELDS)} FROM jobs
+                    WHERE rowid > ? AND (parsed_version IS NULL OR parsed_version < ?)
+                    ORDER BY rowid LIMIT ?
+                ''', (last_rowid, PARSED_FIELDS_VERSION, batch_size)).fetchall()
+            if not rows: break
+            updates = []
+            for row in rows:
+                job = dict(zip(HASHED_FIELDS, row[1:]))
+                tags = json.loads(job['tags']) if job['tags'] else []
+                _, salary_line, _ = JobParser.scan_lines(job['raw_content'] or '')
+                fields = JobParser.structured_fields(job['raw_content'] or '', tags, salary_line)
+                job['location'] = fields['location']
+                values = tuple(job[name] or '' for name in HASHED_FIELDS)
+                updates.append((fields['location'],) + tuple(fields[name] for name in STRUCTURED_FIELDS)
+                               + (job_content_hash(values), PARSED_FIELDS_VERSION, row[0]))
+            with self.transaction() as conn:
+                conn.executemany(f'''
+                    UPDATE jobs SET location = ?, {', '.join(f'{name} = ?' for name in STRUCTURED_FIELDS)},
+                        content_hash = ?, parsed_version = ?
+                    WHERE rowid = ?
+                ''', updates)
+            total += len(rows)
+            last_rowid = rows[-1][0]
+
+        fingerprint = salary_rates_fingerprint()
+        if get_scrape_state(STATE_SALARY_RATES) != fingerprint:
+            with self.transaction() as conn:
+                conn.create_function('salary_usd_month', 3, salary_usd_month, deterministic=True)
+                conn.execute('''
+                    UPDATE jobs SET salary_usd_month = salary_usd_month(salary_max, salary_currency, salary_period)
+                    WHERE salary_max IS NOT NULL
+                ''')
+            self.set_state(STATE_SALARY_RATES, fingerprint)
+        return total
+
+    def dedup_pending(self, batch_size=500):
+        """为还没有签名的旧数据补算签名并归簇 (从旧到新)，返回处理的行数"""
+        return sum(self.dedup_batches(batch_size))
+
+    def dedup_batches(self, batch_size=500):
+        """dedup_pending 的分批版本：每处理完一批 (一个写事务) yield 这批的行数
+
+        正文为空的行算不出签名，始终是 NULL，靠游标跳过而不是反复重查。
+        """
+        last = (-1, '')
+        while True:
+            with db_reader.connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, date, raw_content, date_ts FROM jobs
+                    WHERE minhash IS NULL AND (date_ts > ? OR (date_ts = ? AND id > ?))
+                    ORDER BY date_ts, id LIMIT ?
+                ''', (last[0], last[0], last[1], batch_size)).fetchall()
+            if not rows: return
+            # 签名在锁外计算，写锁只覆盖查候选和写簇
+            fingerprints = [(job_id, date) + job_fingerprint({'raw_content': raw}) for job_id, date, raw, _ in rows]
+            with self.transaction() as conn:
+                for job_id, date, signature, buckets in fingerprints:
+                    assign_cluster(conn, job_id, date, signature, buckets)
+            last = (rows[-1][3], rows[-1][0])
+            yield len(rows)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """持有写锁并在 BEGIN IMMEDIATE 事务中执行，异常时回滚"""
+        with self.lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def set_state(self, key, value):
+        with self.lock:
+            self._connection().execute('''
+                INSERT INTO scrape_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+            ''', (key, None if value is None else str(value)))
+
+    def acquire_lease(self, name, owner, ttl):
+        """获取或续约租约，返回是否持有；其他持有者的租约未过期时返回 False"""
+        now = time.time()
+        with self.transaction() as conn:
+            acquired = conn.execute('''
+                INSERT INTO worker_leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE worker_leases.owner = excluded.owner OR worker_leases.expires_at < ?
+            ''', (name, owner, now + ttl, now)).rowcount == 1
+        return acquired
+
+    def save_channel_status(self, status):
+        """写入一个频道的调度统计 (status 的键与 channel_status 的列同名)"""
+        columns = list(status)
+        with self.lock:
+            self._connection().execute(f'''
+                INSERT INTO channel_status ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                ON CONFLICT(channel) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns if c != 'channel')}
+            ''', [status[c] for c in columns])
+
+    def release_lease(self, name, owner):
+        with self.lock:
+            self._connection().execute('DELETE FROM worker_leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def prune(self):
+        """清理汇总表和变更记录里的过期行 (职位本身由 archive_expired 移到归档库)"""
+        with self.transaction() as conn:
+            # 触发器只做加减，计数归零的汇总行在这里顺带清掉
+            conn.execute('DELETE FROM job_facets WHERE n <= 0')
+            conn.execute('DELETE FROM job_changes WHERE changed_at < ?',
+                         (int(time.time()) - CHANGE_RETENTION_DAYS * 86400,))
+
+    def delete_archived(self, rows):
+        """删除已写入归档库的行；rows 为 (id, content_hash)，期间被更新过的行哈希对不上，留到下一批重新归档"""
+        with self.transaction() as conn:
+            return sum(conn.execute('DELETE FROM jobs WHERE id = ? AND content_hash IS ?', row).rowcount
+                       for row in rows)
+
+    def compact(self, pages):
+        """增量 VACUUM 归还至多 pages 个空闲页，再执行 PRAGMA optimize；返回归还的页数
+
+        只有 auto_vacuum=INCREMENTAL 的库能增量回收，其余只做 optimize。
+        每次回收的页数有上限，持有写锁的时间是有界的。
+        """
+        with self.lock:
+            conn = self._connection()
+            free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            conn.execute('PRAGMA optimize')
+            # 截断 WAL，文件尾部被回收的页这时才真正从磁盘上释放
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+            return free_before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+job_writer = JobWriter()
+
+def save_jobs_to_db(jobs):
+    return job_writer.save(jobs)
+
+# ================= 只读连接池 =================
+READ_POOL_SIZE = 8
+
+class ReadPool:
+    """只读连接池：mode=ro 打开并设置 query_only，API 线程借用后归还
+
+    连接常驻，sqlite3 在每个连接上缓存编译好的语句 (cached_statements)，
+    所以 SQL 文本固定的查询在复用连接时不会重新编译。
+    """
+    def __init__(self, db_path=DB_PATH, size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        uri = 'file:' + urllib.request.pathname2url(os.path.abspath(self.db_path)) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self.idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+db_reader = ReadPool()
+
+@timed(DB_QUERY_SECONDS, query='snapshot')
+def load_jobs_from_db(days=60, fields=None):
+    fields = fields or JOB_FIELDS
+    with db_reader.connection() as conn:
+        rows = conn.execute(f'''
+            SELECT {', '.join(fields)}
+            FROM jobs
+            WHERE date_ts >= ?
+            ORDER BY date_ts DESC, id DESC
+        ''', (days_ago_ts(days),)).fetchall()
+
+    jobs = []
+    for row in rows:
+        job = dict(zip(fields, row))
+        job['tags'] = json.loads(job['tags']) if job['tags'] else []
+        jobs.append(job)
+    return jobs
+
+# ================= 内存快照 =================
+class JobSnapshot:
+    """最近 DEFAULT_LOOKBACK_DAYS 天职位的不可变快照，只含列表字段 (DEFAULT_JOB_FIELDS)，不含 raw_content
+
+    构建好新快照后整体替换模块级引用，请求线程读到的要么是旧快照要么是新快照，不需要加锁。
+    """
+    __slots__ = ('version', 'jobs', 'by_id', 'built_at', 'change_version')
+
+    def __init__(self, version, jobs, change_version=0):
+        self.version = version
+        # 快照包含的最新一条 job_changes 的版本
+        self.change_version = change_version
+        self.jobs = tuple(jobs)
+        self.by_id = types.MappingProxyType({job['id']: job for job in self.jobs})
+        self.built_at = time.time()
+
+    def merged(self, version, job_ids, changed, change_version):
+        """用 changed ({id: job}) 替换 job_ids 对应的职位生成新快照；job_ids 中查不到的视为已删除
+
+        移出时间窗口的职位同时去掉，其余职位对象原样复用，结果仍按 date、id 倒序。
+        """
+        cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=DEFAULT_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        ids = {str(jid) for jid in job_ids}
+        jobs = [job for job in self.jobs if job['id'] not in ids and job['date'] >= cutoff_date]
+        jobs.extend(job for job in changed.values() if job['date'] >= cutoff_date)
+        jobs.sort(key=lambda job: (job['date'], job['id']), reverse=True)
+        return JobSnapshot(version, jobs, change_version)
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+# 请求线程最多每隔这么久查一次是否有新变更 (包括其他进程的写入)
+SNAPSHOT_CHECK_INTERVAL = 1.0
+_snapshot_checked_at = 0.0
+# 同一时刻最多一个后台刷新线程
+_snapshot_refreshing = threading.Event()
+
+def snapshot_changes(since):
+    """since 之后的变更：返回 (最新的变更版本, 变化的职位 id 集合)
+
+    变更已被清理、接不上 since，或者一次超过 CHANGE_FEED_LIMIT 条 (逐个重读不如整体重建) 时返回 None。
+    """
+    with db_reader.connection() as conn:
+        if change_feed_expired(conn, since): return None
+        rows = conn.execute('SELECT version, job_id FROM job_changes WHERE version > ? ORDER BY version LIMIT ?',
+                            (since, CHANGE_FEED_LIMIT + 1)).fetchall()
+    if len(rows) > CHANGE_FEED_LIMIT: return None
+    return (rows[-1][0] if rows else since), {job_id for _, job_id in rows}
+
+def refresh_snapshot(full=False):
+    """发布新快照：只重读 job_changes 里快照之后变化的职位并合并进当前快照；
+    还没有快照、变更接不上或 full 为 True 时从数据库整体重建。没有新变更时返回当前快照。
+
+    并发调用时串行执行，版本号单调递增。
+    """
+    global _snapshot
+    with _snapshot_lock:
+        version = _snapshot.version + 1 if _snapshot else 1
+        snapshot = _snapshot
+        changes = None if full or snapshot is None else snapshot_changes(snapshot.change_version)
+        if changes is None:
+            # 先取变更版本再加载，期间发生的写入会在下次刷新时再合并一次
+            change_version = latest_change_version()
+            _snapshot = JobSnapshot(version, load_jobs_from_db(DEFAULT_LOOKBACK_DAYS, DEFAULT_JOB_FIELDS), change_version)
+        else:
+            change_version, job_ids = changes
+            if change_version == snapshot.change_version: return snapshot
+            # 归簇改写的 canonical_id 也经触发器记进了 job_changes，同簇旧行会一起重读
+            _snapshot = snapshot.merged(version, job_ids, load_jobs_by_ids(job_ids, DEFAULT_JOB_FIELDS), change_version)
+        response_cache.prime()
+        notify_changes()
+        return _snapshot
+
+def _refresh_snapshot_in_background():
+    try:
+        refresh_snapshot()
+    except Exception as e:
+        log.error(f"快照刷新失败: {e}")
+    finally:
+        _snapshot_refreshing.clear()
+
+def get_snapshot():
+    """当前快照；发现数据库有新变更时在后台线程合并，完成前请求继续使用旧快照
+
+    只有进程里还没有任何快照时 (启动后的第一个请求) 才同步构建。
+    """
+    global _snapshot_checked_at
+    snapshot = _snapshot
+    if snapshot is None: return refresh_snapshot()
+    now = time.monotonic()
+    if now - _snapshot_checked_at >= SNAPSHOT_CHECK_INTERVAL and not _snapshot_refreshing.is_set():
+        _snapshot_checked_at = now
+        if latest_change_version() != snapshot.change_version:
+            with _snapshot_lock:
+                if _snapshot_refreshing.is_set(): return snapshot
+                _snapshot_refreshing.set()
+            threading.Thread(target=_refresh_snapshot_in_background, name='snapshot-refresh', daemon=True).start()
+    return snapshot
+
+def find_jobs(job_ids):
+    """按 id 取职位的列表字段 (不含 raw_content)：先查快照，快照里没有的 (更早的或刚写入的) 再查数据库"""
+    snapshot = get_snapshot()
+    found = {}
+    missing = []
+    for jid in job_ids:
+        job = snapshot.by_id.get(str(jid))
+        if job: found[job['id']] = job
+        else: missing.append(jid)
+    if missing:
+        found.update(load_jobs_by_ids(missing, DEFAULT_JOB_FIELDS))
+    return found
+
+# ================= 职位查询 (分页/筛选) =================
+JOB_FIELDS = ('id', 'company', 'title', 'salary', 'date', 'email', 'location', 'raw_content', 'tags', 'type',
+              'canonical_id', 'channel') + STRUCTURED_FIELDS
+# 列表接口默认不返回 raw_content，需要时通过 fields 参数显式指定
+DEFAULT_JOB_FIELDS = tuple(f for f in JOB_FIELDS if f != 'raw_content')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_LOOKBACK_DAYS = 60
+MAX_LOOKBACK_DAYS = 3650
+MAX_TAG_KEYWORDS = 10
+MIN_QUERY_YEAR = 1970
+WORK_MODES = ('remote', 'hybrid', 'onsite')
+
+def encode_cursor(date_ts, job_id):
+    raw = json.dumps([date_ts, job_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_ts, job_id = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError("cursor 无效")
+    # 旧版本的游标是日期字符串，同样按无效处理，客户端从第一页重新开始
+    if not isinstance(date_ts, int) or isinstance(date_ts, bool) or not isinstance(job_id, str):
+        raise ValueError("cursor 无效")
+    return date_ts, job_id
+
+def _parse_date_arg(value, name):
+    try:
+        date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"{name} 格式应为 YYYY-MM-DD")
+    # strftime 输出 0001 年时不补零 ("1-01-01")，与 date 列按字符串比较时静默返回空结果；早于 epoch 的日期本来也没有意义
+    if date.year < MIN_QUERY_YEAR:
+        raise ValueError(f"{name} 不能早于 {MIN_QUERY_YEAR} 年")
+    return date.isoformat()
+
+def _parse_days_arg(value):
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("days 必须是整数")
+    # 过大的 days 会让 timedelta 溢出 (OverflowError)，在这里就拒绝
+    if not 1 <= days <= MAX_LOOKBACK_DAYS:
+        raise ValueError(f"days 必须在 1 到 {MAX_LOOKBACK_DAYS} 之间")
+    return days
+
+def _parse_keywords_arg(value, name):
+    words = [w.strip() for w in value.split(',') if w.strip()]
+    if len(words) > MAX_TAG_KEYWORDS:
+        raise ValueError(f"{name} 最多 {MAX_TAG_KEYWORDS} 个关键词")
+    return words
+
+def _parse_bool_arg(value, name):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'): return True
+    if lowered in ('0', 'false', 'no'): return False
+    raise ValueError(f"{name} 只能是 true/false")
+
+def parse_job_query(args):
+    """把 /api/jobs 的查询参数解析成 query_jobs 的参数，非法输入抛出 ValueError"""
+    query = {'filters': {}, 'fields': DEFAULT_JOB_FIELDS, 'limit': DEFAULT_PAGE_SIZE, 'cursor': None}
+    filters = query['filters']
+
+    for name in ('type', 'tag', 'company', 'channel'):
+        if args.get(name): filters[name] = args[name]
+
+    if args.get('date_from'):
+        filters['date_from'] = _parse_date_arg(args['date_from'], 'date_from')
+    else:
+        days = _parse_days_arg(args.get('days', DEFAULT_LOOKBACK_DAYS))
+        filters['date_from'] = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+    if args.get('date_to'):
+        filters['date_to'] = _parse_date_arg(args['date_to'], 'date_to')
+
+    if args.get('has_email'):
+        filters['has_email'] = _parse_bool_arg(args['has_email'], 'has_email')
+    for name in ('tag_contains', 'contains'):
+        if args.get(name):
+            words = _parse_keywords_arg(args[name], name)
+            if words: filters[name] = words
+    for name in ('salary_min', 'salary_max'):
+        if args.get(name):
+            try:
+                filters[name] = float(args[name])
+            except ValueError:
+                raise ValueError(f"{name} 必须是数字")
+    if args.get('include_duplicates'):
+        filters['include_duplicates'] = _parse_bool_arg(args['include_duplicates'], 'include_duplicates')
+    if args.get('salary_usd_min'):
+        try:
+            filters['salary_usd_min'] = float(args['salary_usd_min'])
+        except ValueError:
+            raise ValueError("salary_usd_min 必须是数字")
+    if args.get('remote'):
+        filters['remote'] = _parse_bool_arg(args['remote'], 'remote')
+    if args.get('work_mode'):
+        if args['work_mode'] not in WORK_MODES:
+            raise ValueError(f"work_mode 只能是 {'/'.join(WORK_MODES)}")
+        filters['work_mode'] = args['work_mode']
+
+    if args.get('limit'):
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            raise ValueError("limit 必须是整数")
+        query['limit'] = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if args.get('cursor'):
+        query['cursor'] = decode_cursor(args['cursor'])
+
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in JOB_FIELDS]
+        if unknown:
+            raise ValueError(f"未知字段: {', '.join(unknown)}")
+        query['fields'] = tuple(f for f in JOB_FIELDS if f in fields or f == 'id')
+
+    return query
+
+def _like_pattern(word):
+    return '%' + re.sub(r'([%_\\])', r'\\\1', word) + '%'
+
+def job_filter_sql(filters, alias=None):
+    """把筛选条件翻译成 jobs 表上的 WHERE 子句列表和参数；alias 为 jobs 在 JOIN 里的别名"""
+    c = (lambda name: f'{alias}.{name}') if alias else (lambda name: name)
+    where = []
+    params = []
+    if filters.get('date_from'):
+        where.append(f"{c('date_ts')} >= ?"); params.append(date_to_ts(filters['date_from']))
+    if filters.get('date_to'):
+        where.append(f"{c('date_ts')} <= ?"); params.append(date_to_ts(filters['date_to']))
+    for name in ('type', 'company'):
+        if filters.get(name):
+            where.append(f"{c(name)} = ?"); params.append(filters[name])
+    if filters.get('channel'):
+        where.append(f"{c('channel')} = ?"); params.append(filters['channel'])
+    if filters.get('tag'):
+        where.append(f"{c('id')} IN (SELECT job_id FROM job_tags WHERE tag = ?)")
+        params.append(filters['tag'])
+    if filters.get('tag_contains'):
+        # 任一标签包含任一关键词；扫描 idx_job_tags_tag 覆盖索引，不回表
+        where.append(f"{c('id')} IN (SELECT job_id FROM job_tags WHERE "
+                     + ' OR '.join(["tag LIKE ? ESCAPE '\\'"] * len(filters['tag_contains'])) + ')')
+        params.extend(_like_pattern(word) for word in filters['tag_contains'])
+    for word in filters.get('contains', ()):
+        # 每个关键词都要出现在公司、岗位、地点或原文里
+        where.append(f"({c('company')} || ' ' || {c('title')} || ' ' || IFNULL({c('location')}, '') || ' ' || "
+                     f"IFNULL({c('raw_content')}, '')) LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(word))
+    if 'has_email' in filters:
+        where.append(f"{c('email')} != ''" if filters['has_email'] else f"({c('email')} = '' OR {c('email')} IS NULL)")
+    # salary_max 列与展示用的 salary 字符串是同一个数 (区间上限，原币种)
+    if filters.get('salary_min') is not None:
+        where.append(f"{c('salary_max')} >= ?"); params.append(filters['salary_min'])
+    if filters.get('salary_max') is not None:
+        where.append(f"{c('salary_max')} <= ?"); params.append(filters['salary_max'])
+    if filters.get('salary_usd_min') is not None:
+        where.append(f"{c('salary_usd_month')} >= ?"); params.append(filters['salary_usd_min'])
+    if 'remote' in filters:
+        where.append(f"{c('is_remote')} = ?"); params.append(1 if filters['remote'] else 0)
+    if filters.get('work_mode'):
+        where.append(f"{c('work_mode')} = ?"); params.append(filters['work_mode'])
+    if not filters.get('include_duplicates'):
+        # 默认只返回每个重复簇的代表行
+        where.append(f"{c('canonical_id')} IS NULL")
+    return where, params
+
+@timed(DB_QUERY_SECONDS, query='jobs')
+def query_jobs(filters, fields=DEFAULT_JOB_FIELDS, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """按 (date_ts, id) 倒序做 keyset 分页查询，返回 (jobs, next_cursor)"""
+    where, params = job_filter_sql(filters)
+    if cursor:
+        # 行值比较可以直接在 idx_canonical_date_ts (canonical_id, date_ts, id) 上做范围扫描
+        where.append('(date_ts, id) < (?, ?)')
+        params.extend(cursor)
+
+    # 分页游标需要 date_ts 和 id，即使没有被投影也要查出来
+    columns = list(fields)
+    for required in ('id', 'date_ts'):
+        if required not in columns: columns.append(required)
+    sql = f"SELECT {', '.join(columns)} FROM jobs"
+    if where: sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY date_ts DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    with db_reader.connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    jobs = []
+    for row in rows:
+        record = dict(zip(columns, row))
+        if 'tags' in record:
+            record['tags'] = json.loads(record['tags']) if record['tags'] else []
+        jobs.append({f: record[f] for f in fields})
+    next_cursor = None
+    if has_more and rows:
+        last = dict(zip(columns, rows[-1]))
+        next_cursor = encode_cursor(last['date_ts'], last['id'])
+    return jobs, next_cursor
+
+@timed(DB_QUERY_SECONDS, query='by_ids')
+def load_jobs_by_ids(job_ids, fields=None):
+    """按 id 批量读取职位，返回 {id: job}；fields 默认是全部字段 (含 raw_content)"""
+    fields = fields or JOB_FIELDS
+    ids = list({str(jid) for jid in job_ids})
+    jobs = {}
+    if not ids: return jobs
+    with db_reader.connection() as conn:
+        # SQLite 默认最多 999 个绑定参数，分批查询
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = conn.execute(f"""
+                SELECT {', '.join(fields)}
+                FROM jobs WHERE id IN ({','.join('?' * len(chunk))})
+            """, chunk).fetchall()
+            for row in rows:
+                job = dict(zip(fields, row))
+                job['tags'] = json.loads(job['tags']) if job['tags'] else []
+                jobs[job['id']] = job
+    return jobs
+
+# 只有这些筛选条件时直接读 job_facets 汇总表，其余条件退回到在 jobs 上按条件分组计数
+SUMMARY_FACET_FILTERS = {'date_from', 'date_to', 'include_duplicates'}
+DEFAULT_FACET_LIMIT = 50
+
+def parse_facet_query(args):
+    """/api/facets 的参数：筛选条件与 /api/jobs 相同，另有 facets (逗号分隔的维度) 和 limit (每个维度返回的个数)"""
+    query = {'filters': parse_job_query(args)['filters'], 'facets': FACETS, 'limit': DEFAULT_FACET_LIMIT}
+    if args.get('facets'):
+        names = [f.strip() for f in args['facets'].split(',') if f.strip()]
+        unknown = [f for f in names if f not in FACETS]
+        if unknown:
+            raise ValueError(f"未知维度: {', '.join(unknown)}")
+        query['facets'] = tuple(f for f in FACETS if f in names)
+    if args.get('limit'):
+        try:
+            query['limit'] = max(1, min(int(args['limit']), MAX_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit 必须是整数")
+    return query
+
+@timed(DB_QUERY_SECONDS, query='facets')
+def query_facets(filters, facets=FACETS, limit=DEFAULT_FACET_LIMIT):
+    """返回 {facet: [{'value': v, 'count': n}, ...]}，每个维度按计数倒序取前 limit 个"""
+    result = {facet: [] for facet in facets}
+    with db_reader.connection() as conn:
+        if set(filters) <= SUMMARY_FACET_FILTERS:
+            sql = f"SELECT facet, value, SUM(n) FROM job_facets WHERE facet IN ({','.join('?' * len(facets))})"
+            params = list(facets)
+            if filters.get('date_from'):
+                sql += ' AND day >= ?'; params.append(date_to_ts(filters['date_from']))
+            if filters.get('date_to'):
+                sql += ' AND day <= ?'; params.append(date_to_ts(filters['date_to']))
+            if not filters.get('include_duplicates'):
+                sql += ' AND dup = 0'
+            sql += " AND value != '' GROUP BY facet, value HAVING SUM(n) > 0"
+            rows = conn.execute(sql, params).fetchall()
+        else:
+            where, params = job_filter_sql(filters)
+            where_sql = ' AND '.join(where) or '1'
+            rows = []
+            for facet in facets:
+                if facet == 'tag':
+                    sql = f'''
+                        SELECT 'tag', job_tags.tag, COUNT(DISTINCT job_tags.job_id)
+                        FROM job_tags JOIN jobs ON jobs.id = job_tags.job_id
+                        WHERE {where_sql} GROUP BY job_tags.tag
+                    '''
+                else:
+                    sql = f"SELECT '{facet}', {facet}, COUNT(*) FROM jobs WHERE {where_sql} AND {facet} != '' GROUP BY {facet}"
+                rows.extend(conn.execute(sql, params).fetchall())
+    for facet, value, count in rows:
+        result[facet].append({'value': value, 'count': count})
+    for facet, values in result.items():
+        values.sort(key=lambda item: (-item['count'], item['value']))
+        del values[limit:]
+    return result
+
+SEARCH_FIELDS = ('id', 'company', 'title', 'salary', 'date', 'email', 'type')
+MIN_TRIGRAM_LEN = 3
+
+def _like_snippet(text, term, width=24):
+    """为 LIKE 匹配生成与 FTS5 snippet() 相同格式的高亮片段"""
+    text = text or ''
+    pos = text.lower().find(term.lower())
+    if pos < 0: return text[:width * 2]
+    start = max(0, pos - width)
+    end = min(len(text), pos + len(term) + width)
+    return (('…' if start > 0 else '') + text[start:pos] + '<mark>' + text[pos:pos + len(term)] + '</mark>'
+            + text[pos + len(term):end] + ('…' if end < len(text) else ''))
+
+@timed(DB_QUERY_SECONDS, query='search')
+def search_jobs(q, limit=DEFAULT_PAGE_SIZE, days=DEFAULT_LOOKBACK_DAYS, filters=None, fields=SEARCH_FIELDS):
+    """全文检索，返回按相关度排序、带高亮片段的结果；filters 与 /api/jobs 的筛选条件相同，fields 为字段投影
+
+    trigram 分词只能索引 3 个字符及以上的词；两个字母/数字组成的词 (如 "运营") 查 jobs_bigram，
+    只有单字和含符号的短词作为 LIKE 条件过滤。
+    """
+    terms = [t for t in q.split() if t]
+    if not terms: return []
+    indexes = search_indexes()
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LEN] if 'jobs_fts' in indexes else []
+    bigram_terms = ([t for t in terms if t not in long_terms and _BIGRAM_TERM.fullmatch(t)]
+                    if 'jobs_bigram' in indexes else [])
+    short_terms = [t for t in terms if t not in long_terms and t not in bigram_terms]
+    filters = dict(filters or {})
+    filters.setdefault('date_from', (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d'))
+    # 筛选条件带上别名：FTS 分支里 jobs_fts 也有 company/title 列
+    where, params = job_filter_sql(filters, alias='j')
+    columns = ', '.join(f'j.{f}' for f in fields)
+
+    where_sql = ' AND '.join(where)
+    if bigram_terms:
+        where_sql += ' AND j.rowid IN (SELECT rowid FROM jobs_bigram WHERE jobs_bigram MATCH ?)'
+        params.append(' AND '.join(f'"{t}"' for t in bigram_terms))
+    for term in short_terms:
+        where_sql += " AND (j.company || ' ' || j.title || ' ' || j.raw_content) LIKE ? ESCAPE '\\'"
+        params.append(_like_pattern(term))
+
+    with db_reader.connection() as conn:
+        if long_terms:
+            # 每个词作为短语加引号，避免用户输入被当作 FTS5 查询语法
+            match = ' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            rows = conn.execute(f'''
+                SELECT {columns},
+                       highlight(jobs_fts, 1, '<mark>', '</mark>'),
+                       snippet(jobs_fts, 2, '<mark>', '</mark>', '…', 24),
+                       bm25(jobs_fts, 5.0, 3.0, 1.0) AS score
+                FROM jobs_fts JOIN jobs j ON j.rowid = jobs_fts.rowid
+                WHERE jobs_fts MATCH ? AND {where_sql}
+                ORDER BY score LIMIT ?
+            ''', [match] + params + [limit]).fetchall()
+        else:
+            rows = conn.execute(f'''
+                SELECT {columns}, j.title, j.raw_content, 0
+                FROM jobs j
+                WHERE {where_sql}
+                ORDER BY j.date_ts DESC, j.id DESC LIMIT ?
+            ''', params + [limit]).fetchall()
+
+    results = []
+    for row in rows:
+        job = dict(zip(fields, row))
+        if 'tags' in job:
+            job['tags'] = json.loads(job['tags']) if job['tags'] else []
+        job['title_highlight'], job['snippet'], job['score'] = row[len(fields):]
+        if not long_terms:
+            term = (bigram_terms + short_terms)[0]
+            job['title_highlight'] = _like_snippet(job['title_highlight'], term, width=len(job['title_highlight'] or ''))
+            job['snippet'] = _like_snippet(job['snippet'], term)
+        results.append(job)
+    return results
+
+# ================= 变更流 =================
+# 写库触发器把每个变化的职位 id 追加到 job_changes，客户端拿着上次的 version 增量同步。
+# 同进程写入后通过 notify_changes 立即唤醒 SSE 连接；其他进程的写入靠 STREAM_POLL_INTERVAL 轮询发现。
+CHANGE_FEED_LIMIT = 500
+CHANGE_RETENTION_DAYS = 7
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "2"))
+STREAM_HEARTBEAT = 15
+# 每个 SSE 连接占住一个 worker 线程：连接最长保持 STREAM_MAX_AGE 秒后由服务端结束，浏览器带着
+# Last-Event-ID 自动重连；每个进程同时最多 STREAM_MAX_CLIENTS 个连接，超出的返回 503，前端改为轮询 /api/jobs/changes
+STREAM_MAX_AGE = float(os.environ.get("STREAM_MAX_AGE", "45"))
+STREAM_MAX_CLIENTS = int(os.environ.get("STREAM_MAX_CLIENTS", "8"))
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+_changes_signal = threading.Condition()
+
+def notify_changes():
+    with _changes_signal:
+        _changes_signal.notify_all()
+
+def wait_for_changes(timeout):
+    with _changes_signal:
+        _changes_signal.wait(timeout)
+
+def _latest_change_version(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'job_changes'").fetchone()
+    return row[0] if row else 0
+
+def latest_change_version():
+    with db_reader.connection() as conn:
+        return _latest_change_version(conn)
+
+def change_feed_expired(conn, since):
+    """since 早于已清理的记录或晚于最新版本：增量同步接不上，只能重新全量加载"""
+    latest = _latest_change_version(conn)
+    oldest = conn.execute('SELECT MIN(version) FROM job_changes').fetchone()[0]
+    return since > latest or since + 1 < (oldest or latest + 1)
+
+@timed(DB_QUERY_SECONDS, query='changes')
+def changes_since(since, fields=DEFAULT_JOB_FIELDS, include_duplicates=False, limit=CHANGE_FEED_LIMIT):
+    """返回 version 之后的变更：同一职位只保留最后一次，按当前状态给出 upsert (附带职位) 或 delete
+
+    since 早于已清理的记录或晚于最新版本时返回 reset，客户端需要重新全量加载。
+    """
+    with db_reader.connection() as conn:
+        if change_feed_expired(conn, since):
+            return {"version": _latest_change_version(conn), "reset": True, "has_more": False, "changes": []}
+        rows = conn.execute('''
+            SELECT version, job_id FROM job_changes WHERE version > ? ORDER BY version LIMIT ?
+        ''', (since, limit)).fetchall()
+    if not rows:
+        return {"version": since, "reset": False, "has_more": False, "changes": []}
+
+    # 按最后一次变化的顺序输出
+    order = {job_id: version for version, job_id in rows}
+    current = load_jobs_by_ids(order)
+    changes = []
+    for job_id in sorted(order, key=order.get):
+        job = current.get(job_id)
+        if job is None or (job['canonical_id'] is not None and not include_duplicates):
+            # 被删除，或被归入别的簇成了重复行，对默认列表来说都是消失
+            changes.append({"id": job_id, "op": "delete"})
+        else:
+            changes.append({"id": job_id, "op": "upsert", "job": {f: job[f] for f in fields}})
+    return {"version": rows[-1][0], "reset": False, "has_more": len(rows) == limit, "changes": changes}
+
+def _parse_since(value):
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("since 必须是整数")
+    if since < 0: raise ValueError("since 必须是非负整数")
+    return since
+
+@timed(DB_QUERY_SECONDS, query='count')
+def count_jobs():
+    with db_reader.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+# ================= 数据保留与归档 =================
+# 超过保留期的职位不直接删除，而是压缩后移到单独的归档库 (ARCHIVE_DB_PATH)，历史搜索可以按需查询。
+# 由调度进程的定期维护执行：分批归档、清理汇总表、增量 VACUUM 和 PRAGMA optimize。
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "90"))
+ARCHIVE_DB_PATH = os.environ.get("ARCHIVE_DB_PATH", "jobs_archive.db")
+ARCHIVE_BATCH_SIZE = 500
+# 批与批之间让出写锁，抓取写入可以穿插进行
+ARCHIVE_BATCH_PAUSE = 0.05
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", str(6 * 3600)))
+# 每次维护最多回收的空闲页数 (4KB 页约 40MB)
+INCREMENTAL_VACUUM_PAGES = 10000
+# 上次维护的时间记在 scrape_state，调度进程重启或换主后不会马上重复执行
+STATE_LAST_MAINTENANCE = 'last_maintenance'
+
+# 单条记录只有几百字节，直接 zlib 压缩率很低；预置字典里放上字段名和常见词，压缩后约小三分之一。
+# 已归档的行靠 codec 列找到对应的字典解压，所以字典只能新增版本，不能修改
+ARCHIVE_ZDICTS = {
+    1: ('{"id": "DeJob_official/", "company": "", "title": "", "salary": "", "date": "", "email": "", '
+        '"location": "", "raw_content": "", "tags": [], "type": "", "canonical_id": null, "channel": "", '
+        '"salary_min": null, "salary_max": null, "salary_currency": "USDT", "salary_period": "month", '
+        '"salary_usd_month": null, "is_remote": 0, "work_mode": "remote", "hybrid", "onsite", '
+        '"#招聘 #远程 全职 兼职 实习 其他项目 项目：薪资：邮箱: 工作地点：岗位职责 任职要求 @gmail.com"}').encode('utf-8'),
+}
+ARCHIVE_CODEC = 1
+# 归档库的搜索只按明文列筛选，其余条件 (标签、薪资等) 需要解压整条记录，不支持
+ARCHIVE_FILTERS = frozenset(['date_from', 'date_to', 'type', 'company', 'channel', 'include_duplicates'])
+
+def _deflate_record(job):
+    compressor = zlib.compressobj(6, zdict=ARCHIVE_ZDICTS[ARCHIVE_CODEC])
+    body = json.dumps({f: job[f] for f in JOB_FIELDS}, ensure_ascii=False).encode('utf-8')
+    return compressor.compress(body) + compressor.flush()
+
+def _inflate_text(codec, payload):
+    if payload is None: return None
+    decompressor = zlib.decompressobj(zdict=ARCHIVE_ZDICTS[codec])
+    return (decompressor.decompress(payload) + decompressor.flush()).decode('utf-8')
+
+class ArchiveStore:
+    """归档库：每个职位一行，完整记录 (含 raw_content) 是用预置字典 zlib 压缩的 JSON
+
+    date_ts、channel、company、title、type 另存明文列，用于筛选和排序；公司和标题在归档时写入
+    archived_fts (trigram) 索引，历史搜索按索引和日期索引查找，只解压最终返回的几行。
+    只有维护任务写入，用一个常驻连接；查询很少，每次临时打开只读连接。
+    """
+    def __init__(self, path=ARCHIVE_DB_PATH):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS archived_jobs (
+                    id TEXT PRIMARY KEY,
+                    date_ts INTEGER NOT NULL,
+                    channel TEXT,
+                    company TEXT,
+                    title TEXT,
+                    type TEXT,
+                    codec INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    archived_at INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_date_ts ON archived_jobs(date_ts, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_company ON archived_jobs(company)')
+            self._init_fts(conn)
+            self.conn = conn
+        return self.conn
+
+    @staticmethod
+    def _init_fts(conn):
+        """公司和标题的 trigram 索引，由触发器随 archived_jobs 的写入维护"""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_fts'").fetchone()
+        try:
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS archived_fts USING fts5(
+                    company, title, content='archived_jobs', content_rowid='rowid', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            log.warning(f"FTS5 不可用，归档搜索将使用 LIKE: {e}")
+            return
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS archived_fts_ai AFTER INSERT ON archived_jobs BEGIN
+                INSERT INTO archived_fts(rowid, company, title) VALUES (new.rowid, new.company, new.title);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS archived_fts_au AFTER UPDATE OF company, title ON archived_jobs BEGIN
+                INSERT INTO archived_fts(archived_fts, rowid, company, title)
+                VALUES ('delete', old.rowid, old.company, old.title);
+                INSERT INTO archived_fts(rowid, company, title) VALUES (new.rowid, new.company, new.title);
+            END
+        ''')
+        if not exists:
+            conn.execute("INSERT INTO archived_fts(archived_fts) VALUES ('rebuild')")
+
+    def store(self, jobs):
+        now = int(time.time())
+        rows = [(job['id'], job['date_ts'], job.get('channel'), job.get('company'), job.get('title'), job.get('type'),
+                 ARCHIVE_CODEC, _deflate_record(job), now)
+                for job in jobs]
+        with self.lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 上次归档到一半退出时这些行可能已经在归档库里，覆盖即可；
+                # 用 UPSERT 而不是 INSERT OR REPLACE，REPLACE 删除旧行时不触发 DELETE 触发器，索引会留下旧条目
+                conn.executemany('''
+                    INSERT INTO archived_jobs (id, date_ts, channel, company, title, type, codec, payload, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET date_ts = excluded.date_ts, channel = excluded.channel,
+                        company = excluded.company, title = excluded.title, type = excluded.type,
+                        codec = excluded.codec, payload = excluded.payload, archived_at = excluded.archived_at
+                ''', rows)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def reader(self):
+        uri = 'file:' + urllib.request.pathname2url(os.path.abspath(self.path)) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def load(self, job_ids):
+        """按 id 取归档的职位，返回 {id: job}"""
+        ids = list({str(jid) for jid in job_ids})
+        if not ids or not os.path.exists(self.path): return {}
+        jobs = {}
+        with self.reader() as conn:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for codec, payload in conn.execute(
+                        f"SELECT codec, payload FROM archived_jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                    job = json.loads(_inflate_text(codec, payload))
+                    job['archived'] = True
+                    jobs[job['id']] = job
+        return jobs
+
+    def search(self, terms, filters, limit, fields=SEARCH_FIELDS):
+        """历史搜索：每个词都要在公司或标题里出现，按日期倒序；结果格式与 search_jobs 相同
+
+        filters 只支持 ARCHIVE_FILTERS 里的条件。三个字符以上的词查 archived_fts，
+        更短的词对明文的公司/标题列做 LIKE，都不需要解压 payload。
+        """
+        if not os.path.exists(self.path): return []
+        where = ['1']
+        params = []
+        if filters.get('date_from'):
+            where.append('date_ts >= ?'); params.append(date_to_ts(filters['date_from']))
+        if filters.get('date_to'):
+            where.append('date_ts <= ?'); params.append(date_to_ts(filters['date_to']))
+        for name in ('type', 'company', 'channel'):
+            if filters.get(name):
+                where.append(f'{name} = ?'); params.append(filters[name])
+        with self.reader() as conn:
+            fts = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_fts'").fetchone()
+            long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LEN] if fts else []
+            if long_terms:
+                where.append('rowid IN (SELECT rowid FROM archived_fts WHERE archived_fts MATCH ?)')
+                params.append(' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms))
+            for term in terms:
+                if term in long_terms: continue
+                where.append("(company || ' ' || title) LIKE ? ESCAPE '\\'")
+                params.append(_like_pattern(term))
+            rows = conn.execute(f'''
+                SELECT codec, payload FROM archived_jobs WHERE {' AND '.join(where)}
+                ORDER BY date_ts DESC, id DESC LIMIT ?
+            ''', params + [limit]).fetchall()
+        results = []
+        for codec, payload in rows:
+            job = json.loads(_inflate_text(codec, payload))
+            result = {f: job.get(f) for f in fields}
+            result['title_highlight'] = _like_snippet(job['title'], terms[0], width=len(job['title'] or ''))
+            result['snippet'] = _like_snippet(job.get('raw_content'), terms[0])
+            result['score'] = None
+            result['archived'] = True
+            results.append(result)
+        return results
+
+archive_store = ArchiveStore()
+
+def archive_expired(days=RETENTION_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """把 date_ts 早于保留期的职位分批移到归档库，返回移动的行数
+
+    每批先在归档库提交，再从主库删除：两个文件的事务不是原子的，中途退出时最多在两边各留一份，
+    下次归档覆盖即可，不会丢数据。每批在主库上只是一个短写事务。
+    """
+    cutoff = days_ago_ts(days)
+    columns = JOB_FIELDS + ('date_ts', 'content_hash')
+    total = 0
+    while True:
+        with db_reader.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {', '.join(columns)} FROM jobs WHERE date_ts < ?
+                ORDER BY date_ts, id LIMIT ?
+            ''', (cutoff, batch_size)).fetchall()
+        if not rows: break
+        jobs = []
+        for row in rows:
+            job = dict(zip(columns, row))
+            job['tags'] = json.loads(job['tags']) if job['tags'] else []
+            jobs.append(job)
+        archive_store.store(jobs)
+        moved = job_writer.delete_archived([(job['id'], job['content_hash']) for job in jobs])
+        total += moved
+        ARCHIVED_JOBS.inc(moved)
+        if len(rows) < batch_size or not moved: break
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+    return total
+
+def cleanup_old_jobs(days=RETENTION_DAYS):
+    """把保留期之前的职位移到归档库，并清理汇总表和变更记录里的过期行"""
+    moved = archive_expired(days)
+    job_writer.prune()
+    return moved
+
+def run_maintenance():
+    """定期维护：归档过期职位，然后增量 VACUUM 并更新统计信息"""
+    with MAINTENANCE_SECONDS.time():
+        moved = cleanup_old_jobs(RETENTION_DAYS)
+        freed = job_writer.compact(INCREMENTAL_VACUUM_PAGES)
+    log.info(f"维护完成: 归档 {moved} 条，回收 {freed} 页")
+    set_scrape_state(STATE_LAST_MAINTENANCE, int(time.time()))
+    if moved:
+        refresh_snapshot()
+    return moved
+
+def maintenance_due_at():
+    return float(get_scrape_state(STATE_LAST_MAINTENANCE) or 0) + MAINTENANCE_INTERVAL
+
+def vacuum_full():
+    """切换到增量 VACUUM 并重建整个库；会长时间持有写锁，只在停机时通过 --vacuum 执行"""
+    job_writer.close()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+
+# ================= 响应缓存 =================
+# 同一数据版本内相同的查询结果不变，序列化和压缩只做一次，之后直接返回缓存的字节
+RESPONSE_CACHE_SIZE = 256
+MIN_COMPRESS_SIZE = 1024
+
+class CachedResponse:
+    """预先序列化的 JSON (或 MessagePack) 响应：原始字节、gzip/brotli 压缩版本和强 ETag"""
+    __slots__ = ('body', 'gzip', 'br', 'etag', 'mimetype')
+
+    def __init__(self, payload, encoding='json'):
+        if encoding == 'msgpack':
+            self.body = msgpack.packb(payload, use_bin_type=True)
+            self.mimetype = 'application/x-msgpack'
+        else:
+            self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self.mimetype = 'application/json'
+        # ETag 只取决于内容，数据版本变化但结果没变时客户端仍然可以拿到 304
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.gzip = self.br = None
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            self.gzip = gzip.compress(self.body, compresslevel=6)
+            if brotli is not None:
+                self.br = brotli.compress(self.body, quality=5)
+
+    def to_response(self):
+        if request.if_none_match.contains(self.etag):
+            resp = Response(status=304)
+        else:
+            body, encoding = self.body, None
+            accepted = request.accept_encodings
+            if self.br is not None and accepted['br']:
+                body, encoding = self.br, 'br'
+            elif self.gzip is not None and accepted['gzip']:
+                body, encoding = self.gzip, 'gzip'
+            resp = Response(body, mimetype=self.mimetype)
+            if encoding:
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(self.etag)
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+def data_version():
+    """jobs 表的数据版本，响应缓存的失效依据
+
+    缓存的响应由 jobs_payload 直接查库生成，所以要跟随数据库的写入而不是快照的重建；
+    用 job_changes 的最新版本，其他进程的写入也能让缓存失效。
+    """
+    return latest_change_version()
+
+class ResponseCache:
+    """按 (数据版本, 查询参数) 缓存响应，数据版本变化时整体作废"""
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self.version = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(arg_items):
+        # 默认回看天数按当天日期计算，跨天后同样的参数对应不同的结果
+        return (datetime.date.today().isoformat(),) + tuple(sorted(arg_items))
+
+    def get(self, version, key, build, encoding='json'):
+        with self.lock:
+            if self.version != version:
+                self.version, self.entries = version, {}
+            entry = self.entries.get(key)
+        if entry is None:
+            # 在锁外构建，并发请求同一查询时最多重复计算一次
+            entry = CachedResponse(build(), encoding)
+            with self.lock:
+                if self.version == version:
+                    if len(self.entries) >= self.size:
+                        self.entries.pop(next(iter(self.entries)))
+                    self.entries[key] = entry
+        return entry
+
+    def prime(self):
+        """写入后立即生成默认列表页，首个请求不必等待查询和压缩"""
+        try:
+            self.get(data_version(), self.key(()), lambda: jobs_payload(parse_job_query({})))
+        except Exception as e:
+            log.error(f"预生成默认响应失败: {e}")
+
+def jobs_payload(query, fmt='json'):
+    # 先取变更版本再查询：客户端从这个版本订阅变更，最多重放几条已经包含在结果里的变化
+    change_version = latest_change_version()
+    jobs, next_cursor = query_jobs(**query)
+    if fmt == 'json':
+        return {"jobs": jobs, "next_cursor": next_cursor, "change_version": change_version}
+    payload = columnar_jobs(jobs, query['fields'])
+    payload.update({"next_cursor": next_cursor, "change_version": change_version})
+    return payload
+
+# 列表接口的输出格式：json 是对象数组；columnar 按列输出，字段名只出现一次；
+# msgpack 与 columnar 结构相同，用 MessagePack 编码 (需要安装 msgpack)
+LIST_FORMATS = ('json', 'columnar', 'msgpack')
+# 列式格式里做字典编码的字段：取值重复多，字符串只在 dicts 里出现一次，行里只存下标
+DICT_ENCODED_FIELDS = frozenset(['company', 'title', 'type', 'tags', 'location', 'channel', 'work_mode',
+                                 'salary_currency', 'salary_period'])
+
+def parse_list_format(args):
+    fmt = args.get('format') or 'json'
+    if fmt not in LIST_FORMATS:
+        raise ValueError(f"format 只能是 {'/'.join(LIST_FORMATS)}")
+    if fmt == 'msgpack' and msgpack is None:
+        raise ValueError("服务器未安装 msgpack，请使用 format=columnar")
+    return fmt
+
+def columnar_jobs(jobs, fields):
+    """把职位列表转成列式：columns[i] 是 fields[i] 这一列；字典编码的列存 dicts[字段] 的下标，
+    tags 每行是下标数组，None 保持为 null"""
+    columns = []
+    dicts = {}
+    for field in fields:
+        if field not in DICT_ENCODED_FIELDS:
+            columns.append([job[field] for job in jobs])
+            continue
+        values = []
+        index = {}
+        def code(value):
+            if value is None: return None
+            i = index.get(value)
+            if i is None:
+                i = index[value] = len(values)
+                values.append(value)
+            return i
+        if field == 'tags':
+            columns.append([[code(tag) for tag in job['tags']] for job in jobs])
+        else:
+            columns.append([code(job[field]) for job in jobs])
+        dicts[field] = values
+    return {"format": "columnar", "fields": list(fields), "count": len(jobs), "columns": columns, "dicts": dicts}
+
+response_cache = ResponseCache()
+# facets 的参数空间与列表页不同，单独一个缓存，同样随数据版本作废
+facets_cache = ResponseCache(size=64)
+
+
+# ================= 智能解析逻辑 =================
+# 所有正则和关键词表在模块加载时编译一次，解析时只对正文做一遍逐行扫描
+HASHTAG_RE = re.compile(r'[#＃]([\w\-\.\+\u4e00-\u9fa5]+)')
+EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+\.[a-zA-Z]+')
+COMPANY_LINE_RE = re.compile(r'^(?:项目|Project|公司|Company|Team)\s*[:：]\s*(.+)', re.IGNORECASE)
+CLEAN_HASHTAG_RE = re.compile(r'[#＃].*')
+CLEAN_SYMBOL_RE = re.compile(r'[^\w\s\u4e00-\u9fa5:：\.\-\(\)\+]')
+CLEAN_PREFIX_RE = re.compile(r'^[【\[]?(?:招聘|岗位|职位|Job|Hiring|Position)[\]】]?[:：]?\s*', re.IGNORECASE)
+SALARY_KEYWORD_RE = re.compile(r'薪资|待遇|Salary|Pay|U|\$')
+DIGIT_RE = re.compile(r'\d')
+NUMBER_RE = re.compile(r'(\d+)')
+
+SALARY_AMOUNT_RE = re.compile(
+    r'(\d+(?:\.\d+)?)\s*([kKwW万千]?)(?:\s*(?:-|~|～|—|–|至|到)\s*(\d+(?:\.\d+)?)\s*([kKwW万千]?))?')
+SALARY_MULTIPLIERS = {'': 1, 'k': 1000, 'K': 1000, '千': 1000, 'w': 10000, 'W': 10000, '万': 10000}
+# 顺序有意义：usdt 要先于 usd 判断
+SALARY_CURRENCY_PATTERNS = [
+    ('USDT', re.compile(r'usdt|usdc|\d\s*[kw万]?\s*u(?![a-z])')),
+    ('USD', re.compile(r'\$|usd|美金|美元|dollar')),
+    ('HKD', re.compile(r'hkd|港币')),
+    ('EUR', re.compile(r'€|eur')),
+    ('SGD', re.compile(r'sgd|新币')),
+    ('CNY', re.compile(r'¥|￥|rmb|cny|人民币|元')),
+]
+SALARY_PERIOD_PATTERNS = [
+    ('hour', re.compile(r'时薪|小时|/\s*h(?:ou)?r|per\s*hour|hourly')),
+    ('day', re.compile(r'日薪|/\s*[天日]|per\s*day|/\s*day|daily')),
+    ('week', re.compile(r'周薪|/\s*周|per\s*week|/\s*week|weekly')),
+    ('year', re.compile(r'年薪|/\s*年|每年|per\s*(?:year|annum)|/\s*y(?:ea)?r|annual|年包')),
+]
+LOCATION_LINE_RE = re.compile(r'^(?:工作|办公)?(?:地点|地址|坐标|城市|地区)\s*[:：]\s*(.+)|^(?:location|base|based in)\s*[:：]?\s*(.+)', re.IGNORECASE)
+REMOTE_RE = re.compile(r'远程|remote|wfh|居家|在家办公|work from home|anywhere', re.IGNORECASE)
+HYBRID_RE = re.compile(r'混合|hybrid', re.IGNORECASE)
+ONSITE_RE = re.compile(r'现场|坐班|线下办公|onsite|on-site|in office|办公室', re.IGNORECASE)
+MAX_LOCATION_LEN = 40
+
+JOB_KEYWORDS = ["工程师", "运营", "市场", "实习生", "BD", "专员", "经理", "设计师", "交易员", "负责人"]
+BLACKLIST_TAGS = ["research", "socialfi", "defi", "web3", "crypto", "blockchain", "gamefi", "nft", "dao", "headhunter", "recruiter", "hiring", "job", "fulltime", "parttime", "remote", "apply", "work", "career", "talent", "exchange", "wallet", "public", "chain", "infrastructure"]
+INVALID_COMPANY_NAMES = frozenset(["简介", "介绍", "岗位", "职责", "要求", "福利", "待遇", "关于我们", "About", "Intro", "Description", "Requirements", "Welcome"])
+# 标签是否包含任一关键词 (子串匹配)：合并成一个交替正则，由正则引擎一次扫描完成
+JOB_KEYWORD_RE = re.compile('|'.join(re.escape(k.lower()) for k in JOB_KEYWORDS))
+BLACKLIST_TAG_RE = re.compile('|'.join(re.escape(k) for k in BLACKLIST_TAGS))
+
+class JobParser:
+    @staticmethod
+    def clean_string(text):
+        if not text: return ""
+        text = CLEAN_HASHTAG_RE.sub('', text)
+        text = CLEAN_SYMBOL_RE.sub('', text)
+        text = CLEAN_PREFIX_RE.sub('', text)
+        return text.strip()
+
+    @staticmethod
+    def is_salary_line(line):
+        return len(line) < 50 and SALARY_KEYWORD_RE.search(line) is not None and DIGIT_RE.search(line) is not None
+
+    @staticmethod
+    def extract_max_salary(raw_text):
+        target_line = next((line for line in raw_text.split('\n') if JobParser.is_salary_line(line)), "")
+        return JobParser.salary_from_line(target_line)
+
+    @staticmethod
+    def salary_from_line(target_line):
+        if not target_line: return "面议"
+        numbers = NUMBER_RE.findall(target_line)
+        if not numbers: return target_line
+        lower_line = target_line.lower()
+        has_k = 'k' in lower_line
+        valid_nums = [n for n in map(int, numbers) if (n > 100 and n < 100000) or (n < 100 and has_k)]
+        if not valid_nums: return target_line
+        max_val = max(valid_nums)
+        unit = ""
+        if "u" in lower_line: unit = "U"
+        elif "$" in target_line: unit = "$"
+        elif has_k: unit = "k"
+        if unit == "k" and max_val < 1000: return f"{max_val}k"
+        return f"{max_val}{unit}"
+
+    @staticmethod
+    def salary_fields(target_line):
+        """把薪资行解析成数值区间：{'salary_min', 'salary_max', 'salary_currency', 'salary_period'}，面议时均为 None"""
+        fields = {'salary_min': None, 'salary_max': None, 'salary_currency': None, 'salary_period': None}
+        if not target_line: return fields
+        lower_line = target_line.lower()
+        currency = next((code for code, pattern in SALARY_CURRENCY_PATTERNS if pattern.search(lower_line)), None)
+        for match in SALARY_AMOUNT_RE.finditer(target_line):
+            low, low_unit, high, high_unit = match.groups()
+            # "15-25K" 的单位只写在后一个数上
+            if high is not None and not low_unit: low_unit = high_unit
+            values = [float(low) * SALARY_MULTIPLIERS[low_unit]]
+            if high is not None: values.append(float(high) * SALARY_MULTIPLIERS[high_unit])
+            # 没有单位也没有币种的两位数 (如 "14薪"、"3年") 不是薪资；"$50/hour" 是
+            if not (low_unit or high_unit or currency) and max(values) <= 100: continue
+            fields['salary_min'], fields['salary_max'] = min(values), max(values)
+            break
+        if fields['salary_max'] is None: return fields
+        fields['salary_currency'] = currency or DEFAULT_SALARY_CURRENCY
+        fields['salary_period'] = next(
+            (period for period, pattern in SALARY_PERIOD_PATTERNS if pattern.search(lower_line)), 'month')
+        return fields
+
+    @staticmethod
+    def location_fields(raw_text, hashtags):
+        """地点行 (工作地点：/Location:) 和远程/混合/现场标记，返回 {'location', 'is_remote', 'work_mode'}"""
+        location = None
+        for line in raw_text.split('\n'):
+            match = LOCATION_LINE_RE.match(line.strip())
+            if match:
+                location = (match.group(1) or match.group(2)).strip()[:MAX_LOCATION_LEN]
+                break
+        text = raw_text + ' ' + ' '.join(hashtags)
+        if HYBRID_RE.search(text): work_mode = 'hybrid'
+        elif REMOTE_RE.search(text): work_mode = 'remote'
+        elif location or ONSITE_RE.search(text): work_mode = 'onsite'
+        else: work_mode = None
+        if not location:
+            location = {'remote': '远程', 'hybrid': '混合'}.get(work_mode, '')
+        return {'location': location, 'is_remote': 1 if work_mode == 'remote' else 0, 'work_mode': work_mode}
+
+    @staticmethod
+    def structured_fields(raw_text, hashtags, salary_line):
+        fields = JobParser.salary_fields(salary_line)
+        fields['salary_usd_month'] = salary_usd_month(
+            fields['salary_max'], fields['salary_currency'], fields['salary_period'])
+        fields.update(JobParser.location_fields(raw_text, hashtags))
+        return fields
+
+    @staticmethod
+    def title_from_tags(hashtags):
+        for tag in hashtags:
+            tag_lower = tag.lower()
+            if BLACKLIST_TAG_RE.search(tag_lower): continue
+            if JOB_KEYWORD_RE.search(tag_lower): return tag
+        return None
+
+    @staticmethod
+    def scan_lines(raw_text):
+        """一遍扫描正文，同时找出公司名 (显式 "项目/Company:" 行优先，否则取第一条合适的短行)、薪资行和邮箱"""
+        labeled_company = None
+        fallback_company = None
+        salary_line = None
+        email = None
+        for raw_line in raw_text.split('\n'):
+            # 薪资行按未 strip 的原始行判断长度
+            if salary_line is None and JobParser.is_salary_line(raw_line):
+                salary_line = raw_line
+            if email is None:
+                email_match = EMAIL_RE.search(raw_line)
+                if email_match: email = email_match.group(0)
+            line = raw_line.strip()
+            if not line: continue
+            if labeled_company is None:
+                company_match = COMPANY_LINE_RE.match(line)
+                if company_match:
+                    labeled_company = JobParser.clean_string(company_match.group(1))
+            # 显式公司行清洗后可能为空，此时仍按第一条合适的短行兜底
+            if (not labeled_company and fallback_company is None and len(line) < 40
+                    and line[0] not in '#＃' and "招聘" not in line):
+                cleaned_line = JobParser.clean_string(line)
+                if cleaned_line not in INVALID_COMPANY_NAMES and len(cleaned_line) >= 2:
+                    fallback_company = cleaned_line
+            company_done = labeled_company or (labeled_company == "" and fallback_company is not None)
+            if company_done and salary_line is not None and email is not None:
+                break
+        return (labeled_company or fallback_company), salary_line, email
+
+    @staticmethod
+    def extract_post_id(msg_div):
+        """t.me/s 页面把 "频道/序号" 放在内层 tgme_widget_message 的 data-post 上，外层 wrap 没有该属性"""
+        post_id = msg_div.get('data-post-id') or msg_div.get('data-post')
+        if not post_id:
+            inner = msg_div.find(attrs={'data-post': True})
+            if inner: post_id = inner.get('data-post')
+        return post_id
+
+    @staticmethod
+    def parse_html_message(msg_div):
+        """解析 BeautifulSoup 的 tgme_widget_message_wrap 节点"""
+        return JobParser.parse_message(bs4_message_record(msg_div))
+
+    @staticmethod
+    def parse_message(record):
+        """解析一条 MessageRecord (与 HTML 解析引擎无关)，不是招聘信息时返回 None"""
+        try:
+            raw_text = record.text
+            if raw_text is None or ("#招聘" not in raw_text and "＃招聘" not in raw_text):
+                PARSE_MESSAGES.inc(result='skipped')
+                return None
+
+            date_str = datetime.date.today().strftime("%Y-%m-%d")
+            if record.datetime is not None:
+                date_str = record.datetime.split('T')[0]
+
+            hashtags = HASHTAG_RE.findall(raw_text)
+            unique_id = record.post_id
+            if not unique_id:
+                unique_id = f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+
+            job_data = {
+                "id": unique_id,
+                "channel": post_channel(unique_id),
+                "date": date_str,
+                "raw_content": raw_text,
+                "tags": hashtags,
+                "type": "全职",
+                "location": "",
+                "email": "",
+                "company": "",
+                "title": ""
+            }
+
+            company, salary_line, email = JobParser.scan_lines(raw_text)
+            job_data["company"] = company if company else "其他项目"
+            job_data["title"] = JobParser.title_from_tags(hashtags) or "其他"
+            job_data["salary"] = JobParser.salary_from_line(salary_line)
+            job_data["email"] = email or ""
+            job_data.update(JobParser.structured_fields(raw_text, hashtags, salary_line))
+
+            for tag in hashtags:
+                if "兼职" in tag: job_data["type"] = "兼职"
+                if "实习" in tag: job_data["type"] = "实习"
+                if "外包" in tag or "项目" in tag: job_data["type"] = "项目制"
+
+            PARSE_MESSAGES.inc(result='job')
+            return job_data
+        except Exception as e:
+            PARSE_MESSAGES.inc(result='error')
+            log.debug(f"消息解析失败: {e}", extra={'post_id': record.post_id})
+            return None
+
+# ================= HTML 解析引擎 =================
+# 每条消息只需要三样东西：消息 id、正文文本 (<br> 转成换行)、发布时间。
+# 各解析引擎只负责从页面中抽出这些字段，后续的招聘信息解析 (JobParser.parse_message) 完全相同。
+MessageRecord = namedtuple('MessageRecord', ['post_id', 'text', 'datetime'])
+# auto: 安装了 lxml 就用 lxml 流式解析，否则退回 BeautifulSoup(html.parser)
+HTML_PARSER_BACKEND = os.environ.get("HTML_PARSER_BACKEND", "auto")
+
+def bs4_message_record(msg_div):
+    text_div = msg_div.find('div', class_='tgme_widget_message_text')
+    text = None
+    if text_div:
+        for br in text_div.find_all("br"): br.replace_with("\n")
+        text = text_div.get_text()
+    date_attr = None
+    time_span = msg_div.find('a', class_='tgme_widget_message_date')
+    if time_span:
+        time_tag = time_span.find('time')
+        if time_tag and time_tag.has_attr('datetime'):
+            date_attr = time_tag['datetime']
+    return MessageRecord(JobParser.extract_post_id(msg_div), text, date_attr)
+
+def parse_page_bs4(chunks):
+    """返回 ([MessageRecord], 是否还有更新的消息)"""
+    soup = BeautifulSoup(''.join(chunks), 'html.parser')
+    records = [bs4_message_record(div) for div in soup.find_all('div', class_='tgme_widget_message_wrap')]
+    has_newer = soup.find('a', class_='tme_messages_more', attrs={'data-after': True}) is not None
+    return records, has_newer
+
+def _lxml_has_class(el, name):
+    return name in (el.get('class') or '').split()
+
+def _lxml_text(el, parts):
+    """与 BeautifulSoup.get_text() 一致：按文档顺序拼接文本节点，<br> 输出换行，跳过注释"""
+    if isinstance(el.tag, str):
+        if el.tag == 'br':
+            parts.append('\n')
+        elif el.text:
+            parts.append(el.text)
+        for child in el:
+            _lxml_text(child, parts)
+            if child.tail: parts.append(child.tail)
+
+def lxml_message_record(wrap):
+    text = None
+    date_attr = None
+    post_id = wrap.get('data-post-id') or wrap.get('data-post')
+    for el in wrap.iter():
+        if not isinstance(el.tag, str): continue
+        if text is None and el.tag == 'div' and _lxml_has_class(el, 'tgme_widget_message_text'):
+            parts = []
+            _lxml_text(el, parts)
+            text = ''.join(parts)
+        elif post_id is None and el.get('data-post'):
+            post_id = el.get('data-post')
+        elif date_attr is None and el.tag == 'a' and _lxml_has_class(el, 'tgme_widget_message_date'):
+            time_tag = next(el.iter('time'), None)
+            if time_tag is not None and time_tag.get('datetime') is not None:
+                date_attr = time_tag.get('datetime')
+    return MessageRecord(post_id, text, date_attr)
+
+def parse_page_lxml(chunks):
+    """lxml 增量解析：每个 tgme_widget_message_wrap 结束时立即抽取字段并释放该子树，不保留整棵文档树"""
+    parser = lxml_etree.HTMLPullParser(events=('end',), tag=('div', 'a'))
+    records = []
+    has_newer = False
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, el in parser.read_events():
+            if el.tag == 'a':
+                if _lxml_has_class(el, 'tme_messages_more') and el.get('data-after') is not None:
+                    has_newer = True
+            elif _lxml_has_class(el, 'tgme_widget_message_wrap'):
+                records.append(lxml_message_record(el))
+                el.clear()
+                parent = el.getparent()
+                while parent is not None and el.getprevious() is not None:
+                    del parent[0]
+    parser.close()
+    return records, has_newer
+
+PARSER_BACKENDS = {'html.parser': parse_page_bs4}
+if lxml_etree is not None:
+    PARSER_BACKENDS['lxml'] = parse_page_lxml
+
+def get_parser_backend(name=None):
+    name = name or HTML_PARSER_BACKEND
+    if name == 'auto':
+        name = 'lxml' if 'lxml' in PARSER_BACKENDS else 'html.parser'
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"未知或未安装的解析引擎: {name}")
+    return PARSER_BACKENDS[name]
+
+# ================= HTTP 抓取层 =================
+# 令牌桶限速：平均每秒 SCRAPE_RATE 个请求，允许 SCRAPE_BURST 个突发
+SCRAPE_RATE = float(os.environ.get("SCRAPE_RATE", "1.0"))
+SCRAPE_BURST = int(os.environ.get("SCRAPE_BURST", "4"))
+SCRAPE_CONCURRENCY = int(os.environ.get("SCRAPE_CONCURRENCY", "4"))
+FETCH_MAX_RETRIES = 4
+FETCH_BACKOFF_BASE = 1.0
+FETCH_BACKOFF_MAX = 30.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+NOT_MODIFIED = object()
+
+class FetchError(Exception):
+    pass
+
+class TokenBucket:
+    """线程安全的令牌桶，acquire() 阻塞到拿到令牌为止"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """不阻塞：拿到令牌返回 0，否则返回还需等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """服务端要求降速时清空令牌，seconds 秒内不再发放"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait: return
+            time.sleep(wait)
+
+class PageFetcher:
+    """复用连接池的抓取器：令牌桶限速、有界并发、指数退避+抖动重试、条件请求"""
+    def __init__(self, rate=SCRAPE_RATE, burst=SCRAPE_BURST, concurrency=SCRAPE_CONCURRENCY, timeout=15):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"User-Agent": "Mozilla/5.0"})
+        self.limiter = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fetch')
+        self.timeout = timeout
+        # url -> (ETag, Last-Modified)
+        self.validators = {}
+        self.validators_lock = threading.Lock()
+
+    def fetch(self, url, conditional=False):
+        """返回页面文本；conditional=True 且服务器返回 304 时返回 NOT_MODIFIED；重试耗尽抛出 FetchError"""
+        result = 'error'
+        started = time.perf_counter()
+        try:
+            text = self._fetch(url, conditional)
+            result = 'not_modified' if text is NOT_MODIFIED else 'ok'
+            return text
+        finally:
+            FETCH_SECONDS.observe(time.perf_counter() - started, result=result)
+
+    def _fetch(self, url, conditional):
+        headers = {}
+        if conditional:
+            with self.validators_lock:
+                etag, last_modified = self.validators.get(url, (None, None))
+            if etag: headers['If-None-Match'] = etag
+            if last_modified: headers['If-Modified-Since'] = last_modified
+
+        last_error = None
+        for attempt in range(FETCH_MAX_RETRIES + 1):
+            if attempt:
+                FETCH_RETRIES.inc()
+                # full jitter: 在 [0, min(上限, base*2^n)] 之间随机等待，避免重试扎堆
+                delay = random.uniform(0, min(FETCH_BACKOFF_MAX, FETCH_BACKOFF_BASE * 2 ** attempt))
+                retry_after = getattr(last_error, 'retry_after', None)
+                time.sleep(max(delay, retry_after or 0))
+            self.limiter.acquire()
+            try:
+                resp = self.session.get(url, headers=headers, proxies=PROXY, timeout=self.timeout)
+            except requests.RequestException as e:
+                last_error = e
+                continue
+            if resp.status_code == 304:
+                return NOT_MODIFIED
+            if resp.status_code == 200:
+                if conditional:
+                    with self.validators_lock:
+                        self.validators[url] = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+                return resp.text
+            last_error = FetchError(f"HTTP {resp.status_code}: {url}")
+            if resp.status_code not in RETRY_STATUS:
+                break
+            retry_after = resp.headers.get('Retry-After', '')
+            last_error.retry_after = min(float(retry_after), FETCH_BACKOFF_MAX) if retry_after.isdigit() else None
+        raise FetchError(f"抓取失败 {url}: {last_error}")
+
+    def fetch_many(self, urls):
+        """并发抓取多页，按输入顺序返回 [文本或异常]；并发度与速率分别受线程池和令牌桶约束"""
+        def _fetch(url):
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                return e
+        return list(self.executor.map(_fetch, urls))
+
+# ================= 爬虫服务 =================
+# 增量抓取的高水位 (已入库的最大 data-post-id 序号) 和回填进度都记录在 scrape_state 表，键带频道后缀
+STATE_LAST_POST_ID = 'last_post_id'
+STATE_BACKFILL_BEFORE = 'backfill_before'
+STATE_SALARY_RATES = 'salary_rates'
+BACKFILL_DONE = 'done'
+# 首次抓取 (还没有高水位) 时最多向前翻的页数
+INITIAL_MAX_PAGES = 5
+# 增量抓取时单次最多向后翻的页数，防止异常情况下死循环
+INCREMENTAL_MAX_PAGES = 50
+# t.me/s 每页 20 条消息；回填时按这个步长预测后续页的 before 游标并发抓取
+PAGE_SPAN = 20
+
+def post_channel(post_id):
+    """data-post-id 中的频道名，没有频道前缀时返回 None"""
+    if not post_id or '/' not in post_id: return None
+    return post_id.split('/', 1)[0] or None
+
+def post_number(post_id):
+    """data-post-id 形如 "DeJob_official/12345"，取出其中的消息序号"""
+    if not post_id: return None
+    tail = str(post_id).rsplit('/', 1)[-1]
+    return int(tail) if tail.isdigit() else None
+
+class WebScraper:
+    """一个频道的抓取器；多个频道共享同一个 PageFetcher，也就共享它的令牌桶 (全局速率预算)"""
+    def __init__(self, channel=CHANNEL_USERNAME, fetcher=None, parser_backend=None):
+        self.channel = channel
+        self.base_url = f"https://t.me/s/{channel}"
+        self.fetcher = fetcher or PageFetcher()
+        self.parse_backend = get_parser_backend(parser_backend)
+
+    def state_key(self, key):
+        return f"{key}:{self.channel}"
+
+    def fetch_page(self, url, conditional=True):
+        """抓取并解析一页，返回 (posts, has_newer)；posts 为 [(消息序号, job 或 None)]
+
+        页面未变化 (304) 时返回 ([], False)，请求失败抛出 FetchError。
+        """
+        html = self.fetcher.fetch(url, conditional=conditional)
+        if html is NOT_MODIFIED: return [], False
+        return self.parse_page(html)
+
+    def parse_page(self, html):
+        return self.parse_page_with(self.parse_backend, html)
+
+    @staticmethod
+    def parse_page_with(backend, html):
+        with PARSE_PAGE_SECONDS.time(backend=backend.__name__):
+            records, has_newer = backend([html])
+        posts = []
+        for record in records:
+            job = JobParser.parse_message(record)
+            if job and not (job['email'] or len(job['raw_content']) > 20): job = None
+            posts.append((post_number(record.post_id), job))
+        return posts, has_newer
+
+    def fetch_jobs(self, lookback_days=60):
+        return self.poll(lookback_days)['jobs']
+
+    def poll(self, lookback_days=60):
+        """抓取入口：有高水位时只取更新的消息，否则按 lookback_days 做首次抓取
+
+        返回 {'jobs': 新职位, 'posts': 高水位之后新出现的消息数, 'error': 抓取出错时的错误信息}
+        """
+        last_post_id = get_scrape_state(self.state_key(STATE_LAST_POST_ID))
+        if last_post_id is None:
+            all_jobs, max_seen, error = self._fetch_initial(lookback_days)
+        else:
+            all_jobs, max_seen, error = self._fetch_incremental(int(last_post_id))
+        log.info(f"[{self.channel}] 抓取结束，共 {len(all_jobs)} 条新数据")
+        # 首次抓取没有基准，不计入发帖速率
+        posts = max_seen - int(last_post_id) if last_post_id is not None and max_seen is not None else 0
+
+        # 保存到数据库，入库成功后才推进高水位
+        try:
+            if all_jobs:
+                counts = save_jobs_to_db(all_jobs)
+                log.info(f"[{self.channel}] 已保存到数据库: 新增 {counts['inserted']} / 更新 {counts['updated']} / 未变 {counts['unchanged']}")
+                if counts['inserted'] or counts['updated']:
+                    # 只重读 job_changes 里记录的变化职位，合并进快照
+                    refresh_snapshot()
+            if max_seen is not None and (last_post_id is None or max_seen > int(last_post_id)):
+                set_scrape_state(self.state_key(STATE_LAST_POST_ID), max_seen)
+        except Exception as e:
+            log.error(f"数据库保存失败: {e}")
+            error = f"数据库保存失败: {e}"
+
+        return {'jobs': all_jobs, 'posts': posts, 'error': error}
+
+    def _fetch_initial(self, lookback_days):
+        log.info(f"启动 Web 抓取: {self.base_url}")
+        all_jobs = []
+        max_seen = None
+        error = None
+        target_url = self.base_url
+        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=lookback_days)
+
+        for page in range(INITIAL_MAX_PAGES):
+            try:
+                log.debug(f"请求第 {page+1} 页...")
+                posts, _ = self.fetch_page(target_url)
+                if not posts: break
+                numbers = [n for n, _ in posts if n is not None]
+                if numbers: max_seen = max([max_seen or 0] + numbers)
+                page_jobs = []
+                reached_cutoff = False
+                for _, job in reversed(posts):
+                    if not job: continue
+                    if job['date']:
+                        try:
+                            d = datetime.datetime.strptime(job['date'], "%Y-%m-%d")
+                            if d < cutoff_date:
+                                reached_cutoff = True
+                                break
+                        except: pass
+                    page_jobs.append(job)
+                all_jobs.extend(page_jobs)
+                log.debug(f"解析到 {len(page_jobs)} 个职位")
+                if reached_cutoff or not numbers: break
+                target_url = f"{self.base_url}?before={min(numbers)}"
+            except Exception as e:
+                log.warning(f"[{self.channel}] 抓取出错: {e}")
+                error = str(e)
+                break
+        return all_jobs, max_seen, error
+
+    def _fetch_incremental(self, last_post_id):
+        """从高水位往后取 (?after=)，直到没有更新的消息；稳态下只需要一次请求"""
+        log.info(f"增量抓取: {self.base_url} (after={last_post_id})")
+        all_jobs = []
+        max_seen = last_post_id
+        error = None
+        for page in range(INCREMENTAL_MAX_PAGES):
+            try:
+                posts, has_newer = self.fetch_page(f"{self.base_url}?after={max_seen}")
+                if not posts: break
+                new_posts = [(n, job) for n, job in posts if n is not None and n > max_seen]
+                if not new_posts: break
+                page_jobs = [job for _, job in new_posts if job]
+                all_jobs.extend(page_jobs)
+                max_seen = max(n for n, _ in new_posts)
+                log.debug(f"第 {page+1} 页解析到 {len(page_jobs)} 个新职位")
+                # 页面上还有 "加载更新消息" 的链接时才继续；判断失误也只是留到下一轮再取
+                if not has_newer: break
+            except Exception as e:
+                log.warning(f"[{self.channel}] 抓取出错: {e}")
+                error = str(e)
+                break
+        return all_jobs, max_seen, error
+
+    def backfill(self, reset=False, workers=None):
+        """显式回填全部历史消息：不限页数，按批入库并记录进度，中断后可从断点继续"""
+        return BackfillPipeline(self, workers=workers).run(reset=reset)
+
+# ================= 回填流水线 =================
+# 抓取 (线程) -> 解析 (进程池) -> 写库 (单线程)，各阶段之间用有界队列连接形成背压
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 2)))
+PIPELINE_QUEUE_SIZE = 32
+WRITE_BATCH_SIZE = 500
+POST_ID_RE = re.compile(r'data-post(?:-id)?="([^"]+)"')
+_PIPELINE_DONE = object()
+
+def parse_page_worker(page_html, backend_name, keep_below):
+    """进程池中执行：解析一页并只保留序号小于 keep_below 的职位 (与前一页重叠的部分已入库)
+
+    返回 (jobs, 解析耗时)，耗时用于统计解析阶段的实际工作量。
+    """
+    started = time.perf_counter()
+    posts, _ = WebScraper.parse_page_with(get_parser_backend(backend_name), page_html)
+    jobs = [job for number, job in posts if job and number is not None and number < keep_below]
+    for job in jobs:
+        job['minhash'] = job_minhash(job['raw_content'])
+    return jobs, time.perf_counter() - started
+
+class StageStats:
+    """单个阶段的吞吐计数"""
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def summary(self, wall):
+        rate = self.items / wall if wall > 0 else 0
+        return f"{self.name}: {self.items} {self.unit} ({rate:.1f}/s，忙碌 {self.busy:.1f}s)"
+
+class BackfillPipeline:
+    """回填流水线
+
+    抓取阶段按 PAGE_SPAN 步长预测 before 游标并发抓取一个窗口，只用正则取出消息序号来判断
+    是否出现空洞、是否已到频道开头；解析阶段把页面交给进程池，不和 Flask 进程争抢 GIL；
+    写库阶段按提交顺序取回结果，攒够一批写入一次，写入成功后才推进断点。
+    """
+    def __init__(self, scraper, workers=None):
+        self.scraper = scraper
+        self.workers = workers or PARSE_WORKERS
+        self.backend_name = next(name for name, fn in PARSER_BACKENDS.items() if fn is scraper.parse_backend)
+        self.pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.results = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.error = None
+        self.finished = False
+        self.stats = {
+            'fetch': StageStats('抓取', '页'),
+            'parse': StageStats('解析', '页'),
+            'write': StageStats('写库', '条'),
+        }
+        self.write_counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def run(self, reset=False):
+        if reset:
+            set_scrape_state(self.scraper.state_key(STATE_BACKFILL_BEFORE), None)
+        before = get_scrape_state(self.scraper.state_key(STATE_BACKFILL_BEFORE))
+        if before == BACKFILL_DONE:
+            log.info("历史回填已完成 (使用 --backfill-reset 重新开始)")
+            return 0
+        before = int(before) if before is not None else None
+        self.from_top = before is None
+
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            stages = [
+                threading.Thread(target=self._fetch_stage, args=(before,), name='backfill-fetch'),
+                threading.Thread(target=self._parse_stage, args=(pool,), name='backfill-parse'),
+            ]
+            for stage in stages: stage.start()
+            try:
+                total = self._write_stage()
+            finally:
+                self.stop.set()
+                for stage in stages: stage.join()
+
+        wall = time.monotonic() - started
+        for stat in self.stats.values():
+            log.info(f"{stat.summary(wall)}")
+        log.info(f"新增 {self.write_counts['inserted']} / 更新 {self.write_counts['updated']} / 未变 {self.write_counts['unchanged']}")
+        if self.write_counts['inserted'] or self.write_counts['updated']:
+            refresh_snapshot()
+        if self.error:
+            log.warning(f"回填中断: {self.error}，下次将从断点继续")
+        elif self.finished:
+            set_scrape_state(self.scraper.state_key(STATE_BACKFILL_BEFORE), BACKFILL_DONE)
+            log.info(f"历史回填完成，共 {total} 条")
+        return total
+
+    def _put(self, q, item):
+        """阻塞写入有界队列 (背压)，流水线停止时放弃"""
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch_stage(self, before):
+        fetcher = self.scraper.fetcher
+        base_url = self.scraper.base_url
+        try:
+            while not self.stop.is_set():
+                if before is None:
+                    cursors = [None]
+                else:
+                    cursors = [before - i * PAGE_SPAN for i in range(fetcher.concurrency * 2)
+                               if before - i * PAGE_SPAN > 1]
+                urls = [base_url if c is None else f"{base_url}?before={c}" for c in cursors]
+                started = time.monotonic()
+                pages = fetcher.fetch_many(urls)
+                self.stats['fetch'].add(len(pages), time.monotonic() - started)
+
+                for i, page_html in enumerate(pages):
+                    if isinstance(page_html, Exception):
+                        self.error = page_html
+                        return
+                    numbers = [post_number(m) for m in POST_ID_RE.findall(page_html)]
+                    numbers = [n for n in numbers if n is not None and (before is None or n < before)]
+                    if not numbers:
+                        self.finished = True
+                        return
+                    keep_below = before if before is not None else max(numbers) + 1
+                    before = min(numbers)
+                    if not self._put(self.pages, (page_html, keep_below, before, max(numbers))):
+                        return
+                    if before <= 1:
+                        self.finished = True
+                        return
+                    # 实际覆盖不到下一个预测游标，说明中间有空洞，丢弃窗口剩余结果
+                    if i + 1 < len(cursors) and before > cursors[i + 1]:
+                        break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self.pages, _PIPELINE_DONE)
+
+    def _parse_stage(self, pool):
+        try:
+            while not self.stop.is_set():
+                try:
+                    item = self.pages.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is _PIPELINE_DONE: break
+                page_html, keep_below, checkpoint, max_number = item
+                future = pool.submit(parse_page_worker, page_html, self.backend_name, keep_below)
+                if not self._put(self.results, (future, checkpoint, max_number)):
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self.results, _PIPELINE_DONE)
+
+    def _write_stage(self):
+        total = 0
+        batch = []
+        checkpoint = None
+        high_water = None
+
+        def flush():
+            nonlocal batch
+            if batch:
+                started = time.monotonic()
+                counts = save_jobs_to_db(batch)
+                self.stats['write'].add(len(batch), time.monotonic() - started)
+                for key, value in counts.items(): self.write_counts[key] += value
+            # 这一批之前的页全部入库后才推进断点，中断后最多重复抓取一批
+            if checkpoint is not None:
+                set_scrape_state(self.scraper.state_key(STATE_BACKFILL_BEFORE), checkpoint)
+            batch = []
+
+        while True:
+            try:
+                item = self.results.get(timeout=0.5)
+            except queue.Empty:
+                if self.stop.is_set(): break
+                continue
+            if item is _PIPELINE_DONE: break
+            future, page_checkpoint, max_number = item
+            try:
+                jobs, parse_seconds = future.result()
+            except Exception as e:
+                self.error = e
+                self.finished = False
+                break
+            self.stats['parse'].add(1, parse_seconds)
+            batch.extend(jobs)
+            total += len(jobs)
+            checkpoint = page_checkpoint
+            if high_water is None:
+                high_water = max_number
+            if len(batch) >= WRITE_BATCH_SIZE:
+                flush()
+                log.debug(f"已入库 {total} 条，进度 before={checkpoint}")
+
+        flush()
+        # 从最新一页开始的回填顺带建立增量抓取的高水位
+        last_post_key = self.scraper.state_key(STATE_LAST_POST_ID)
+        if self.from_top and high_water is not None and get_scrape_state(last_post_key) is None:
+            set_scrape_state(last_post_key, high_water)
+        return total
+
+# ================= 频道调度 =================
+# 每个频道按自己的间隔轮询：间隔由观测到的发帖速率决定 (平均每次轮询约看到 CHANNEL_TARGET_POSTS 条新消息)，
+# 再除以优先级，限制在 [min_interval, max_interval] 内。所有频道共享 PageFetcher 的令牌桶作为全局速率预算，
+# 同时到期时优先级高的先派发。
+SCRAPE_INTERVAL = int(os.environ.get("SCRAPE_INTERVAL", "60"))
+CHANNEL_MAX_INTERVAL = int(os.environ.get("CHANNEL_MAX_INTERVAL", "3600"))
+CHANNEL_TARGET_POSTS = 1.0
+CHANNEL_RATE_ALPHA = 0.3
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "4"))
+ChannelConfig = namedtuple('ChannelConfig', ['name', 'priority', 'min_interval', 'max_interval'])
+
+def load_channels():
+    """读取频道配置：CHANNELS_FILE 存在时用它，否则用 SCRAPE_CHANNELS (name:priority,...)
+
+    配置写错不能让进程起不来：文件解析失败时退回环境变量，单个无效条目打印后跳过。
+    """
+    entries = None
+    if os.path.exists(CHANNELS_FILE):
+        try:
+            with open(CHANNELS_FILE, encoding='utf-8') as f:
+                entries = json.load(f)
+            if not isinstance(entries, list):
+                raise ValueError("顶层必须是列表")
+        except (OSError, ValueError) as e:
+            log.error(f"频道配置 {CHANNELS_FILE} 无效，改用 SCRAPE_CHANNELS: {e}")
+            entries = None
+    if entries is None:
+        entries = []
+        for item in os.environ.get("SCRAPE_CHANNELS", CHANNEL_USERNAME).split(','):
+            if not item.strip(): continue
+            name, _, priority = item.strip().partition(':')
+            entries.append({'name': name, 'priority': priority or 1})
+    channels = []
+    for entry in entries:
+        try:
+            if isinstance(entry, str): entry = {'name': entry}
+            name = entry['name']
+            if not isinstance(name, str) or not name.strip():
+                raise ValueError("频道名必须是非空字符串")
+            channels.append(ChannelConfig(
+                name.strip(),
+                max(float(entry.get('priority', 1)), 0.1),
+                float(entry.get('min_interval', SCRAPE_INTERVAL)),
+                float(entry.get('max_interval', CHANNEL_MAX_INTERVAL)),
+            ))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            log.error(f"跳过无效的频道配置 {entry!r}: {e}")
+    if not channels:
+        log.warning("没有可用的频道配置，调度器不会抓取任何频道")
+    return channels
+
+_channels_cache = (False, [])
+_channels_lock = threading.Lock()
+
+def configured_channels():
+    """当前的频道配置；CHANNELS_FILE 的修改时间不变时直接用上次读到的结果，不在每个请求里重新解析"""
+    global _channels_cache
+    try:
+        mtime = os.path.getmtime(CHANNELS_FILE)
+    except OSError:
+        mtime = None
+    with _channels_lock:
+        if _channels_cache[0] != mtime:
+            _channels_cache = (mtime, load_channels())
+        return _channels_cache[1]
+
+class ChannelState:
+    """调度器里一个频道的运行状态；字段与 channel_status 表对应，便于其他进程查看"""
+    __slots__ = ('config', 'scraper', 'interval', 'post_rate', 'jobs_per_hour', 'polls', 'jobs_total',
+                 'last_poll_at', 'last_success_at', 'next_poll_at', 'last_error', 'running')
+
+    def __init__(self, config, scraper):
+        self.config = config
+        self.scraper = scraper
+        self.interval = config.min_interval
+        self.post_rate = None
+        self.jobs_per_hour = None
+        self.polls = 0
+        self.jobs_total = 0
+        self.last_poll_at = None
+        self.last_success_at = None
+        self.next_poll_at = 0.0
+        self.last_error = None
+        self.running = False
+
+    def status(self):
+        return {'channel': self.config.name, 'priority': self.config.priority, 'interval': self.interval,
+                'post_rate': self.post_rate, 'jobs_per_hour': self.jobs_per_hour, 'polls': self.polls,
+                'jobs_total': self.jobs_total, 'last_poll_at': self.last_poll_at,
+                'last_success_at': self.last_success_at, 'next_poll_at': self.next_poll_at,
+                'last_error': self.last_error}
+
+def _ewma(previous, observed):
+    return observed if previous is None else CHANNEL_RATE_ALPHA * observed + (1 - CHANNEL_RATE_ALPHA) * previous
+
+class ChannelScheduler:
+    def __init__(self, channels, workers=SCHEDULER_WORKERS, fetcher=None):
+        self.fetcher = fetcher or PageFetcher()
+        self.states = {c.name: ChannelState(c, WebScraper(c.name, fetcher=self.fetcher)) for c in channels}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='channel')
+        self.lock = threading.Lock()
+
+    @property
+    def scrapers(self):
+        return [state.scraper for state in self.states.values()]
+
+    def restore(self):
+        """接管调度时读回上一个调度进程保存的速率和下次轮询时间，重启后不必重新学习"""
+        with db_reader.connection() as conn:
+            rows = conn.execute('SELECT * FROM channel_status').fetchall()
+            names = [d[0] for d in conn.execute('SELECT * FROM channel_status LIMIT 0').description]
+        with self.lock:
+            for row in rows:
+                saved = dict(zip(names, row))
+                state = self.states.get(saved['channel'])
+                if state is None: continue
+                for key in ('post_rate', 'jobs_per_hour', 'polls', 'jobs_total', 'last_poll_at',
+                            'last_success_at', 'next_poll_at', 'last_error'):
+                    setattr(state, key, saved[key])
+                if saved['interval']:
+                    state.interval = min(max(saved['interval'], state.config.min_interval), state.config.max_interval)
+                state.next_poll_at = state.next_poll_at or 0.0
+
+    def run_due(self):
+        """派发所有到期且没有在运行的频道，返回距离下一个频道到期的秒数"""
+        now = time.time()
+        with self.lock:
+            due = [s for s in self.states.values() if not s.running and s.next_poll_at <= now]
+            due.sort(key=lambda s: (-s.config.priority, s.next_poll_at))
+            for state in due:
+                state.running = True
+                self.executor.submit(self._poll, state)
+            waiting = [s.next_poll_at - now for s in self.states.values() if not s.running]
+        return max(0.0, min(waiting)) if waiting else SCRAPE_INTERVAL
+
+    def poll_all(self):
+        """立即把所有频道各抓一次 (数据库为空时的同步抓取)，返回新职位总数"""
+        return sum(len(scraper.fetch_jobs(60)) for scraper in self.scrapers)
+
+    def _poll(self, state):
+        started = time.time()
+        try:
+            result = state.scraper.poll(60)
+        except Exception as e:
+            result = {'jobs': [], 'posts': 0, 'error': str(e)}
+        finished = time.time()
+        with self.lock:
+            elapsed = started - state.last_poll_at if state.last_poll_at else None
+            state.polls += 1
+            state.jobs_total += len(result['jobs'])
+            state.last_poll_at = started
+            state.last_error = result['error']
+            if result['error'] is None:
+                state.last_success_at = finished
+                if elapsed:
+                    state.post_rate = _ewma(state.post_rate, result['posts'] / elapsed)
+                    state.jobs_per_hour = _ewma(state.jobs_per_hour, len(result['jobs']) * 3600 / elapsed)
+                if state.post_rate:
+                    interval = CHANNEL_TARGET_POSTS / state.post_rate / state.config.priority
+                elif state.post_rate is None:
+                    interval = state.config.min_interval
+                else:
+                    interval = state.config.max_interval
+            else:
+                # 出错时指数退避，成功一次后回到按速率计算的间隔
+                interval = state.interval * 2
+            state.interval = min(max(interval, state.config.min_interval), state.config.max_interval)
+            # 加一点抖动，避免大量频道在同一时刻到期
+            state.next_poll_at = finished + state.interval * random.uniform(0.9, 1.1)
+            state.running = False
+            status = state.status()
+        try:
+            job_writer.save_channel_status(status)
+        except Exception as e:
+            log.error(f"[{state.config.name}] 保存调度状态失败: {e}")
+
+_channel_scheduler = None
+_channel_scheduler_lock = threading.Lock()
+
+def get_channel_scheduler():
+    """进程内的频道调度器，第一次用到时才读频道配置并创建；只提供 API 的 web worker 不会创建它"""
+    global _channel_scheduler
+    with _channel_scheduler_lock:
+        if _channel_scheduler is None:
+            _channel_scheduler = ChannelScheduler(configured_channels())
+        return _channel_scheduler
+
+def channel_status_report():
+    """/api/channels 的内容：channel_status 加上各频道的游标、库内职位数和滞后"""
+    now = time.time()
+    with db_reader.connection() as conn:
+        cursor = conn.execute('SELECT * FROM channel_status ORDER BY channel')
+        names = [d[0] for d in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        counts = dict(conn.execute('SELECT channel, COUNT(*) FROM jobs GROUP BY channel'))
+        cursors = dict(conn.execute('SELECT key, value FROM scrape_state WHERE key LIKE ?', (f'{STATE_LAST_POST_ID}:%',)))
+    configured = {c.name for c in configured_channels()}
+    for row in rows:
+        name = row['channel']
+        row['configured'] = name in configured
+        row['jobs_in_db'] = counts.get(name, 0)
+        row['last_post_id'] = cursors.get(f'{STATE_LAST_POST_ID}:{name}')
+        # staleness: 距上次成功抓取的秒数；overdue: 已到期但还没被派发的秒数 (速率预算不足时增长)
+        row['staleness'] = round(now - row['last_success_at'], 1) if row['last_success_at'] else None
+        row['overdue'] = round(max(0.0, now - row['next_poll_at']), 1) if row['next_poll_at'] else None
+    return rows
+
+def channel_status_gauge(field):
+    """/metrics 的频道 gauge；读 channel_status 表，web 进程也能看到工作进程的调度状态"""
+    column = {'interval': 'interval', 'last_poll': 'last_poll_at'}[field]
+    with db_reader.connection() as conn:
+        return {(channel,): value for channel, value in conn.execute(f'SELECT channel, {column} FROM channel_status')}
+
+# ================= Flask App =================
+# 路由注册在蓝图上，由 create_app 组装成应用
+api = Blueprint('api', __name__)
+
+# ================= OAuth2 辅助函数 =================
+class GmailClient:
+    """进程内缓存的 Gmail 凭据和 API 客户端
+
+    令牌文件只在修改时间变化时重新读取，access token 临近过期时加锁刷新并写回文件。
+    discovery 文档只解析一次；httplib2 连接不是线程安全的，每个线程各自构建一个 service。
+    """
+    def __init__(self, token_file=TOKEN_FILE, api_root=GMAIL_API_ROOT):
+        self.token_file = token_file
+        self.api_root = api_root
+        self.creds = None
+        self.mtime = None
+        self.doc = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def credentials(self):
+        """获取或刷新Gmail API凭据"""
+        with self.lock:
+            self._reload_if_changed()
+            creds = self.creds
+            if creds is None or not self._needs_refresh(creds):
+                return creds
+            if not creds.refresh_token:
+                log.info("无有效令牌，需要重新授权")
+                return creds
+            try:
+                creds.refresh(Request())
+                self._save(creds)
+                log.info("令牌已刷新")
+            except Exception as e:
+                log.error(f"刷新令牌失败: {e}")
+                return None
+            return creds
+
+    def set_credentials(self, creds):
+        with self.lock:
+            self._save(creds)
+            self.creds = creds
+
+    def service(self, creds):
+        cached = getattr(self.local, 'service', None)
+        if cached is not None and cached[0] is creds:
+            return cached[1]
+        service = build_from_document(self._discovery_doc(), credentials=creds)
+        self.local.service = (creds, service)
+        return service
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.token_file)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime: return
+        self.mtime = mtime
+        self.creds = None
+        if mtime is None: return
+        try:
+            self.creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+        except Exception as e:
+            log.error(f"加载令牌失败: {e}")
+
+    @staticmethod
+    def _needs_refresh(creds):
+        if not creds.valid: return True
+        if creds.expiry is None: return False
+        # google-auth 的 expiry 是不带时区的 UTC 时间
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now < datetime.timedelta(seconds=GMAIL_REFRESH_MARGIN)
+
+    def _save(self, creds):
+        with open(self.token_file, 'w') as token_file:
+            token_file.write(creds.to_json())
+        self.mtime = os.path.getmtime(self.token_file)
+
+    def _discovery_doc(self):
+        with self.lock:
+            if self.doc is None:
+                doc = discovery_cache.get_static_doc('gmail', 'v1')
+                if doc is None:
+                    doc = requests.get(GMAIL_DISCOVERY_URL, timeout=30).text
+                doc = json.loads(doc)
+                if self.api_root:
+                    root = self.api_root.rstrip('/') + '/'
+                    doc['rootUrl'] = doc['mtlsRootUrl'] = root
+                    doc['baseUrl'] = root + doc['servicePath']
+                self.doc = doc
+            return self.doc
+
+gmail_client = GmailClient()
+
+def get_gmail_credentials():
+    return gmail_client.credentials()
+
+def save_gmail_credentials(creds):
+    """保存Gmail API凭据到文件"""
+    gmail_client.set_credentials(creds)
+    log.info(f"令牌已保存到 {TOKEN_FILE}")
+
+# ================= 投递队列 =================
+# 投递任务持久化在 SQLite 中，由后台工作线程发送；进程重启后未完成的任务会继续发送
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", "4"))
+# 每个 SMTP 主机每秒最多发送封数，默认与原来每封间隔 2 秒一致
+SEND_RATE = float(os.environ.get("SEND_RATE", "0.5"))
+SEND_BURST = int(os.environ.get("SEND_BURST", "1"))
+# Gmail 每用户每秒 250 配额单位，messages.send 每次 100 单位
+GMAIL_SEND_RATE = float(os.environ.get("GMAIL_SEND_RATE", "2"))
+GMAIL_SEND_BURST = int(os.environ.get("GMAIL_SEND_BURST", "2"))
+SEND_MAX_ATTEMPTS = 5
+SEND_RETRY_BASE = 30
+SEND_RETRY_MAX = 30 * 60
+SEND_IDLE_POLL = 5
+SEND_CLAIM_SCAN = 50
+# SMTP 连接池：每个 (主机, 端口, 账号) 最多同时打开的连接数、空闲多久关闭、空闲多久后复用前先 NOOP 检查
+SMTP_MAX_CONNECTIONS = int(os.environ.get("SMTP_MAX_CONNECTIONS", "2"))
+SMTP_IDLE_TIMEOUT = 120
+SMTP_CHECK_AFTER = 10
+# 超过这个大小的邮件走 Gmail 可续传上传，按块从共享缓冲区读取
+GMAIL_RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+GMAIL_UPLOAD_CHUNK = 1024 * 1024
+
+SendBatch = namedtuple('SendBatch', 'provider template smtp_host smtp_port smtp_user smtp_pass')
+SendTask = namedtuple('SendTask', 'id batch_id email title attempts')
+
+class SendError(Exception):
+    """不可重试的投递错误"""
+
+# 队列里的 SMTP 授权码用 Fernet 加密后才写库。密钥取环境变量 SEND_SECRET_KEY，
+# 没有时用数据库旁边的 <DB_PATH>.key (首次使用时生成，权限 600)，数据库文件本身不含密钥。
+_secret_boxes = {}
+_secret_lock = threading.Lock()
+
+def secret_box():
+    """加解密授权码的 Fernet 实例；未安装 cryptography 时抛出 SendError"""
+    if Fernet is None:
+        raise SendError("SMTP 投递需要安装 cryptography (pip install cryptography)")
+    key = os.environ.get("SEND_SECRET_KEY")
+    source = key or DB_PATH + '.key'
+    with _secret_lock:
+        box = _secret_boxes.get(source)
+        if box is None:
+            if not key:
+                try:
+                    fd = os.open(source, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(Fernet.generate_key())
+                except FileExistsError:
+                    pass
+                with open(source, 'rb') as f:
+                    key = f.read().strip()
+            box = _secret_boxes[source] = Fernet(key)
+    return box
+
+def encrypt_secret(secret):
+    return secret_box().encrypt(secret.encode('utf-8')).decode('ascii')
+
+def decrypt_secret(token):
+    try:
+        return secret_box().decrypt(token.encode('ascii')).decode('utf-8')
+    except InvalidToken:
+        raise SendError("SMTP 授权码无法解密 (密钥已更换)，请重新提交投递")
+
+# SMTP DATA 和 Gmail 上传都要求 CRLF 换行
+CRLF_POLICY = email_policy.compat32.clone(linesep='\r\n')
+DOT_STUFF_RE = re.compile(rb'^\.', re.M)
+
+class ResumeTemplate:
+    """一份简历的邮件模板：附件部分只编码一次，每个收件人只生成信头和正文
+
+    render() 返回 (信头+正文, 附件正文, 结束分隔符) 三段字节，中间一段对所有收件人是同一个对象，
+    整批投递只在内存中保留一份编码后的简历。
+    """
+    def __init__(self, file_name, file_content):
+        self.file_name = file_name
+        self.boundary = '=' * 15 + uuid.uuid4().hex
+        part = MIMEApplication(file_content, Name=file_name)
+        part['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        raw = part.as_bytes(policy=CRLF_POLICY)
+        split = raw.index(b'\r\n\r\n') + 4
+        self.part_header = f'--{self.boundary}\r\n'.encode('ascii') + raw[:split]
+        self.attachment = raw[split:]
+        self.closing = f'\r\n--{self.boundary}--\r\n'.encode('ascii')
 
-# ================= OAuth2 配置 =================
-# Gmail OAuth2 配置 - 用户需要从Google Cloud Console获取
-# 创建项目：https://console.cloud.google.com/
-# 启用Gmail API，创建OAuth2客户端凭证（桌面应用类型）
-# 将客户端ID和密钥保存在本地配置文件中
-OAUTH_CLIENT_CONFIG = {
-    "web": {
-        "client_id": os.environ.get("GMAIL_CLIENT_ID", ""),
-        "client_secret": os.environ.get("GMAIL_CLIENT_SECRET", ""),
-        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "redirect_uris": ["http://localhost:5000/oauth2callback"]
-    }
-}
+    def render(self, sender, target_email, job_title):
+        msg = MIMEMultipart(boundary=self.boundary)
+        msg['From'] = sender
+        msg['To'] = target_email
+        msg['Subject'] = f"应聘：{job_title} - {self.file_name.replace('.pdf', '')}"
 
-# 本地存储令牌的文件
-TOKEN_FILE = 'gmail_token.json'
-SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+        body = f"""您好，\n\n我对贵公司发布的 [{job_title}] 职位非常感兴趣。\n附件是我的个人简历，请查收。\n\n期待您的回复。"""
+        msg.attach(MIMEText(body, 'plain'))
 
-# ================= 数据库配置 =================
-DB_PATH = 'jobs.db'
+        raw = msg.as_bytes(policy=CRLF_POLICY)
+        # 去掉结束分隔符，接上预先编码好的附件部分
+        head = raw[:raw.rindex(f'--{self.boundary}--'.encode('ascii'))] + self.part_header
+        return head, self.attachment, self.closing
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS jobs (
-            id TEXT PRIMARY KEY,
-            company TEXT,
-            title TEXT,
-            salary TEXT,
-            date TEXT,
-            email TEXT,
-            location TEXT,
-            raw_content TEXT,
-            tags TEXT,
-            type TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE INDEX IF NOT EXISTS idx_date ON jobs(date DESC)
-    ''')
-    c.execute('''
-        CREATE INDEX IF NOT EXISTS idx_company ON jobs(company)
-    ''')
-    c.execute('''
-        CREATE INDEX IF NOT EXISTS idx_type ON jobs(type)
-    ''')
-    conn.commit()
-    conn.close()
+class ChainedReader(io.RawIOBase):
+    """把多段字节拼成一个可 seek 的只读流，不做拼接复制"""
+    def __init__(self, parts):
+        self.parts = [memoryview(part) for part in parts]
+        self.starts = []
+        offset = 0
+        for part in self.parts:
+            self.starts.append(offset)
+            offset += len(part)
+        self.size = offset
+        self.pos = 0
 
-def save_jobs_to_db(jobs):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    for job in jobs:
-        # 将tags列表转换为JSON字符串
-        tags_json = json.dumps(job.get('tags', []), ensure_ascii=False)
-        c.execute('''
-            INSERT OR REPLACE INTO jobs
-            (id, company, title, salary, date, email, location, raw_content, tags, type, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (
-            job['id'],
-            job.get('company', ''),
-            job.get('title', ''),
-            job.get('salary', ''),
-            job.get('date', ''),
-            job.get('email', ''),
-            job.get('location', ''),
-            job.get('raw_content', ''),
-            tags_json,
-            job.get('type', '')
-        ))
-    conn.commit()
-    conn.close()
+    def readable(self): return True
 
-def load_jobs_from_db(days=60):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
-    c.execute('''
-        SELECT id, company, title, salary, date, email, location, raw_content, tags, type
-        FROM jobs
-        WHERE date >= ?
-        ORDER BY date DESC
-    ''', (cutoff_date,))
+    def seekable(self): return True
 
-    jobs = []
-    for row in c.fetchall():
-        job = {
-            'id': row[0],
-            'company': row[1],
-            'title': row[2],
-            'salary': row[3],
-            'date': row[4],
-            'email': row[5],
-            'location': row[6],
-            'raw_content': row[7],
-            'tags': json.loads(row[8]) if row[8] else [],
-            'type': row[9]
-        }
-        jobs.append(job)
-    conn.close()
-    return jobs
+    def tell(self): return self.pos
 
-def cleanup_old_jobs(days=90):
-    """清理90天前的旧数据"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
-    c.execute('DELETE FROM jobs WHERE date < ?', (cutoff_date,))
-    conn.commit()
-    conn.close()
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR: offset += self.pos
+        elif whence == io.SEEK_END: offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
 
-# 初始化数据库
-init_db() 
+    def read(self, size=-1):
+        # googleapiclient 按块上传时要求读满请求的长度，不能像 RawIOBase 默认那样只读一段
+        remaining = max(0, self.size - self.pos)
+        if size is None or size < 0 or size > remaining: size = remaining
+        out = bytearray(size)
+        view = memoryview(out)
+        filled = 0
+        while filled < size:
+            filled += self.readinto(view[filled:])
+        return bytes(out)
 
-# ================= 智能解析逻辑 (保持不变) =================
-class JobParser:
-    @staticmethod
-    def clean_string(text):
-        if not text: return ""
-        text = re.sub(r'[#＃].*', '', text)
-        text = re.sub(r'[^\w\s\u4e00-\u9fa5:：\.\-\(\)\+]', '', text)
-        text = re.sub(r'^[【\[]?(?:招聘|岗位|职位|Job|Hiring|Position)[\]】]?[:：]?\s*', '', text, flags=re.IGNORECASE)
-        return text.strip()
+    def readinto(self, buffer):
+        if self.pos >= self.size: return 0
+        index = bisect.bisect_right(self.starts, self.pos) - 1
+        start = self.pos - self.starts[index]
+        chunk = self.parts[index][start:start + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
 
-    @staticmethod
-    def extract_max_salary(raw_text):
-        lines = raw_text.split('\n')
-        target_line = ""
-        for line in lines:
-            if any(k in line for k in ["薪资", "待遇", "Salary", "Pay", "U", "$"]):
-                if len(line) < 50 and re.search(r'\d', line):
-                    target_line = line
-                    break
-        if not target_line: return "面议"
-        numbers = re.findall(r'(\d+)', target_line)
-        if not numbers: return target_line
-        nums = [int(n) for n in numbers]
-        valid_nums = [n for n in nums if (n > 100 and n < 100000) or (n < 100 and 'k' in target_line.lower())]
-        if not valid_nums: return target_line
-        max_val = max(valid_nums)
-        unit = ""
-        lower_line = target_line.lower()
-        if "u" in lower_line: unit = "U"
-        elif "$" in target_line: unit = "$"
-        elif "k" in lower_line: unit = "k"
-        if unit == "k" and max_val < 1000: return f"{max_val}k"
-        return f"{max_val}{unit}"
+def smtp_send_parts(server, sender, recipient, parts):
+    """直接走 MAIL/RCPT/DATA 发送分段的邮件，附件段原样写入 socket
 
-    @staticmethod
-    def parse_html_message(msg_div):
-        try:
-            text_div = msg_div.find('div', class_='tgme_widget_message_text')
-            if not text_div: return None
-            for br in text_div.find_all("br"): br.replace_with("\n")
-            raw_text = text_div.get_text()
+    base64 行不会以 '.' 开头，只需要对信头和正文做点转义，附件不再复制。
+    服务器支持 PIPELINING 时三条命令一次写出，省掉两个往返。
+    """
+    server.ehlo_or_helo_if_needed()
+    commands = [f'MAIL FROM:{smtplib.quoteaddr(sender)}', f'RCPT TO:{smtplib.quoteaddr(recipient)}', 'DATA']
+    if server.has_extn('pipelining'):
+        server.send(''.join(command + '\r\n' for command in commands))
+        replies = [server.getreply() for _ in commands]
+    else:
+        replies = []
+        for command in commands:
+            replies.append(server.docmd(command))
+            if replies[-1][0] >= 400: break
+    (code, resp), rest = replies[0], replies[1:]
+    if code != 250:
+        _smtp_reset(server, rest)
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+    (code, resp), rest = rest[0], rest[1:]
+    if code not in (250, 251):
+        _smtp_reset(server, rest)
+        raise smtplib.SMTPRecipientsRefused({recipient: (code, resp)})
+    code, resp = rest[0]
+    if code != 354:
+        _smtp_reset(server)
+        raise smtplib.SMTPDataError(code, resp)
+    head, attachment, closing = parts
+    server.send(DOT_STUFF_RE.sub(b'..', head))
+    server.send(attachment)
+    server.send(closing + b'.\r\n')
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
 
-            if "#招聘" not in raw_text and "＃招聘" not in raw_text:
-                return None
+def _smtp_reset(server, replies=()):
+    try:
+        # MAIL/RCPT 失败但流水线里的 DATA 仍被接受 (354) 时，先发 "." 结束这封空邮件再 RSET
+        if any(code == 354 for code, _ in replies):
+            server.send(b'.\r\n')
+            server.getreply()
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
 
-            time_span = msg_div.find('a', class_='tgme_widget_message_date')
-            date_str = datetime.date.today().strftime("%Y-%m-%d")
-            if time_span:
-                time_tag = time_span.find('time')
-                if time_tag and time_tag.has_attr('datetime'):
-                    date_str = time_tag['datetime'].split('T')[0]
+def open_smtp(host, port, user, password):
+    if port == 465:
+        server = smtplib.SMTP_SSL(host, port, timeout=30)
+    else:
+        server = smtplib.SMTP(host, port, timeout=30)
+        server.ehlo()
+        # 只有服务器声明支持时才升级 TLS
+        if server.has_extn('starttls'):
+            server.starttls()
+            server.ehlo()
+    server.login(user, password)
+    return server
 
-            hashtags = re.findall(r'[#＃]([\w\-\.\+\u4e00-\u9fa5]+)', raw_text)
-            unique_id = msg_div.get('data-post-id')
-            if not unique_id:
-                unique_id = f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+def _smtp_quit(server):
+    try:
+        server.quit()
+    except Exception:
+        server.close()
 
-            job_data = {
-                "id": unique_id,
-                "date": date_str,
-                "raw_content": raw_text,
-                "tags": hashtags,
-                "type": "全职",
-                "location": "远程",
-                "email": "",
-                "company": "",
-                "title": ""
-            }
+def _smtp_session_usable(e):
+    """服务器正常回复了错误 (拒收等) 时会话仍然可用，连接断开、超时或 421 时需要丢弃"""
+    if isinstance(e, smtplib.SMTPRecipientsRefused): return True
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421
 
-            lines = [l.strip() for l in raw_text.split('\n') if l.strip()]
-            found_company = None
-            found_title = None
-            
-            job_keywords = ["工程师", "运营", "市场", "实习生", "BD", "专员", "经理", "设计师", "交易员", "负责人"]
-            blacklist_tags = ["research", "socialfi", "defi", "web3", "crypto", "blockchain", "gamefi", "nft", "dao", "headhunter", "recruiter", "hiring", "job", "fulltime", "parttime", "remote", "apply", "work", "career", "talent", "exchange", "wallet", "public", "chain", "infrastructure"]
-            invalid_company_names = ["简介", "介绍", "岗位", "职责", "要求", "福利", "待遇", "关于我们", "About", "Intro", "Description", "Requirements", "Welcome"]
-
-            for line in lines:
-                if not found_company:
-                    company_match = re.match(r'^(?:项目|Project|公司|Company|Team)\s*[:：]\s*(.+)', line, re.IGNORECASE)
-                    if company_match:
-                        found_company = JobParser.clean_string(company_match.group(1))
-                        break
-            if not found_company:
-                for line in lines:
-                    cleaned_line = JobParser.clean_string(line)
-                    if not line.startswith('#') and not line.startswith('＃') and len(line) < 40 and "招聘" not in line:
-                        if cleaned_line in invalid_company_names or len(cleaned_line) < 2: continue
-                        found_company = cleaned_line
-                        break
+class SmtpPool:
+    """按 (主机, 端口, 账号) 复用已登录的 SMTP 连接，跨请求、跨工作线程共享
 
-            target_tag = None
-            for tag in hashtags:
-                tag_lower = tag.lower()
-                if any(bad in tag_lower for bad in blacklist_tags): continue
-                for keyword in job_keywords:
-                    if keyword.lower() in tag_lower:
-                        target_tag = tag
+    空闲连接按密码摘要区分，换了密码不会拿到别人登录好的会话；
+    空闲超过 SMTP_CHECK_AFTER 秒的连接复用前先 NOOP，失败就重连。
+    """
+    def __init__(self, max_per_key=SMTP_MAX_CONNECTIONS, idle_timeout=SMTP_IDLE_TIMEOUT, check_after=SMTP_CHECK_AFTER):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.idle = {}
+        self.opened = {}
+        self.cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def connection(self, host, port, user, password):
+        key = (host, port, user)
+        digest = hashlib.sha256(password.encode('utf-8')).digest()
+        server = self._checkout(key, digest, password)
+        try:
+            yield server
+        except BaseException as e:
+            if _smtp_session_usable(e):
+                self._checkin(key, server, digest)
+            else:
+                self._discard(key, server)
+            raise
+        self._checkin(key, server, digest)
+
+    def _checkout(self, key, digest, password):
+        stale = []
+        server = None
+        with self.cond:
+            while True:
+                entries = self.idle.get(key, [])
+                while entries:
+                    candidate, candidate_digest, last_used = entries.pop()
+                    if hmac.compare_digest(candidate_digest, digest):
+                        server = candidate
                         break
-                if target_tag: break
-            
-            found_title = target_tag if target_tag else "其他"
+                    stale.append(candidate)
+                    self.opened[key] -= 1
+                if server is not None or self.opened.get(key, 0) < self.max_per_key:
+                    break
+                self.cond.wait()
+            if server is None:
+                self.opened[key] = self.opened.get(key, 0) + 1
+        for old in stale: _smtp_quit(old)
 
-            job_data["company"] = found_company if found_company else "其他项目"
-            job_data["title"] = found_title
-            job_data["salary"] = JobParser.extract_max_salary(raw_text)
-            email_match = re.search(r'[\w\.-]+@[\w\.-]+\.[a-zA-Z]+', raw_text)
-            job_data["email"] = email_match.group(0) if email_match else ""
+        if server is not None and time.monotonic() - last_used > self.check_after:
+            try:
+                healthy = server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                healthy = False
+            if not healthy:
+                server.close()
+                server = None
+        if server is None:
+            try:
+                host, port, user = key
+                server = open_smtp(host, port, user, password)
+            except BaseException:
+                with self.cond:
+                    self.opened[key] -= 1
+                    self.cond.notify()
+                raise
+        return server
 
-            for tag in hashtags:
-                if "兼职" in tag: job_data["type"] = "兼职"
-                if "实习" in tag: job_data["type"] = "实习"
-                if "外包" in tag or "项目" in tag: job_data["type"] = "项目制"
+    def _checkin(self, key, server, digest):
+        with self.cond:
+            self.idle.setdefault(key, []).append((server, digest, time.monotonic()))
+            self.cond.notify()
 
-            return job_data
-        except Exception as e: return None
+    def _discard(self, key, server):
+        server.close()
+        with self.cond:
+            self.opened[key] -= 1
+            self.cond.notify()
 
-# ================= 爬虫服务 =================
-class WebScraper:
-    def __init__(self):
-        self.base_url = f"https://t.me/s/{CHANNEL_USERNAME}"
-        self.cached_jobs = []
+    def expire_idle(self):
+        """关闭空闲超过 idle_timeout 的连接，由投递线程空闲时调用"""
+        expired = []
+        now = time.monotonic()
+        with self.cond:
+            for key, entries in self.idle.items():
+                keep = [entry for entry in entries if now - entry[2] <= self.idle_timeout]
+                if len(keep) != len(entries):
+                    expired.extend(entry[0] for entry in entries if now - entry[2] > self.idle_timeout)
+                    self.opened[key] -= len(entries) - len(keep)
+                    entries[:] = keep
+            if expired: self.cond.notify_all()
+        for server in expired: _smtp_quit(server)
 
-    def fetch_jobs(self, lookback_days=60):
-        print(f"[*] 启动 Web 抓取: {self.base_url}")
-        all_jobs = []
-        target_url = self.base_url
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=lookback_days)
-        headers = {"User-Agent": "Mozilla/5.0"}
+smtp_pool = SmtpPool()
 
-        for page in range(5):
-            try:
-                print(f"[*] 请求第 {page+1} 页...")
-                resp = requests.get(target_url, headers=headers, proxies=PROXY, timeout=15)
-                if resp.status_code != 200: break
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                divs = soup.find_all('div', class_='tgme_widget_message_wrap')
-                if not divs: break
-                page_jobs = []
-                for div in reversed(divs):
-                    job = JobParser.parse_html_message(div)
-                    if job:
-                        if job['date']:
-                            try:
-                                d = datetime.datetime.strptime(job['date'], "%Y-%m-%d")
-                                if d < cutoff_date: 
-                                    self.cached_jobs = all_jobs + page_jobs
-                                    return self.cached_jobs
-                            except: pass
-                        if job['email'] or len(job['raw_content']) > 20: page_jobs.append(job)
-                all_jobs.extend(page_jobs)
-                print(f"    -> 解析到 {len(page_jobs)} 个职位")
-                link = soup.find('a', class_='tme_messages_more')
-                if link and link.get('href'):
-                    href = link['href']
-                    target_url = href if href.startswith('http') else f"https://t.me{href}"
-                    time.sleep(1.5)
-                else: break
-            except Exception as e:
-                print(f"[!] 错误: {e}")
-                break
-        self.cached_jobs = all_jobs
-        print(f"[*] 抓取结束，共 {len(all_jobs)} 条")
+GMAIL_RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
 
-        # 保存到数据库
-        if all_jobs:
-            try:
-                save_jobs_to_db(all_jobs)
-                print(f"[*] 已保存 {len(all_jobs)} 条数据到数据库")
-                # 清理旧数据
-                cleanup_old_jobs(90)
-            except Exception as e:
-                print(f"[!] 数据库保存失败: {e}")
+def gmail_rate_limited(e):
+    """429，或 403 且原因是 rateLimitExceeded/userRateLimitExceeded"""
+    if not isinstance(e, HttpError): return False
+    if e.resp.status == 429: return True
+    if e.resp.status != 403: return False
+    try:
+        errors = json.loads(e.content)['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(err.get('reason') in GMAIL_RATE_LIMIT_REASONS for err in errors)
 
-        return all_jobs
+def retry_after_seconds(e):
+    try:
+        return max(0.0, float(e.resp.get('retry-after')))
+    except (TypeError, ValueError):
+        return None
 
-# ================= Flask App =================
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-CORS(app)
-scraper = WebScraper()
+def gmail_send(service, parts):
+    """以 message/rfc822 媒体上传原始邮件，不再对整封邮件做一次 base64"""
+    reader = ChainedReader(parts)
+    media = MediaIoBaseUpload(reader, mimetype='message/rfc822', chunksize=GMAIL_UPLOAD_CHUNK,
+                              resumable=reader.size > GMAIL_RESUMABLE_THRESHOLD)
+    return service.users().messages().send(userId='me', media_body=media).execute()
 
-# ================= OAuth2 辅助函数 =================
-def get_gmail_credentials():
-    """获取或刷新Gmail API凭据"""
-    creds = None
-    # 从文件加载令牌
-    if os.path.exists(TOKEN_FILE):
-        try:
-            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        except Exception as e:
-            print(f"[!] 加载令牌失败: {e}")
+def is_transient_send_error(e):
+    """4xx、连接断开、超时以及 Gmail 429/5xx 可以重试，其余 (认证失败、5xx 拒收等) 直接失败"""
+    if isinstance(e, SendError): return False
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, HttpError):
+        return e.resp.status in (429, 500, 502, 503, 504)
+    return isinstance(e, OSError)
+
+def provider_key(provider, smtp_host):
+    return 'gmail' if provider == 'gmail' else f'smtp:{smtp_host}'
+
+def send_task_counts():
+    with db_reader.connection() as conn:
+        return {(status,): n for status, n in conn.execute('SELECT status, COUNT(*) FROM send_tasks GROUP BY status')}
+
+class SendQueue:
+    """SQLite 持久化的投递队列
+
+    任务状态: pending -> sending -> sent / failed；可重试的错误按指数退避写回 next_attempt_at。
+    限速按服务商各自一个令牌桶，令牌不足时跳过该服务商的任务而不是阻塞线程。
+    web 进程只登记任务；发送线程只在持有 scheduler 租约的进程里运行，令牌桶因此是全局唯一的一份。
+    """
+    def __init__(self, workers=SEND_WORKERS):
+        self.workers = workers
+        self.threads = []
+        self.owner = None
+        self.stopping = threading.Event()
+        self.start_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.buckets = {}
+        self.throttled = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def start(self, owner):
+        """由拿到租约的进程调用：先恢复无主的任务，再启动发送线程；owner 为租约持有者"""
+        with self.start_lock:
+            if self.threads: return
+            self.owner = owner
+            self.stopping = threading.Event()
+            resumed = self.recover()
+            if resumed:
+                log.info(f"恢复 {resumed} 个未完成的投递任务")
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(self.stopping,), name=f'send-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self):
+        """失去租约时停止认领新任务；已经在发送的任务发完后照常记录结果"""
+        with self.start_lock:
+            self.stopping.set()
+            self.wake.set()
+            self.threads = []
+
+    def recover(self):
+        """把认领者已不在的 sending 任务重新排队，返回任务数
+
+        认领者是当时的租约持有者。它的租约仍然有效 (包括本进程自己) 时任务可能还在发送，不能动；
+        租约过期或已释放说明那个进程已经退出，或卡住超过了 SCHEDULER_LEASE_TTL，发送结果未知，重发一次。
+        """
+        with job_writer.transaction() as conn:
+            resumed = conn.execute('''
+                UPDATE send_tasks SET status = 'pending', claimed_by = NULL
+                WHERE status = 'sending' AND claimed_by IS NOT ?
+                  AND (claimed_by IS NULL OR claimed_by NOT IN (SELECT owner FROM worker_leases WHERE expires_at >= ?))
+            ''', (self.owner, time.time())).rowcount
+            # 任务都已结束但批次还留着简历和授权码的 (收尾前进程退出)，一并收尾
+            for (batch_id,) in conn.execute('''
+                SELECT id FROM send_batches b WHERE (status != 'done' OR smtp_pass IS NOT NULL OR resume IS NOT NULL)
+                  AND NOT EXISTS (SELECT 1 FROM send_tasks t WHERE t.batch_id = b.id AND t.status IN ('pending', 'sending'))
+            ''').fetchall():
+                self._close_batch(conn, batch_id)
+        return resumed
+
+    def enqueue(self, provider, jobs, file_name, resume, smtp=None):
+        """登记一次投递，返回 batch_id；jobs 需已过滤掉没有邮箱的职位
+
+        SMTP 授权码加密后写库，未安装 cryptography 时抛出 SendError。
+        """
+        batch_id = uuid.uuid4().hex
+        smtp_host, smtp_port, smtp_user, smtp_pass = smtp or (None, None, None, None)
+        smtp_pass = encrypt_secret(smtp_pass) if smtp_pass and jobs else None
+        with job_writer.transaction() as conn:
+            conn.execute('''
+                INSERT INTO send_batches (id, provider, status, file_name, resume, smtp_host, smtp_port, smtp_user, smtp_pass)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (batch_id, provider, 'running' if jobs else 'done', file_name,
+                  resume if jobs else None, smtp_host, smtp_port, smtp_user, smtp_pass))
+            conn.executemany(
+                'INSERT INTO send_tasks (batch_id, job_id, email, title) VALUES (?, ?, ?, ?)',
+                [(batch_id, job['id'], job['email'], job.get('title') or 'Position') for job in jobs])
+        # 本进程就是调度进程时 (开发服务器) 立即唤醒发送线程，否则由调度进程在 SEND_IDLE_POLL 秒内取走
+        self.wake.set()
+        return batch_id
+
+    def status(self, batch_id):
+        with db_reader.connection() as conn:
+            batch = conn.execute(
+                'SELECT provider, status, file_name, created_at, finished_at FROM send_batches WHERE id = ?',
+                (batch_id,)).fetchone()
+            if batch is None: return None
+            rows = conn.execute('''
+                SELECT job_id, email, title, status, attempts, next_attempt_at, last_error
+                FROM send_tasks WHERE batch_id = ? ORDER BY id
+            ''', (batch_id,)).fetchall()
+        counts = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        tasks = []
+        for job_id, email, title, status, attempts, next_attempt_at, last_error in rows:
+            counts[status] += 1
+            tasks.append({
+                'job_id': job_id, 'email': email, 'title': title, 'status': status, 'attempts': attempts,
+                'next_attempt_at': next_attempt_at if status == 'pending' and attempts else None,
+                'error': last_error,
+            })
+        provider, status, file_name, created_at, finished_at = batch
+        return {
+            'batch_id': batch_id, 'provider': provider, 'status': status, 'file_name': file_name,
+            'created_at': created_at, 'finished_at': finished_at,
+            'total': len(tasks), 'counts': counts, 'tasks': tasks,
+        }
 
-    # 如果令牌无效或过期，尝试刷新
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    def _bucket(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if key == 'gmail':
+                    bucket = TokenBucket(GMAIL_SEND_RATE, GMAIL_SEND_BURST)
+                else:
+                    bucket = TokenBucket(SEND_RATE, SEND_BURST)
+                self.buckets[key] = bucket
+            return bucket
+
+    def _throttle(self, key, e):
+        """服务商限流：暂停该服务商的令牌桶，连续被限流时等待时间翻倍
+
+        多个线程在同一暂停期内收到的限流响应只算一次，不会叠加放大等待时间。
+        """
+        with self.lock:
+            now = time.monotonic()
+            streak, until = self.throttled.get(key, (0, 0))
+            if now < until:
+                return until - now
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = min(SEND_RETRY_MAX, 2 ** streak) * random.uniform(0.5, 1)
+            self.throttled[key] = (streak + 1, now + delay)
+        self._bucket(key).pause(delay)
+        return delay
+
+    def _batch(self, batch_id):
+        """批次配置 (授权码已解密) 和编码好的简历模板，按 batch_id 缓存；在写锁外调用 (模板要对整份简历做 base64)"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            with db_reader.connection() as conn:
+                row = conn.execute('''
+                    SELECT provider, file_name, resume, smtp_host, smtp_port, smtp_user, smtp_pass
+                    FROM send_batches WHERE id = ?
+                ''', (batch_id,)).fetchone()
+            if row is None:
+                raise SendError(f"批次 {batch_id} 不存在")
+            provider, file_name, resume = row[:3]
+            batch = SendBatch(provider, ResumeTemplate(file_name, resume or b''), *row[3:6],
+                              decrypt_secret(row[6]) if row[6] else None)
+            with self.lock:
+                self.batches[batch_id] = batch
+        return batch
+
+    def _claim(self):
+        """取一个到期且所属服务商有令牌的任务并标记为 sending；没有时返回 (None, 建议等待秒数)"""
+        now = time.time()
+        wait = SEND_IDLE_POLL
+        with job_writer.transaction() as conn:
+            # 令牌桶只需要服务商和主机，直接连表取出，不在写锁内读取批次
+            rows = conn.execute('''
+                SELECT t.id, t.batch_id, t.email, t.title, t.attempts, b.provider, b.smtp_host
+                FROM send_tasks t JOIN send_batches b ON b.id = t.batch_id
+                WHERE t.status = 'pending' AND t.next_attempt_at <= ?
+                ORDER BY t.next_attempt_at, t.id LIMIT ?
+            ''', (now, SEND_CLAIM_SCAN)).fetchall()
+            for row in rows:
+                task = SendTask(*row[:5])
+                bucket_wait = self._bucket(provider_key(*row[5:])).try_acquire()
+                if bucket_wait:
+                    wait = min(wait, bucket_wait)
+                    continue
+                conn.execute("UPDATE send_tasks SET status = 'sending', claimed_by = ? WHERE id = ?", (self.owner, task.id))
+                return task, 0
+            if not rows:
+                due = conn.execute("SELECT MIN(next_attempt_at) FROM send_tasks WHERE status = 'pending'").fetchone()[0]
+                if due is not None:
+                    wait = min(wait, max(0, due - now))
+        return None, wait
+
+    def _run(self, stopping):
+        while not stopping.is_set():
             try:
-                creds.refresh(Request())
-                print("[*] 令牌已刷新")
+                task, wait = self._claim()
             except Exception as e:
-                print(f"[!] 刷新令牌失败: {e}")
-                creds = None
+                log.error(f"投递队列读取失败: {e}")
+                task, wait = None, SEND_IDLE_POLL
+            if task is None:
+                if wait >= SEND_IDLE_POLL: smtp_pool.expire_idle()
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            self._process(task)
+
+    def _process(self, task):
+        attempts = task.attempts + 1
+        try:
+            batch = self._batch(task.batch_id)
+        except Exception as e:
+            log.error(f"读取投递批次失败 ({task.email}): {e}")
+            self._finish(task, 'failed', attempts, 0, str(e))
+            return
+        key = provider_key(batch.provider, batch.smtp_host)
+        started = time.perf_counter()
+        try:
+            self._send(batch, task)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            if gmail_rate_limited(e):
+                SEND_SECONDS.observe(elapsed, provider=batch.provider, result='throttled')
+                # 限流不是这封邮件的问题，不计入重试次数
+                delay = self._throttle(key, e)
+                log.warning(f"Gmail 限流，{delay:.0f} 秒后继续发送")
+                self._finish(task, 'pending', task.attempts, time.time() + delay, str(e))
+            elif is_transient_send_error(e) and attempts < SEND_MAX_ATTEMPTS:
+                delay = min(SEND_RETRY_MAX, SEND_RETRY_BASE * 2 ** task.attempts) * random.uniform(0.5, 1)
+                log.error(f"发送到 {task.email} 失败 (第 {attempts} 次)，{delay:.0f} 秒后重试: {e}")
+                SEND_SECONDS.observe(elapsed, provider=batch.provider, result='retry')
+                self._finish(task, 'pending', attempts, time.time() + delay, str(e))
+            else:
+                log.error(f"发送失败到 {task.email}: {e}")
+                SEND_SECONDS.observe(elapsed, provider=batch.provider, result='failed')
+                self._finish(task, 'failed', attempts, 0, str(e))
+            return
+        SEND_SECONDS.observe(time.perf_counter() - started, provider=batch.provider, result='sent')
+        if self.throttled.get(key):
+            with self.lock:
+                self.throttled.pop(key, None)
+        self._finish(task, 'sent', attempts, 0, None)
+
+    def _finish(self, task, status, attempts, next_attempt_at, error):
+        with job_writer.transaction() as conn:
+            owned = conn.execute('''
+                UPDATE send_tasks SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,
+                    claimed_by = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'sending' AND claimed_by IS ?
+            ''', (status, attempts, next_attempt_at, error, task.id, self.owner)).rowcount
+            if not owned:
+                # 本进程卡住太久、租约过期后任务已被新的调度进程恢复，结果以那边为准
+                log.warning(f"投递任务 {task.id} 已被其他调度进程接管，丢弃本次结果 ({status})")
+                return
+            remaining = conn.execute(
+                "SELECT 1 FROM send_tasks WHERE batch_id = ? AND status IN ('pending', 'sending') LIMIT 1",
+                (task.batch_id,)).fetchone()
+            if remaining is None:
+                self._close_batch(conn, task.batch_id)
+        if remaining is not None and status == 'pending':
+            self.wake.set()
+
+    def _close_batch(self, conn, batch_id):
+        """批次的任务全部结束 (发出或失败) 后收尾：不再保留简历和 SMTP 授权码"""
+        conn.execute('''
+            UPDATE send_batches SET status = 'done', resume = NULL, smtp_pass = NULL,
+                finished_at = COALESCE(finished_at, CURRENT_TIMESTAMP)
+            WHERE id = ?
+        ''', (batch_id,))
+        with self.lock:
+            self.batches.pop(batch_id, None)
+
+    def _send(self, batch, task):
+        if batch.provider == 'gmail':
+            creds = get_gmail_credentials()
+            if not creds:
+                raise SendError("Gmail未授权")
+            sender = creds.id_token['email'] if hasattr(creds, 'id_token') and creds.id_token else 'me'
+            gmail_send(gmail_client.service(creds), batch.template.render(sender, task.email, task.title))
         else:
-            print("[*] 无有效令牌，需要重新授权")
+            parts = batch.template.render(batch.smtp_user, task.email, task.title)
+            if not batch.smtp_pass:
+                raise SendError("SMTP 配置缺失")
+            with smtp_pool.connection(batch.smtp_host, batch.smtp_port, batch.smtp_user, batch.smtp_pass) as server:
+                smtp_send_parts(server, batch.smtp_user, task.email, parts)
 
-    return creds
+send_queue = SendQueue()
 
-def save_gmail_credentials(creds):
-    """保存Gmail API凭据到文件"""
-    with open(TOKEN_FILE, 'w') as token_file:
-        token_file.write(creds.to_json())
-    print(f"[*] 令牌已保存到 {TOKEN_FILE}")
+def unique_job_ids(job_ids):
+    """按提交顺序去重的 id 列表 (统一为字符串)"""
+    return list(dict.fromkeys(str(jid) for jid in job_ids))
+
+def select_send_targets(job_ids):
+    """按提交顺序取有邮箱的职位，同一重复簇 (同一条招聘的多次重发) 只投递一次"""
+    job_ids = unique_job_ids(job_ids)
+    jobs_by_id = find_jobs(job_ids)
+    targets = []
+    seen = set()
+    for jid in job_ids:
+        job = jobs_by_id.get(jid)
+        if not job or not job['email']: continue
+        cluster = job.get('canonical_id') or job['id']
+        if cluster in seen: continue
+        seen.add(cluster)
+        targets.append(job)
+    return targets
 
 # ================= 后台定时更新 =================
-def background_update():
-    """后台定时更新数据"""
-    while True:
-        try:
-            print(f"[*] [{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 开始定时更新...")
-            jobs = scraper.fetch_jobs(60)
-            print(f"[*] 定时更新完成，获取 {len(jobs)} 条数据")
-        except Exception as e:
-            print(f"[!] 定时更新失败: {e}")
-        # 每2小时更新一次
-        time.sleep(2 * 60 * 60)
+SCHEDULER_LEASE = 'scheduler'
+# 持有者定期续约；进程退出或卡住超过该时间后，其他进程接管抓取和投递
+SCHEDULER_LEASE_TTL = int(os.environ.get("SCHEDULER_LEASE_TTL", "300"))
+SCHEDULER_LEASE_RENEW = 30
+
+def scheduler_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _become_scheduler(owner):
+    """拿到租约后一次性的工作：补算旧数据的结构化字段，恢复频道调度状态，启动投递队列"""
+    try:
+        migrated = job_writer.backfill_structured_fields()
+        if migrated:
+            log.info(f"已为 {migrated} 条旧数据补算结构化薪资/地点字段")
+            refresh_snapshot()
+    except Exception as e:
+        log.error(f"结构化字段迁移失败: {e}")
+    get_channel_scheduler().restore()
+    # 发送线程和令牌桶只在租约持有者里运行，多个 web worker 不会各自按一份速率发送
+    send_queue.start(owner)
+
+def background_update(owner=None):
+    """后台定时更新数据
 
-# 启动后台更新线程
-update_thread = threading.Thread(target=background_update, daemon=True)
-update_thread.start()
-print("[*] 后台定时更新线程已启动 (每2小时更新一次)")
+    开发服务器的后台线程和 --worker 进程都运行这个循环，只有持有 scheduler 租约的一个实际抓取和投递。
+    退出循环 (--worker 收到 SIGTERM) 时释放租约，备用进程不必等租约过期。
+    """
+    owner = owner or scheduler_owner()
+    leader = False
+    renew_at = 0.0
+    # 旧数据的去重签名补算，获得租约后每轮推进一批，跑完 (或失去租约) 后置为 None
+    dedup = None
+    deduped = 0
+    maintenance_at = 0.0
+    try:
+        while True:
+            wait = SCHEDULER_LEASE_RENEW
+            try:
+                if time.monotonic() >= renew_at:
+                    renew_at = time.monotonic() + SCHEDULER_LEASE_RENEW
+                    if job_writer.acquire_lease(SCHEDULER_LEASE, owner, SCHEDULER_LEASE_TTL):
+                        if not leader:
+                            leader = True
+                            maintenance_at = 0.0
+                            log.info(f"{owner} 获得调度租约，频道: {', '.join(get_channel_scheduler().states)}")
+                            _become_scheduler(owner)
+                            dedup, deduped = job_writer.dedup_batches(), 0
+                    elif leader:
+                        leader = False
+                        dedup = None
+                        send_queue.stop()
+                        log.warning(f"{owner} 的调度租约已被其他进程接管")
+                if leader:
+                    if time.time() >= maintenance_at:
+                        maintenance_at = maintenance_due_at()
+                        if time.time() >= maintenance_at:
+                            # 先推迟下次时间，维护失败时不会在每轮循环里重试
+                            maintenance_at = time.time() + MAINTENANCE_INTERVAL
+                            run_maintenance()
+                    wait = get_channel_scheduler().run_due()
+                    if dedup is not None:
+                        batch = next(dedup, None)
+                        if batch is None:
+                            dedup = None
+                            if deduped: log.info(f"已为 {deduped} 条旧数据补算去重签名")
+                        else:
+                            # 还有待补算的行：不等到下一个频道到期，尽快进入下一轮
+                            deduped += batch
+                            wait = 0
+            except Exception as e:
+                log.exception(f"定时更新失败: {e}")
+            time.sleep(max(0.5, min(wait, renew_at - time.monotonic())))
+    finally:
+        if leader:
+            send_queue.stop()
+            job_writer.release_lease(SCHEDULER_LEASE, owner)
 
-@app.route('/api/jobs', methods=['GET'])
+@api.route('/api/jobs', methods=['GET'])
 def get_jobs():
+    """分页查询职位
+
+    参数: type, tag, tag_contains (逗号分隔，任一标签包含任一关键词), contains (逗号分隔，公司/岗位/地点/原文包含全部关键词),
+    company, date_from, date_to, days, has_email, salary_min / salary_max (原币种区间上限的下界/上界),
+    salary_usd_min (美元月薪), remote, work_mode (remote/hybrid/onsite), include_duplicates,
+    limit, cursor (上一页返回的 next_cursor), fields (逗号分隔的字段投影),
+    format (json/columnar/msgpack，见 LIST_FORMATS)
+    """
+    try:
+        query = parse_job_query(request.args)
+        fmt = parse_list_format(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+
+    try:
+        # 数据库完全为空时 (首次启动)，同步爬取一次
+        if (current_app.config.get('INLINE_SCRAPE') and query['cursor'] is None
+                and not get_snapshot().jobs and count_jobs() == 0):
+            log.info("数据库无数据，开始爬取...")
+            get_channel_scheduler().poll_all()
+        key = ResponseCache.key(request.args.items(multi=True))
+        entry = response_cache.get(data_version(), key, lambda: jobs_payload(query, fmt),
+                                   'msgpack' if fmt == 'msgpack' else 'json')
+    except Exception as e:
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+
+    return entry.to_response()
+
+@api.route('/api/facets', methods=['GET'])
+def get_facets():
+    """各维度 (type, tag, title, company) 的职位计数
+
+    参数: 与 /api/jobs 相同的筛选条件, facets (逗号分隔，默认全部), limit (每个维度的个数)
+    """
+    try:
+        query = parse_facet_query(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+
+    try:
+        key = ResponseCache.key(request.args.items(multi=True))
+        entry = facets_cache.get(data_version(), key, lambda: {"facets": query_facets(**query)})
+    except Exception as e:
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+
+    return entry.to_response()
+
+@api.route('/api/jobs/changes', methods=['GET'])
+def get_job_changes():
+    """增量同步: since (上次拿到的 version 或 /api/jobs 返回的 change_version), fields, include_duplicates
+
+    has_more 为 true 时用返回的 version 继续请求；reset 为 true 时需要重新全量加载。
+    """
+    try:
+        since = _parse_since(request.args.get('since'))
+        query = parse_job_query(request.args)
+        feed = changes_since(since, query['fields'], query['filters'].get('include_duplicates', False))
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    except Exception as e:
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+    return jsonify(feed)
+
+@api.route('/api/jobs/stream', methods=['GET'])
+def stream_job_changes():
+    """SSE 推送变更：每个事件的 data 与 /api/jobs/changes 的返回相同，id 为 version
+
+    起点依次取断线重连时浏览器带的 Last-Event-ID、since 参数、当前最新版本。
+    连接保持 STREAM_MAX_AGE 秒后结束，由浏览器重连；并发连接数已满时返回 503。
+    """
     try:
-        # 首先尝试从数据库加载
-        db_jobs = load_jobs_from_db(60)  # 加载60天内的数据
-        if db_jobs:
-            scraper.cached_jobs = db_jobs
-            print(f"[*] 从数据库加载 {len(db_jobs)} 条数据")
-            return jsonify(db_jobs)
+        start = request.headers.get('Last-Event-ID') or request.args.get('since')
+        since = _parse_since(start) if start else latest_change_version()
+        query = parse_job_query(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    fields, include_duplicates = query['fields'], query['filters'].get('include_duplicates', False)
+    if not _stream_slots.acquire(blocking=False):
+        response = jsonify({"status": "error", "msg": "推送连接数已满，请改用 /api/jobs/changes 轮询"})
+        response.headers['Retry-After'] = str(int(STREAM_MAX_AGE))
+        return response, 503
+
+    def events(version):
+        yield "retry: 3000\n\n"
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        idle_since = time.monotonic()
+        while time.monotonic() < deadline:
+            feed = changes_since(version, fields, include_duplicates)
+            if feed['reset']:
+                version = feed['version']
+                yield f"id: {version}\nevent: reset\ndata: {json.dumps(feed)}\n\n"
+                idle_since = time.monotonic()
+            elif feed['changes']:
+                version = feed['version']
+                yield f"id: {version}\nevent: changes\ndata: {json.dumps(feed, ensure_ascii=False)}\n\n"
+                idle_since = time.monotonic()
+                if feed['has_more']: continue
+            elif time.monotonic() - idle_since >= STREAM_HEARTBEAT:
+                # 注释行作为心跳，防止代理断开空闲连接，也让服务端及时发现客户端已离开
+                yield ": ping\n\n"
+                idle_since = time.monotonic()
+            wait_for_changes(min(STREAM_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+        # 只有 id 没有 data 的消息不会触发事件，但会更新浏览器的 Last-Event-ID，重连从这里继续
+        yield f"id: {version}\n\n"
+
+    response = Response(events(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 生成器结束或客户端断开时 WSGI 服务器会 close 响应，在那里归还连接名额
+    response.call_on_close(_stream_slots.release)
+    return response
+
+# 详情接口单次最多取的职位数，与列表页大小同一量级
+MAX_DETAIL_IDS = 100
+
+@api.route('/api/jobs/details', methods=['GET'])
+def get_job_details():
+    """批量取职位详情 (含 raw_content)：ids 逗号分隔，已归档的从归档库取；不存在的 id 列在 missing 里"""
+    ids = list(dict.fromkeys(i.strip() for i in request.args.get('ids', '').split(',') if i.strip()))
+    if not ids:
+        return jsonify({"status": "error", "msg": "缺少 ids"}), 400
+    if len(ids) > MAX_DETAIL_IDS:
+        return jsonify({"status": "error", "msg": f"ids 最多 {MAX_DETAIL_IDS} 个"}), 400
+    try:
+        found = load_jobs_by_ids(ids)
+        found.update(archive_store.load([i for i in ids if i not in found]))
+    except Exception as e:
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+    return jsonify({
+        "jobs": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],
+    })
+
+@api.route('/api/jobs/<path:job_id>', methods=['GET'])
+def get_job_detail(job_id):
+    """单个职位的完整字段 (含 raw_content)；id 形如 频道名/序号，所以用 path 转换器"""
+    try:
+        job = load_jobs_by_ids([job_id]).get(job_id) or archive_store.load([job_id]).get(job_id)
     except Exception as e:
-        print(f"[!] 数据库读取失败: {e}")
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+    if job is None:
+        return jsonify({"status": "error", "msg": "职位不存在"}), 404
+    return jsonify(job)
 
-    # 数据库无数据或读取失败，则爬取
-    print("[*] 数据库无数据，开始爬取...")
-    if not scraper.cached_jobs:
-        scraper.fetch_jobs(60)
-    return jsonify(scraper.cached_jobs)
+@api.route('/api/channels', methods=['GET'])
+def get_channels():
+    """各频道的调度状态：间隔、发帖速率、吞吐、滞后、游标和库内职位数"""
+    try:
+        return jsonify({"channels": channel_status_report()})
+    except Exception as e:
+        log.exception(f"数据库读取失败: {e}")
+        return jsonify({"status": "error", "msg": f"数据库读取失败: {str(e)}"}), 500
+
+@api.route('/api/jobs/search', methods=['GET'])
+def search_jobs_api():
+    """全文检索职位: q (必填), limit, days, fields (逗号分隔的字段投影，默认 SEARCH_FIELDS)，
+    以及与 /api/jobs 相同的筛选条件 (type, tag_contains, salary_min/salary_max 等)；
+    archive: true 时结果不足 limit 再查归档库，days 超过保留期时自动打开。归档库只支持 ARCHIVE_FILTERS 里的条件，
+    归档结果按日期倒序排在后面，带 archived: true"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"status": "error", "msg": "缺少搜索词 q"}), 400
+    try:
+        days = _parse_days_arg(request.args.get('days', DEFAULT_LOOKBACK_DAYS))
+        query = parse_job_query(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"status": "error", "msg": "limit 必须是整数"}), 400
+    try:
+        include_archive = (_parse_bool_arg(request.args['archive'], 'archive') if request.args.get('archive')
+                           else days > RETENTION_DAYS and set(query['filters']) <= ARCHIVE_FILTERS)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": str(e)}), 400
+    if include_archive and not set(query['filters']) <= ARCHIVE_FILTERS:
+        return jsonify({"status": "error", "msg": f"归档搜索只支持 {', '.join(sorted(ARCHIVE_FILTERS))} 筛选"}), 400
+
+    fields = query['fields'] if request.args.get('fields') else SEARCH_FIELDS
+    try:
+        results = search_jobs(q, limit=limit, days=days, filters=query['filters'], fields=fields)
+        if include_archive and len(results) < limit:
+            results += archive_store.search(q.split(), query['filters'], limit - len(results), fields)
+    except Exception as e:
+        log.exception(f"搜索失败: {e}")
+        return jsonify({"status": "error", "msg": f"搜索失败: {str(e)}"}), 500
+    return jsonify({"jobs": results})
 
-@app.route('/api/send-resume', methods=['POST'])
+@api.route('/api/send-resume', methods=['POST'])
 def send_resume_real():
     # 1. 验证文件
     if 'resume' not in request.files: return jsonify({"status": "error", "msg": "未找到简历"}), 400
@@ -408,61 +4228,47 @@ def send_resume_real():
     smtp_user = request.form.get('smtp_user')
     smtp_pass = request.form.get('smtp_pass')
     smtp_host = request.form.get('smtp_host', 'smtp.qq.com') # 默认QQ
-    smtp_port = int(request.form.get('smtp_port', 587))
+    try:
+        smtp_port = int(request.form.get('smtp_port', 587))
+        if not 1 <= smtp_port <= 65535: raise ValueError
+    except ValueError:
+        return jsonify({"status": "error", "msg": "smtp_port 必须是 1-65535 之间的整数"}), 400
 
     if not smtp_user or not smtp_pass:
         return jsonify({"status": "error", "msg": "请填写邮箱配置"}), 400
 
     try:
         job_ids = json.loads(request.form.get('jobIds'))
+        if not isinstance(job_ids, list): raise ValueError
     except: return jsonify({"status": "error", "msg": "职位ID解析失败"}), 400
+    if Fernet is None:
+        return jsonify({"status": "error", "msg": "SMTP 投递需要安装 cryptography (pip install cryptography)"}), 500
 
-    file_content = file.read()
-    file_name = file.filename
-    success_count = 0
-    failed_jobs = []
-
-    print(f"[*] 用户 {smtp_user} 正在投递 {len(job_ids)} 个职位...")
-
+    # 先同步校验一次登录，授权码错误时直接告诉用户，而不是让整批任务在后台失败；
+    # 登录好的连接放回连接池，后台发送直接复用
     try:
-        # 动态连接 SMTP
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-
-        for jid in job_ids:
-            target_job = next((j for j in scraper.cached_jobs if str(j['id']) == str(jid)), None)
-            if not target_job or not target_job['email']: continue
-
-            target_email = target_job['email']
-            job_title = target_job.get('title', 'Position')
-            
-            msg = MIMEMultipart()
-            msg['From'] = smtp_user
-            msg['To'] = target_email
-            msg['Subject'] = f"应聘：{job_title} - {file_name.replace('.pdf', '')}"
-
-            body = f"""您好，\n\n我对贵公司发布的 [{job_title}] 职位非常感兴趣。\n附件是我的个人简历，请查收。\n\n期待您的回复。"""
-            msg.attach(MIMEText(body, 'plain'))
-
-            part = MIMEApplication(file_content, Name=file_name)
-            part['Content-Disposition'] = f'attachment; filename="{file_name}"'
-            msg.attach(part)
-
-            try:
-                server.send_message(msg)
-                success_count += 1
-                time.sleep(2)
-            except Exception as e:
-                failed_jobs.append(target_email)
-
-        server.quit()
-        return jsonify({"status": "success", "sent": success_count, "failed": len(failed_jobs)})
-
+        with smtp_pool.connection(smtp_host, smtp_port, smtp_user, smtp_pass):
+            pass
     except Exception as e:
         return jsonify({"status": "error", "msg": f"邮箱登录失败: {str(e)}，请检查授权码"}), 500
 
-@app.route('/api/oauth2/auth')
+    job_ids = unique_job_ids(job_ids)
+    jobs = select_send_targets(job_ids)
+    batch_id = send_queue.enqueue('smtp', jobs, file.filename, file.read(),
+                                  smtp=(smtp_host, smtp_port, smtp_user, smtp_pass))
+    log.info(f"用户 {smtp_user} 提交投递 {len(jobs)} 个职位，批次 {batch_id}")
+    return jsonify({"status": "queued", "batch_id": batch_id, "queued": len(jobs),
+                    "skipped": len(job_ids) - len(jobs)}), 202
+
+@api.route('/api/send-batches/<batch_id>')
+def send_batch_status(batch_id):
+    """投递批次进度：每个收件人的状态、重试次数和错误信息"""
+    status = send_queue.status(batch_id)
+    if status is None:
+        return jsonify({"status": "error", "msg": "批次不存在"}), 404
+    return jsonify(status)
+
+@api.route('/api/oauth2/auth')
 def oauth2_auth():
     """开始Gmail OAuth2授权流程"""
     # 检查是否配置了客户端ID和密钥
@@ -499,13 +4305,13 @@ def oauth2_auth():
         })
 
     except Exception as e:
-        print(f"[!] OAuth2授权URL生成失败: {e}")
+        log.error(f"OAuth2授权URL生成失败: {e}")
         return jsonify({
             "status": "error",
             "msg": f"OAuth2配置错误: {str(e)}"
         }), 500
 
-@app.route('/oauth2callback')
+@api.route('/oauth2callback')
 def oauth2_callback():
     """OAuth2回调处理"""
     # 验证state
@@ -534,10 +4340,10 @@ def oauth2_callback():
         return redirect('/?oauth2_success=true')
 
     except Exception as e:
-        print(f"[!] OAuth2回调处理失败: {e}")
+        log.error(f"OAuth2回调处理失败: {e}")
         return f"授权失败: {str(e)}", 400
 
-@app.route('/api/send-resume-gmail', methods=['POST'])
+@api.route('/api/send-resume-gmail', methods=['POST'])
 def send_resume_gmail():
     """使用Gmail API发送简历"""
     # 1. 验证文件
@@ -556,76 +4362,18 @@ def send_resume_gmail():
 
     try:
         job_ids = json.loads(request.form.get('jobIds'))
+        if not isinstance(job_ids, list): raise ValueError
     except:
         return jsonify({"status": "error", "msg": "职位ID解析失败"}), 400
 
-    file_content = file.read()
-    file_name = file.filename
-    success_count = 0
-    failed_jobs = []
+    job_ids = unique_job_ids(job_ids)
+    jobs = select_send_targets(job_ids)
+    batch_id = send_queue.enqueue('gmail', jobs, file.filename, file.read())
+    log.info(f"使用Gmail API提交投递 {len(jobs)} 个职位，批次 {batch_id}")
+    return jsonify({"status": "queued", "batch_id": batch_id, "queued": len(jobs),
+                    "skipped": len(job_ids) - len(jobs)}), 202
 
-    print(f"[*] 使用Gmail API投递 {len(job_ids)} 个职位...")
-
-    try:
-        # 创建Gmail服务
-        service = build('gmail', 'v1', credentials=creds)
-
-        for jid in job_ids:
-            target_job = next((j for j in scraper.cached_jobs if str(j['id']) == str(jid)), None)
-            if not target_job or not target_job['email']:
-                continue
-
-            target_email = target_job['email']
-            job_title = target_job.get('title', 'Position')
-
-            # 创建邮件
-            message = MIMEMultipart()
-            message['to'] = target_email
-            message['from'] = creds.id_token['email'] if hasattr(creds, 'id_token') and creds.id_token else 'me'
-            message['subject'] = f"应聘：{job_title} - {file_name.replace('.pdf', '')}"
-
-            # 添加正文
-            body = f"""您好，\n\n我对贵公司发布的 [{job_title}] 职位非常感兴趣。\n附件是我的个人简历，请查收。\n\n期待您的回复。"""
-            message.attach(MIMEText(body, 'plain'))
-
-            # 添加附件
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(file_content)
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename="{file_name}"')
-            message.attach(part)
-
-            # 编码邮件
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-
-            try:
-                # 发送邮件
-                service.users().messages().send(
-                    userId='me',
-                    body={'raw': raw_message}
-                ).execute()
-
-                success_count += 1
-                time.sleep(2)  # 避免速率限制
-
-            except Exception as e:
-                print(f"[!] 发送失败到 {target_email}: {e}")
-                failed_jobs.append(target_email)
-
-        return jsonify({
-            "status": "success",
-            "sent": success_count,
-            "failed": len(failed_jobs)
-        })
-
-    except Exception as e:
-        print(f"[!] Gmail API错误: {e}")
-        return jsonify({
-            "status": "error",
-            "msg": f"Gmail发送失败: {str(e)}"
-        }), 500
-
-@app.route('/api/oauth2/status')
+@api.route('/api/oauth2/status')
 def oauth2_status():
     """检查OAuth2授权状态"""
     creds = get_gmail_credentials()
@@ -640,10 +4388,111 @@ def oauth2_status():
             "msg": "未授权或令牌已过期"
         })
 
-@app.route('/')
+# ================= 请求指标与性能分析 =================
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.headers.get(PROFILE_HEADER) == '1':
+        g.profiler = pyinstrument.Profiler() if pyinstrument else cProfile.Profile()
+        if pyinstrument: g.profiler.start()
+        else: g.profiler.enable()
+
+@api.after_app_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response = profile_report(profiler)
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                 endpoint=endpoint, method=request.method, status=response.status_code)
+    # 流式响应 (SSE) 的长度未知，也不能提前读出来
+    if not response.is_streamed:
+        HTTP_RESPONSE_BYTES.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+    return response
+
+def profile_report(profiler):
+    """停止分析器，把报告作为纯文本响应返回 (视图本身的响应被丢弃)"""
+    if pyinstrument:
+        profiler.stop()
+        report = profiler.output_text(unicode=True, color=False)
+    else:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        report = out.getvalue()
+    response = Response(report, mimetype='text/plain')
+    response.headers['X-Profile-Backend'] = 'pyinstrument' if pyinstrument else 'cProfile'
+    return response
+
+@api.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/')
 def serve_index():
     return send_file('index.html')
 
+# ================= 应用入口 =================
+def create_app(inline_scrape=False):
+    """创建 Flask 应用
+
+    不建表、不抓取、不启动后台线程，可以放心地在多个 WSGI worker 里各创建一份。
+    迁移和后台任务由 python bacnked.py --worker (或开发服务器) 负责。
+    inline_scrape: 数据库为空时在请求里同步抓取一次，只在单进程的开发服务器里打开。
+    """
+    setup_logging()
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+    app.config['INLINE_SCRAPE'] = inline_scrape
+    CORS(app)
+    app.register_blueprint(api)
+    return app
+
 if __name__ == '__main__':
-    print("Server running on http://localhost:5000")
-    app.run(port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    setup_logging()
+    init_db()
+    if '--migrate' in sys.argv:
+        sys.exit(0)
+    if '--backfill' in sys.argv or '--backfill-reset' in sys.argv:
+        for channel_scraper in get_channel_scheduler().scrapers:
+            channel_scraper.backfill(reset='--backfill-reset' in sys.argv)
+        sys.exit(0)
+    if '--dedup' in sys.argv:
+        log.info(f"已为 {job_writer.dedup_pending()} 条旧数据补算去重签名")
+        refresh_snapshot()
+        sys.exit(0)
+    if '--maintenance' in sys.argv:
+        run_maintenance()
+        sys.exit(0)
+    if '--vacuum' in sys.argv:
+        vacuum_full()
+        log.info("已重建数据库并切换到增量 VACUUM")
+        sys.exit(0)
+    if '--reparse' in sys.argv:
+        log.info(f"已为 {job_writer.backfill_structured_fields()} 条旧数据补算结构化字段")
+        refresh_snapshot()
+        sys.exit(0)
+    if '--worker' in sys.argv:
+        # 生产环境的后台进程：web 由 wsgi.py 在 gunicorn 等服务器下运行
+        log.info(f"调度进程已启动 ({len(get_channel_scheduler().states)} 个频道)")
+        # 被 kill / systemd 停止时正常退出，background_update 在 finally 里释放租约
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if WORKER_METRICS_PORT:
+            serve_metrics(WORKER_METRICS_PORT)
+            log.info(f"指标: http://{METRICS_HOST}:{WORKER_METRICS_PORT}/metrics")
+        background_update()
+        sys.exit(0)
+    # 开发模式：单进程里同时运行开发服务器和后台更新线程
+    update_thread = threading.Thread(target=background_update, daemon=True)
+    update_thread.start()
+    log.info(f"后台定时更新线程已启动 ({len(get_channel_scheduler().states)} 个频道)")
+    log.info("Server running on http://localhost:5000")
+    try:
+        create_app(inline_scrape=True).run(port=5000, debug=True, use_reloader=False)
+    finally:
+        # 后台线程是 daemon 线程，不会走到自己的 finally，由主线程释放租约
+        send_queue.stop()
+        job_writer.release_lease(SCHEDULER_LEASE, scheduler_owner())
\ No newline at end of file
@@ -0,0 +1,1103 @@
+"""easyJob 性能与回归测试工具
+
+用法:
+    python benchmark.py gen-corpus DIR [--pages N] [--seed S]   生成合成的频道页面语料
+    python benchmark.py save-corpus DIR [--pages N]             从 t.me 抓取真实频道页面保存为语料
+    python benchmark.py parser-diff DIR [--golden F | --write-golden F]
+                                                                对比各解析引擎与参考实现的 job_data 输出
+    python benchmark.py parse [--messages N] [--output F] [--baseline F]
+                                                                解析吞吐 (条/秒)，可与上次结果对比
+    python benchmark.py fake-gmail [--port P] [--quota Q]       启动本地假 Gmail API (配合 GMAIL_API_ROOT)
+    python benchmark.py gmail [--messages N] [--concurrency C] [--quota Q] [--size B]
+                                                                经假 Gmail API 的发送吞吐 (封/秒)
+    python benchmark.py fake-smtp [--port P] [--latency S]      启动本地假 SMTP 服务 (需要 aiosmtpd)
+    python benchmark.py smtp [--messages N] [--concurrency C] [--latency S] [--size B]
+                                                                经假 SMTP 的发送吞吐 (封/秒)，对比连接池与每封新建连接
+    python benchmark.py fake-tme [--port P] [--pages N] [--latency S]
+                                                                启动本地假 t.me/s 频道 (合成的分页 HTML)
+    python benchmark.py scrape [--pages N] [--new-pages N] [--workers W]
+                                                                经假 t.me 的抓取/解析/入库吞吐 (临时数据库)
+    python benchmark.py seed-db PATH [--rows N] [--days D]      用合成职位填充数据库 (1 万 ~ 100 万条)
+    python benchmark.py load [--db PATH | --url URL] [--duration S] [--concurrency C] [--send]
+                                                                对 /api/jobs、搜索、facets、详情 (和投递) 接口压测，p50/p99 与 RSS
+    python benchmark.py suite [--rows N] [--output F] [--baseline F]
+                                                                依次运行 parse、scrape、seed-db、load，结果合并写入一个 JSON
+
+除假服务外，各命令都支持 --output 写出 JSON 结果、--baseline 与之前的结果对比；
+吞吐类指标越大越好，*_ms、*_mb 类指标越小越好。
+
+parser-diff 以 BeautifulSoup(html.parser) + 冻结的基线解析器 (BaselineJobParser) 为参考实现，
+逐页、逐字段比较各解析引擎的结果，有任何差异时退出码为 1。
+也可用 --write-golden 把参考输出存为文件，之后用 --golden 对比。
+"""
+import argparse
+import asyncio
+import datetime
+import html
+import itertools
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import math
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+import bacnked
+
+# ================= 合成语料 =================
+COMPANIES = ["Marisa", "OKX Ventures", "Bitget", "链上数据科技", "Polygon Labs", "SafePal", "MetaMask", "某交易所", "Web3 游戏工作室", "DeFi Protocol"]
+TITLES = ["Solidity工程师", "后端开发工程师", "前端工程师", "运营经理", "市场专员", "BD经理", "产品设计师", "量化交易员", "社区运营实习生", "技术负责人"]
+EXTRA_TAGS = ["远程", "全职", "兼职", "实习", "外包", "Web3", "DeFi", "Remote", "Crypto", "GameFi", "NFT", "钱包"]
+SALARY_LINES = ["薪资：20k-30k", "Salary: 3000-5000U", "待遇：$5000/month", "薪资范围: 15-25K·14薪", "Pay: 2000-4000 USDT", "薪资面议", "💰 8000-12000U/月"]
+BODY_LINES = [
+    "负责智能合约的设计、开发与审计",
+    "熟悉 EVM、Solidity 及常见 DeFi 协议",
+    "3 年以上相关工作经验，英语可作为工作语言",
+    "我们提供有竞争力的薪酬 &amp; 代币激励",
+    "工作地点：远程 / 新加坡",
+    "About us: we are building the next generation of on-chain infrastructure.",
+    "Requirements: strong communication skills &lt;English/Chinese&gt;",
+    "简历请注明&nbsp;应聘岗位",
+]
+
+def synthetic_message(rng, number, channel=bacnked.CHANNEL_USERNAME, date='2026-10-01'):
+    """生成一条与 t.me/s 页面结构一致的消息 HTML"""
+    kind = rng.random()
+    if kind < 0.08:
+        # 只有图片没有正文
+        body = '<a class="tgme_widget_message_photo_wrap" style="background-image:url(\'https://cdn.example/p.jpg\')"></a>'
+    elif kind < 0.18:
+        body = f'<div class="tgme_widget_message_text js-message_text" dir="auto">频道公告 <b>第 {number} 期</b><br/>欢迎投稿</div>'
+    else:
+        company = rng.choice(COMPANIES)
+        title = rng.choice(TITLES)
+        tags = [title] + rng.sample(EXTRA_TAGS, rng.randint(1, 3))
+        tag_html = ' '.join(f'<a href="?q=%23{html.escape(t)}">#{html.escape(t)}</a>' for t in ['招聘'] + tags)
+        company_line = rng.choice([f"项目：{company}", f"Company: {company}", f"<b>{company}</b> 正在招聘", f"【招聘】{company}"])
+        lines = [tag_html, company_line, rng.choice(SALARY_LINES)] + rng.sample(BODY_LINES, rng.randint(2, 5))
+        if rng.random() < 0.8:
+            email = f"hr{number}@{company.lower().replace(' ', '')}.io"
+            lines.append(f'邮箱：<a href="mailto:{email}">{email}</a>')
+        if rng.random() < 0.3:
+            lines.insert(1, '<i class="emoji" style="background-image:url(\'//telegram.org/img/emoji/40/F09F94A5.png\')"><b>🔥</b></i> 急招')
+        body = f'<div class="tgme_widget_message_text js-message_text" dir="auto">{"<br/>".join(lines)}</div>'
+    if rng.random() < 0.1:
+        body = ('<a class="tgme_widget_message_reply" href="https://t.me/x/1"><div class="tgme_widget_message_author">'
+                '<span class="tgme_widget_message_author_name">DeJob</span></div>'
+                '<div class="tgme_widget_message_metatext js-message_reply_text">上一条消息</div></a>') + body
+    return (f'<div class="tgme_widget_message_wrap js-widget_message_wrap">'
+            f'<div class="tgme_widget_message text_not_supported_wrap js-widget_message" data-post="{channel}/{number}" data-view="x">'
+            f'<div class="tgme_widget_message_bubble">{body}'
+            f'<div class="tgme_widget_message_footer compact js-message_footer"><div class="tgme_widget_message_info short js-message_info">'
+            f'<span class="tgme_widget_message_views">1.2K</span>'
+            f'<span class="tgme_widget_message_meta"><a class="tgme_widget_message_date" href="https://t.me/{channel}/{number}">'
+            f'<time datetime="{date}T08:30:00+00:00" class="time">08:30</time></a></span></div></div></div></div></div>\n')
+
+def synthetic_page(rng, top, total, channel=bacnked.CHANNEL_USERNAME, per_page=bacnked.PAGE_SPAN, after=False):
+    """生成一页频道 HTML：after=False 时为 top 及之前的 per_page 条，after=True 时为 top 之后的 per_page 条"""
+    if after:
+        numbers = list(range(top + 1, min(top + per_page, total) + 1))
+    else:
+        numbers = list(range(max(1, top - per_page + 1), top + 1))
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>DeJob</title></head><body>'
+             '<main class="tgme_main"><section class="tgme_channel_history js-message_history">']
+    if numbers and numbers[0] > 1:
+        parts.append(f'<a class="tme_messages_more js-messages_more" data-before="{numbers[0]}" href="/s/{channel}?before={numbers[0]}"></a>')
+    for n in numbers:
+        day = 1 + (total - n) // 40
+        parts.append(synthetic_message(rng, n, channel, date=f"2026-{10 - min(day // 28, 8):02d}-{28 - day % 28:02d}"))
+    if after and numbers and numbers[-1] < total:
+        parts.append(f'<a class="tme_messages_more js-messages_more" data-after="{numbers[-1]}" href="/s/{channel}?after={numbers[-1]}"></a>')
+    parts.append('</section></main></body></html>')
+    return ''.join(parts)
+
+def gen_corpus(directory, pages, seed):
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    total = pages * bacnked.PAGE_SPAN
+    for i in range(pages):
+        top = total - i * bacnked.PAGE_SPAN
+        with open(os.path.join(directory, f"page_{i:04d}.html"), 'w', encoding='utf-8') as f:
+            f.write(synthetic_page(rng, top, total))
+    print(f"[*] 已生成 {pages} 页合成语料到 {directory}")
+
+def save_corpus(directory, pages):
+    os.makedirs(directory, exist_ok=True)
+    fetcher = bacnked.PageFetcher()
+    base_url = f"https://t.me/s/{bacnked.CHANNEL_USERNAME}"
+    url = base_url
+    for i in range(pages):
+        page_html = fetcher.fetch(url)
+        with open(os.path.join(directory, f"page_{i:04d}.html"), 'w', encoding='utf-8') as f:
+            f.write(page_html)
+        numbers = [bacnked.post_number(m) for m in re.findall(r'data-post="([^"]+)"', page_html)]
+        numbers = [n for n in numbers if n is not None]
+        print(f"[*] 已保存第 {i+1} 页 ({len(numbers)} 条消息)")
+        if not numbers or min(numbers) <= 1: break
+        url = f"{base_url}?before={min(numbers)}"
+
+# ================= 基线解析器 =================
+# a8ed4e2 (优化前) 的 JobParser 原样冻结于此，作为 parser-diff 的参考实现；
+# 不要修改这段代码，否则对比的就是新代码与它自己。
+class BaselineJobParser:
+    @staticmethod
+    def clean_string(text):
+        if not text: return ""
+        text = re.sub(r'[#＃].*', '', text)
+        text = re.sub(r'[^\w\s\u4e00-\u9fa5:：\.\-\(\)\+]', '', text)
+        text = re.sub(r'^[【\[]?(?:招聘|岗位|职位|Job|Hiring|Position)[\]】]?[:：]?\s*', '', text, flags=re.IGNORECASE)
+        return text.strip()
+
+    @staticmethod
+    def extract_max_salary(raw_text):
+        lines = raw_text.split('\n')
+        target_line = ""
+        for line in lines:
+            if any(k in line for k in ["薪资", "待遇", "Salary", "Pay", "U", "$"]):
+                if len(line) < 50 and re.search(r'\d', line):
+                    target_line = line
+                    break
+        if not target_line: return "面议"
+        numbers = re.findall(r'(\d+)', target_line)
+        if not numbers: return target_line
+        nums = [int(n) for n in numbers]
+        valid_nums = [n for n in nums if (n > 100 and n < 100000) or (n < 100 and 'k' in target_line.lower())]
+        if not valid_nums: return target_line
+        max_val = max(valid_nums)
+        unit = ""
+        lower_line = target_line.lower()
+        if "u" in lower_line: unit = "U"
+        elif "$" in target_line: unit = "$"
+        elif "k" in lower_line: unit = "k"
+        if unit == "k" and max_val < 1000: return f"{max_val}k"
+        return f"{max_val}{unit}"
+
+    @staticmethod
+    def parse_html_message(msg_div):
+        try:
+            text_div = msg_div.find('div', class_='tgme_widget_message_text')
+            if not text_div: return None
+            for br in text_div.find_all("br"): br.replace_with("\n")
+            raw_text = text_div.get_text()
+
+            if "#招聘" not in raw_text and "＃招聘" not in raw_text:
+                return None
+
+            time_span = msg_div.find('a', class_='tgme_widget_message_date')
+            date_str = datetime.date.today().strftime("%Y-%m-%d")
+            if time_span:
+                time_tag = time_span.find('time')
+                if time_tag and time_tag.has_attr('datetime'):
+                    date_str = time_tag['datetime'].split('T')[0]
+
+            hashtags = re.findall(r'[#＃]([\w\-\.\+\u4e00-\u9fa5]+)', raw_text)
+            unique_id = msg_div.get('data-post-id')
+            if not unique_id:
+                unique_id = f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+
+            job_data = {
+                "id": unique_id,
+                "date": date_str,
+                "raw_content": raw_text,
+                "tags": hashtags,
+                "type": "全职",
+                "location": "远程",
+                "email": "",
+                "company": "",
+                "title": ""
+            }
+
+            lines = [l.strip() for l in raw_text.split('\n') if l.strip()]
+            found_company = None
+            found_title = None
+
+            job_keywords = ["工程师", "运营", "市场", "实习生", "BD", "专员", "经理", "设计师", "交易员", "负责人"]
+            blacklist_tags = ["research", "socialfi", "defi", "web3", "crypto", "blockchain", "gamefi", "nft", "dao", "headhunter", "recruiter", "hiring", "job", "fulltime", "parttime", "remote", "apply", "work", "career", "talent", "exchange", "wallet", "public", "chain", "infrastructure"]
+            invalid_company_names = ["简介", "介绍", "岗位", "职责", "要求", "福利", "待遇", "关于我们", "About", "Intro", "Description", "Requirements", "Welcome"]
+
+            for line in lines:
+                if not found_company:
+                    company_match = re.match(r'^(?:项目|Project|公司|Company|Team)\s*[:：]\s*(.+)', line, re.IGNORECASE)
+                    if company_match:
+                        found_company = BaselineJobParser.clean_string(company_match.group(1))
+                        break
+            if not found_company:
+                for line in lines:
+                    cleaned_line = BaselineJobParser.clean_string(line)
+                    if not line.startswith('#') and not line.startswith('＃') and len(line) < 40 and "招聘" not in line:
+                        if cleaned_line in invalid_company_names or len(cleaned_line) < 2: continue
+                        found_company = cleaned_line
+                        break
+
+            target_tag = None
+            for tag in hashtags:
+                tag_lower = tag.lower()
+                if any(bad in tag_lower for bad in blacklist_tags): continue
+                for keyword in job_keywords:
+                    if keyword.lower() in tag_lower:
+                        target_tag = tag
+                        break
+                if target_tag: break
+
+            found_title = target_tag if target_tag else "其他"
+
+            job_data["company"] = found_company if found_company else "其他项目"
+            job_data["title"] = found_title
+            job_data["salary"] = BaselineJobParser.extract_max_salary(raw_text)
+            email_match = re.search(r'[\w\.-]+@[\w\.-]+\.[a-zA-Z]+', raw_text)
+            job_data["email"] = email_match.group(0) if email_match else ""
+
+            for tag in hashtags:
+                if "兼职" in tag: job_data["type"] = "兼职"
+                if "实习" in tag: job_data["type"] = "实习"
+                if "外包" in tag or "项目" in tag: job_data["type"] = "项目制"
+
+            return job_data
+        except Exception: return None
+
+# ================= 解析引擎回归对比 =================
+_FALLBACK_ID = re.compile(r'^\d+_[0-9a-f]{6}$')
+
+def _normalize(job):
+    # 没有 data-post 的消息会生成随机 id，两边无法对齐，不参与比较
+    if job and _FALLBACK_ID.match(str(job.get('id', ''))):
+        job = dict(job, id=None)
+    return job
+
+# 后续需求有意改变的行为不与基线比较: 基线只读外层 data-post-id，现在也读内层 data-post，
+# 参考输出的 id 用现在的取法；location 已改由 work_mode 等结构化字段表达
+CHANGED_FIELDS = {'location'}
+
+def reference_parse(page_html):
+    soup = BeautifulSoup(page_html, 'html.parser')
+    jobs = []
+    for div in soup.find_all('div', class_='tgme_widget_message_wrap'):
+        post_id = bacnked.JobParser.extract_post_id(div)
+        job = BaselineJobParser.parse_html_message(div)
+        if job:
+            if post_id: job['id'] = post_id
+            for field in CHANGED_FIELDS: job.pop(field, None)
+        jobs.append(_normalize(job))
+    return jobs
+
+def backend_parse(backend, page_html):
+    records, _ = backend([page_html])
+    return [_normalize(bacnked.JobParser.parse_message(r)) for r in records]
+
+def parser_diff(directory, golden=None, write_golden=None):
+    files = sorted(f for f in os.listdir(directory) if f.endswith('.html'))
+    if not files:
+        print(f"[!] {directory} 中没有 .html 语料")
+        return 1
+    pages = {}
+    for file_name in files:
+        with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+            pages[file_name] = f.read()
+
+    if write_golden:
+        with open(write_golden, 'w', encoding='utf-8') as f:
+            json.dump({name: reference_parse(page_html) for name, page_html in pages.items()}, f, ensure_ascii=False)
+        print(f"[*] 参考输出已写入 {write_golden}")
+        return 0
+    expected_pages = None
+    if golden:
+        with open(golden, encoding='utf-8') as f:
+            expected_pages = json.load(f)
+
+    failures = 0
+    for name, backend in bacnked.PARSER_BACKENDS.items():
+        messages = jobs = 0
+        for file_name, page_html in pages.items():
+            expected = expected_pages[file_name] if expected_pages else reference_parse(page_html)
+            actual = backend_parse(backend, page_html)
+            if len(expected) != len(actual):
+                print(f"[!] {name} {file_name}: 消息数不同 {len(expected)} != {len(actual)}")
+                failures += 1
+                continue
+            for i, (want, got) in enumerate(zip(expected, actual)):
+                messages += 1
+                if want: jobs += 1
+                if want and got:
+                    # 基线没有的新字段 (channel、结构化字段等) 不参与比较
+                    got = {k: v for k, v in got.items() if k in want}
+                if want == got: continue
+                failures += 1
+                if not want or not got:
+                    print(f"[!] {name} {file_name}#{i}: 参考={bool(want)} 实际={bool(got)}")
+                    continue
+                for field in sorted(set(want) | set(got)):
+                    if want.get(field) != got.get(field):
+                        print(f"[!] {name} {file_name}#{i} {field}: {want.get(field)!r} != {got.get(field)!r}")
+        print(f"[*] {name}: {len(files)} 页 / {messages} 条消息 / {jobs} 个职位")
+    print("[*] 所有解析引擎输出一致" if not failures else f"[!] 共 {failures} 处差异")
+    return 1 if failures else 0
+
+# ================= 吞吐测试 =================
+def _best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_parse(messages, repeat, seed):
+    """JobParser 单独的吞吐，以及各解析引擎从 HTML 到 job_data 的端到端吞吐"""
+    rng = random.Random(seed)
+    pages_count = math.ceil(messages / bacnked.PAGE_SPAN)
+    total = pages_count * bacnked.PAGE_SPAN
+    pages = [synthetic_page(rng, total - i * bacnked.PAGE_SPAN, total) for i in range(pages_count)]
+    records = [r for page_html in pages for r in bacnked.parse_page_bs4([page_html])[0]]
+
+    results = {}
+    elapsed = _best_of(repeat, lambda: [bacnked.JobParser.parse_message(r) for r in records])
+    results['jobparser_msgs_per_s'] = len(records) / elapsed
+    for name, backend in bacnked.PARSER_BACKENDS.items():
+        def run():
+            for page_html in pages:
+                for r in backend([page_html])[0]:
+                    bacnked.JobParser.parse_message(r)
+        elapsed = _best_of(max(1, repeat // 2), run)
+        results[f'page_{name}_msgs_per_s'] = len(records) / elapsed
+    return results
+
+# ================= 假 Gmail API =================
+class FakeGmail(ThreadingHTTPServer):
+    """本地假 Gmail messages.send：支持 uploadType=media / resumable，超过 quota (封/秒) 时返回 429"""
+    daemon_threads = True
+
+    def __init__(self, port=0, quota=None, retry_after=None):
+        super().__init__(('127.0.0.1', port), FakeGmailHandler)
+        self.quota = quota
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.window = []
+        self.sessions = {}
+        self.received = []
+        self.rejected = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+    def admit(self):
+        if not self.quota: return True
+        with self.lock:
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1]
+            if len(self.window) >= self.quota:
+                self.rejected += 1
+                return False
+            self.window.append(now)
+            return True
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers: self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _accept(self, message):
+        self.server.received.append(len(message))
+        self._json(200, {'id': uuid.uuid4().hex[:16], 'labelIds': ['SENT']})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if not url.path.endswith('/messages/send'):
+            return self._json(404, {'error': {'code': 404, 'message': 'not found'}})
+        if not self.server.admit():
+            headers = [('Retry-After', str(self.server.retry_after))] if self.server.retry_after is not None else []
+            return self._json(429, {'error': {'code': 429, 'message': 'Too many requests',
+                                              'errors': [{'reason': 'rateLimitExceeded'}]}}, headers)
+        upload_type = parse_qs(url.query).get('uploadType', ['media'])[0]
+        if upload_type == 'resumable':
+            session_id = uuid.uuid4().hex
+            self.server.sessions[session_id] = bytearray()
+            self.send_response(200)
+            self.send_header('Location', f'{self.server.url}upload/session/{session_id}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._accept(body)
+
+    def do_PUT(self):
+        session_id = urlparse(self.path).path.rsplit('/', 1)[-1]
+        data = self.server.sessions.get(session_id)
+        body = self._body()
+        if data is None:
+            return self._json(404, {'error': {'code': 404, 'message': 'no such upload'}})
+        data.extend(body)
+        total = self.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+        if total != '*' and len(data) >= int(total):
+            del self.server.sessions[session_id]
+            return self._accept(data)
+        self.send_response(308)
+        self.send_header('Range', f'bytes=0-{len(data) - 1}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def bench_gmail(messages, concurrency, quota, size, rate=None):
+    """经假 Gmail API 发送：复用 GmailClient 的 service 缓存、ResumeTemplate 和令牌桶限流/429 退避"""
+    from google.auth.credentials import AnonymousCredentials
+
+    server = FakeGmail(quota=quota)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = bacnked.GmailClient(token_file=os.devnull, api_root=server.url)
+    creds = AnonymousCredentials()
+    template = bacnked.ResumeTemplate('resume.pdf', os.urandom(size))
+    bucket = bacnked.TokenBucket(rate or bacnked.GMAIL_SEND_RATE, bacnked.GMAIL_SEND_BURST)
+    counter = itertools.count()
+    throttled = []
+
+    def send_one(i):
+        streak = 0
+        while True:
+            bucket.acquire()
+            try:
+                return bacnked.gmail_send(client.service(creds), template.render('me', f'hr{i}@example.com', '工程师'))
+            except bacnked.HttpError as e:
+                if not bacnked.gmail_rate_limited(e): raise
+                streak += 1
+                throttled.append(i)
+                delay = bacnked.retry_after_seconds(e)
+                bucket.pause(delay if delay is not None else min(30, 0.1 * 2 ** streak))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda _: send_one(next(counter)), range(messages)))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    assert len(server.received) == messages, f"假 Gmail 收到 {len(server.received)} 封，期望 {messages}"
+    return {'gmail_msgs_per_s': messages / elapsed, 'gmail_throttled': float(len(throttled))}
+
+def serve_fake_gmail(port, quota):
+    server = FakeGmail(port=port, quota=quota)
+    print(f"[*] 假 Gmail API 运行在 {server.url}，设置 GMAIL_API_ROOT={server.url} 后启动后端即可")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# ================= 假 SMTP =================
+class FakeSmtpHandler:
+    """aiosmtpd 处理器：接受任意账号登录，声明 PIPELINING，latency 模拟握手和投递的服务器耗时"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.received = 0
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        session.host_name = hostname
+        if not getattr(session, 'counted', False):
+            session.counted = True
+            self.connections += 1
+            if self.latency: await asyncio.sleep(self.latency)
+        return responses[:-1] + ['250-PIPELINING'] + responses[-1:]
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency: await asyncio.sleep(self.latency)
+        self.received += len(envelope.rcpt_tos)
+        return '250 OK'
+
+def start_fake_smtp(port=0, latency=0.0):
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+    except ImportError:
+        sys.exit("需要先安装 aiosmtpd: pip install aiosmtpd")
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+    handler = FakeSmtpHandler(latency)
+    controller = Controller(handler, hostname='127.0.0.1', port=port, auth_require_tls=False,
+                            authenticator=lambda *args: AuthResult(success=True))
+    controller.start()
+    return controller, handler
+
+def bench_smtp(messages, concurrency, latency, size):
+    """同样的并发下，连接池复用已登录会话 vs 每封邮件新建连接 (旧实现的做法，不含 2 秒间隔)"""
+    controller, handler = start_fake_smtp(latency=latency)
+    host, port = controller.hostname, controller.port
+    template = bacnked.ResumeTemplate('resume.pdf', os.urandom(size))
+    results = {}
+    try:
+        pool = bacnked.SmtpPool(max_per_key=concurrency)
+
+        def pooled(i):
+            with pool.connection(host, port, 'bench@example.com', 'secret') as server:
+                bacnked.smtp_send_parts(server, 'bench@example.com', f'hr{i}@example.com',
+                                        template.render('bench@example.com', f'hr{i}@example.com', '工程师'))
+
+        def per_message(i):
+            server = bacnked.open_smtp(host, port, 'bench@example.com', 'secret')
+            try:
+                bacnked.smtp_send_parts(server, 'bench@example.com', f'hr{i}@example.com',
+                                        template.render('bench@example.com', f'hr{i}@example.com', '工程师'))
+            finally:
+                server.quit()
+
+        for name, send in (('pooled', pooled), ('per_message_connection', per_message)):
+            handler.received = handler.connections = 0
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                list(executor.map(send, range(messages)))
+            elapsed = time.perf_counter() - started
+            assert handler.received == messages, f"假 SMTP 收到 {handler.received} 封，期望 {messages}"
+            results[f'smtp_{name}_msgs_per_s'] = messages / elapsed
+            results[f'smtp_{name}_connections'] = float(handler.connections)
+    finally:
+        controller.stop()
+    return results
+
+def serve_fake_smtp(port, latency):
+    controller, _ = start_fake_smtp(port, latency)
+    print(f"[*] 假 SMTP 运行在 {controller.hostname}:{controller.port} (不校验账号，不要求 TLS)，Ctrl+C 退出")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        controller.stop()
+
+# ================= 假 t.me 频道 =================
+class FakeTme(ThreadingHTTPServer):
+    """本地假 t.me/s/<频道>：按 seed 确定性地生成分页 HTML，支持 before/after 游标和 ETag 条件请求
+
+    total 是频道当前最新的消息序号，基准测试中途调大它来模拟频道发了新消息。
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, total=2000, seed=1, latency=0.0):
+        super().__init__(('127.0.0.1', port), FakeTmeHandler)
+        self.total = total
+        self.seed = seed
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+    def channel_url(self, channel=bacnked.CHANNEL_USERNAME):
+        return f'{self.url}s/{channel}'
+
+    def page(self, channel, before=None, after=None):
+        """返回 (页面 HTML, ETag)；同样的游标和 total 总是得到同样的页面"""
+        total = self.total
+        if after is not None:
+            top, is_after = after, True
+        else:
+            top, is_after = (min(before - 1, total) if before else total), False
+        etag = f'"{total}-{top}-{int(is_after)}"'
+        rng = random.Random(f'{self.seed}:{channel}:{etag}')
+        return synthetic_page(rng, top, total, channel, after=is_after), etag
+
+class FakeTmeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 's':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            before = int(query['before'][0]) if 'before' in query else None
+            after = int(query['after'][0]) if 'after' in query else None
+        except ValueError:
+            self.send_error(400)
+            return
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency: time.sleep(self.server.latency)
+        page_html, etag = self.server.page(parts[1], before, after)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = page_html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_fake_tme(port=0, pages=100, seed=1, latency=0.0):
+    server = FakeTme(port=port, total=pages * bacnked.PAGE_SPAN, seed=seed, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serve_fake_tme(port, pages, latency):
+    server = FakeTme(port=port, total=pages * bacnked.PAGE_SPAN, latency=latency)
+    print(f"[*] 假 t.me 运行在 {server.channel_url()} ({server.total} 条消息)，Ctrl+C 退出")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# ================= 全链路: 抓取 / 入库 / 接口 =================
+def archive_path(path):
+    """与数据库 path 配套的归档库路径 (jobs.db -> jobs_archive.db)"""
+    return os.path.splitext(path)[0] + '_archive.db'
+
+def use_database(path):
+    """让 bacnked 的写连接、读连接池、归档库和快照改用 path，基准测试不碰真实的 jobs.db"""
+    bacnked.DB_PATH = path
+    bacnked.job_writer.close()
+    bacnked.job_writer.db_path = path
+    bacnked.db_reader = bacnked.ReadPool(path)
+    bacnked.archive_store = bacnked.ArchiveStore(archive_path(path))
+    bacnked._snapshot = None
+    bacnked.init_db()
+
+def rss_mb(pid=None):
+    """进程当前的 RSS (MB)；读 /proc，不支持的平台返回 None"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb():
+    """本进程的 RSS 峰值 (MB)，Windows 上返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def _with_rss(results, key):
+    peak = peak_rss_mb()
+    if peak is not None: results[key] = peak
+    return results
+
+def bench_scrape(pages, new_pages, workers, seed, latency):
+    """经假 t.me 抓取进临时数据库：fetch_jobs 的首次抓取和增量抓取，以及历史部分的回填流水线"""
+    server = start_fake_tme(pages=pages, seed=seed, latency=latency)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        use_database(os.path.join(tmp, 'bench.db'))
+        # 假服务不需要限速，令牌桶放到足够大，测的是抓取器本身的开销
+        scraper = bacnked.WebScraper(fetcher=bacnked.PageFetcher(rate=1e6, burst=1000))
+        scraper.base_url = server.channel_url()
+
+        def poll():
+            requests_before = server.requests
+            started = time.perf_counter()
+            jobs = scraper.fetch_jobs(lookback_days=3650)
+            return jobs, server.requests - requests_before, time.perf_counter() - started
+
+        jobs, fetched, elapsed = poll()
+        results['fetch_jobs_initial_pages_per_s'] = fetched / elapsed
+        results['fetch_jobs_initial_jobs_per_s'] = len(jobs) / elapsed
+        server.total += new_pages * bacnked.PAGE_SPAN
+        jobs, fetched, elapsed = poll()
+        results['fetch_jobs_incremental_pages_per_s'] = fetched / elapsed
+        results['fetch_jobs_incremental_jobs_per_s'] = len(jobs) / elapsed
+
+        pipeline = bacnked.BackfillPipeline(scraper, workers)
+        started = time.perf_counter()
+        total = pipeline.run(reset=True)
+        wall = time.perf_counter() - started
+        stats = pipeline.stats
+        results['backfill_pages_per_s'] = stats['fetch'].items / wall
+        results['backfill_parse_msgs_per_s'] = stats['parse'].items * bacnked.PAGE_SPAN / wall
+        results['backfill_rows_per_s'] = total / wall
+        if stats['write'].busy:
+            results['ingest_rows_per_s'] = stats['write'].items / stats['write'].busy
+        bacnked.job_writer.close()
+    server.shutdown()
+    return _with_rss(results, 'scrape_peak_rss_mb')
+
+def seed_db(path, rows, days, seed, batch_size=2000):
+    """用合成职位填充数据库，走 JobWriter.save (真实的写库、去重和触发器路径)
+
+    发布日期在最近 days 天内随机分布；库里已有数据时接着最大序号往后编号，可以分多次追加。
+    """
+    use_database(path)
+    channel = bacnked.CHANNEL_USERNAME
+    with bacnked.db_reader.connection() as conn:
+        number = conn.execute("SELECT MAX(CAST(substr(id, instr(id, '/') + 1) AS INTEGER)) FROM jobs WHERE channel = ?",
+                              (channel,)).fetchone()[0] or 0
+    rng = random.Random(seed)
+    backend = bacnked.get_parser_backend(None)
+    today = datetime.date.today()
+    produced = 0
+    parse_seconds = save_seconds = 0.0
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    last_report = time.monotonic()
+    while produced < rows:
+        parts = ['<html><body><section class="tgme_channel_history">']
+        for _ in range(batch_size):
+            number += 1
+            date = today - datetime.timedelta(days=rng.randrange(days))
+            parts.append(synthetic_message(rng, number, channel, date=date.isoformat()))
+        parts.append('</section></body></html>')
+        started = time.perf_counter()
+        posts, _ = bacnked.WebScraper.parse_page_with(backend, ''.join(parts))
+        jobs = [job for _, job in posts if job][:rows - produced]
+        parse_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        for key, value in bacnked.save_jobs_to_db(jobs).items(): counts[key] += value
+        save_seconds += time.perf_counter() - started
+        produced += len(jobs)
+        if time.monotonic() - last_report >= 5:
+            last_report = time.monotonic()
+            print(f"[*] 已写入 {produced}/{rows} 条 ({produced / save_seconds:.0f} 条/秒)")
+    bacnked.job_writer.close()
+    with bacnked.db_reader.connection() as conn:
+        visible = conn.execute('SELECT COUNT(*) FROM jobs WHERE canonical_id IS NULL').fetchone()[0]
+    print(f"[*] {path}: 新增 {counts['inserted']} / 更新 {counts['updated']}，去重后可见 {visible} 条")
+    results = {
+        'seed_rows': float(produced),
+        'seed_parse_msgs_per_s': produced / parse_seconds if parse_seconds else 0.0,
+        'seed_ingest_rows_per_s': produced / save_seconds if save_seconds else 0.0,
+        'seed_db_mb': os.path.getsize(path) / 1024 / 1024,
+    }
+    return _with_rss(results, 'seed_peak_rss_mb')
+
+def copy_database(src, dst):
+    """用 SQLite 在线备份复制数据库 (包含 WAL 里尚未检查点的内容)"""
+    source = sqlite3.connect(src)
+    target = sqlite3.connect(dst)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+    return dst
+
+def start_api_server(db_path, port=0, env=None, sender=False):
+    """在子进程里运行 create_app() (Flask 开发服务器，多线程)，返回 (进程, 基地址)
+
+    放在子进程里是为了不和压测线程争抢 GIL，RSS 也只算服务端本身。
+    sender=True 时同一进程里启动投递线程 (正式部署里由持有租约的调度进程负责)。
+    """
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+    code = ("import logging, bacnked; logging.getLogger('werkzeug').setLevel(logging.WARNING); bacnked.init_db(); "
+            + ("bacnked.send_queue.start('benchmark'); " if sender else "")
+            + f"bacnked.create_app().run(host='127.0.0.1', port={port}, threaded=True)")
+    env = dict(os.environ, DB_PATH=os.path.abspath(db_path), ARCHIVE_DB_PATH=archive_path(os.path.abspath(db_path)),
+               LOG_LEVEL='WARNING', **(env or {}))
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"接口服务启动失败 (退出码 {proc.returncode})")
+        try:
+            requests.get(f'{base}/metrics', timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit("接口服务 30 秒内没有就绪")
+
+def _percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(math.ceil(q * len(sorted_values))) - 1)]
+
+SEARCH_TERMS = ["Solidity", "运营", "DeFi", "后端开发", "Remote", "交易所", "钱包", "智能合约"]
+LIST_FIELDS = 'id,company,title,salary,date,email,location,tags,type,work_mode'
+
+def load_scenarios(base, session, rng, send=None):
+    """压测场景: 名称 -> (权重, 发出一次请求的函数)；预先取好游标和 id，场景之间没有先后依赖"""
+    first = session.get(f'{base}/api/jobs', params={'limit': 50}).json()
+    ids = [job['id'] for job in first.get('jobs', [])]
+    # 合成数据里有中文域名的邮箱，服务器不支持 SMTPUTF8 时投递必然失败，投递场景只选 ASCII 邮箱
+    send_ids = [job['id'] for job in first.get('jobs', []) if job.get('email') and job['email'].isascii()]
+    cursors = []
+    cursor = first.get('next_cursor')
+    while cursor and len(cursors) < 20:
+        cursors.append(cursor)
+        cursor = session.get(f'{base}/api/jobs', params={'limit': 50, 'cursor': cursor}).json().get('next_cursor')
+    if not ids:
+        sys.exit("数据库里没有职位，先运行 seed-db")
+
+    scenarios = {
+        'jobs': (30, lambda s: s.get(f'{base}/api/jobs', params={'limit': 50})),
+        'jobs_filtered': (15, lambda s: s.get(f'{base}/api/jobs', params={
+            'limit': 50, 'days': rng.choice([7, 30, 60]), 'type': rng.choice(['全职', '兼职', '实习']),
+            'has_email': 'true'})),
+        'jobs_cursor': (10, lambda s: s.get(f'{base}/api/jobs', params={'limit': 50, 'cursor': rng.choice(cursors)})
+                        if cursors else s.get(f'{base}/api/jobs', params={'limit': 50})),
+        'jobs_columnar': (10, lambda s: s.get(f'{base}/api/jobs', params={
+            'limit': 500, 'format': 'columnar', 'fields': LIST_FIELDS})),
+        'search': (15, lambda s: s.get(f'{base}/api/jobs/search', params={'q': rng.choice(SEARCH_TERMS), 'limit': 50})),
+        'facets': (10, lambda s: s.get(f'{base}/api/facets', params={'days': rng.choice([7, 30, 60])})),
+        'details': (10, lambda s: s.get(f'{base}/api/jobs/details', params={'ids': ','.join(rng.sample(ids, min(10, len(ids))))})),
+    }
+    if send and send_ids:
+        host, port = send
+        resume = os.urandom(50 * 1024)
+        scenarios['send'] = (2, lambda s: s.post(f'{base}/api/send-resume', files={'resume': ('resume.pdf', resume)}, data={
+            'smtp_user': 'bench@example.com', 'smtp_pass': 'secret', 'smtp_host': host, 'smtp_port': str(port),
+            'jobIds': json.dumps(rng.sample(send_ids, min(5, len(send_ids))))}))
+    return scenarios
+
+def bench_load(db=None, url=None, duration=20, concurrency=8, send=False, seed=1):
+    """闭环压测：concurrency 个客户端按权重随机选场景连续请求 duration 秒，统计各场景延迟分位数"""
+    proc = None
+    smtp = None
+    tmp = None
+    if url:
+        base = url.rstrip('/')
+    else:
+        server_env = None
+        if send:
+            # 投递任务持久化在库里，在副本上压测，免得留下指向已关闭的假 SMTP 的任务；
+            # 投递场景测的是队列和连接池，单账号限速放开
+            tmp = tempfile.TemporaryDirectory()
+            db = copy_database(db, os.path.join(tmp.name, 'load.db'))
+            server_env = {'SEND_RATE': '1000', 'SEND_BURST': '100'}
+        proc, base = start_api_server(db, env=server_env, sender=send)
+    results = {}
+    try:
+        send_target = None
+        if send:
+            smtp, smtp_handler = start_fake_smtp()
+            send_target = (smtp.hostname, smtp.port)
+        rng = random.Random(seed)
+        scenarios = load_scenarios(base, requests.Session(), rng, send_target)
+        names = list(scenarios)
+        weights = [scenarios[name][0] for name in names]
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        lock = threading.Lock()
+        rss_samples = []
+        stop = threading.Event()
+
+        def client(i):
+            session = requests.Session()
+            local = random.Random(seed * 1000 + i)
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                name = local.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    ok = scenarios[name][1](session).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies[name].append(elapsed)
+                    if not ok: errors[name] += 1
+
+        def sample_rss():
+            while not stop.wait(0.2):
+                value = rss_mb(proc.pid)
+                if value is not None: rss_samples.append(value)
+
+        if proc is not None:
+            threading.Thread(target=sample_rss, daemon=True).start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(client, range(concurrency)))
+        wall = time.perf_counter() - started
+        stop.set()
+
+        total = sum(len(values) for values in latencies.values())
+        results['api_requests_per_s'] = total / wall
+        results['api_errors'] = float(sum(errors.values()))
+        for name in names:
+            values = sorted(latencies[name])
+            if not values: continue
+            results[f'api_{name}_p50_ms'] = _percentile(values, 0.50) * 1000
+            results[f'api_{name}_p99_ms'] = _percentile(values, 0.99) * 1000
+        if rss_samples:
+            results['server_rss_mb'] = rss_samples[-1]
+            results['server_peak_rss_mb'] = max(rss_samples)
+        if send:
+            # 投递在服务端队列里异步进行，等一会儿让队列发完再统计
+            time.sleep(2)
+            results['send_delivered'] = float(smtp_handler.received)
+    finally:
+        if smtp is not None: smtp.stop()
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+        if tmp is not None: tmp.cleanup()
+    return results
+
+def bench_suite(rows, duration, concurrency, seed):
+    """一次跑完主要的回归指标：JobParser、fetch_jobs/回填、入库、接口延迟"""
+    results = {}
+    print("[*] parse ...")
+    results.update(bench_parse(2000, 3, seed))
+    print("[*] scrape ...")
+    results.update(bench_scrape(100, 5, None, seed, 0.0))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'seed.db')
+        print(f"[*] seed-db {rows} 条 ...")
+        results.update(seed_db(path, rows, 60, seed))
+        print(f"[*] load {duration} 秒 ...")
+        results.update(bench_load(db=path, duration=duration, concurrency=concurrency, seed=seed))
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def report(results, output=None, baseline=None):
+    """打印结果；output 写入 JSON 便于跨提交对比，baseline 为上次写出的 JSON"""
+    previous = {}
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            previous = json.load(f).get('results', {})
+    for key, value in results.items():
+        line = f"{key:40s} {value:14.1f}"
+        if key in previous and previous[key]:
+            line += f"   (基线 {previous[key]:.1f}, {value / previous[key]:.2f}x)"
+        print(line)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'commit': _git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"[*] 结果已写入 {output}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="easyJob 性能与回归测试工具")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('gen-corpus', help='生成合成的频道页面语料')
+    p.add_argument('directory')
+    p.add_argument('--pages', type=int, default=50)
+    p.add_argument('--seed', type=int, default=1)
+    p = sub.add_parser('save-corpus', help='从 t.me 抓取真实频道页面保存为语料')
+    p.add_argument('directory')
+    p.add_argument('--pages', type=int, default=20)
+    p = sub.add_parser('parser-diff', help='对比各解析引擎与参考实现的输出')
+    p.add_argument('directory')
+    p.add_argument('--golden', help='与之前保存的参考输出对比，而不是与当前参考实现对比')
+    p.add_argument('--write-golden', help='把当前参考实现的输出保存到文件')
+    p = sub.add_parser('parse', help='解析吞吐 (条/秒)')
+    p.add_argument('--messages', type=int, default=5000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('fake-gmail', help='启动本地假 Gmail API')
+    p.add_argument('--port', type=int, default=8030)
+    p.add_argument('--quota', type=float, help='每秒最多接受的封数，超出返回 429')
+    p = sub.add_parser('gmail', help='经假 Gmail API 的发送吞吐 (封/秒)')
+    p.add_argument('--messages', type=int, default=200)
+    p.add_argument('--concurrency', type=int, default=bacnked.SEND_WORKERS)
+    p.add_argument('--quota', type=float, help='假服务每秒最多接受的封数')
+    p.add_argument('--rate', type=float, help='客户端限速 (封/秒)，默认 GMAIL_SEND_RATE')
+    p.add_argument('--size', type=int, default=200 * 1024, help='简历大小 (字节)')
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('fake-smtp', help='启动本地假 SMTP 服务 (需要 aiosmtpd)')
+    p.add_argument('--port', type=int, default=8025)
+    p.add_argument('--latency', type=float, default=0.0, help='每次握手/投递的模拟耗时 (秒)')
+    p = sub.add_parser('smtp', help='经假 SMTP 的发送吞吐 (封/秒)')
+    p.add_argument('--messages', type=int, default=200)
+    p.add_argument('--concurrency', type=int, default=bacnked.SMTP_MAX_CONNECTIONS)
+    p.add_argument('--latency', type=float, default=0.005, help='每次握手/投递的模拟耗时 (秒)')
+    p.add_argument('--size', type=int, default=200 * 1024, help='简历大小 (字节)')
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('fake-tme', help='启动本地假 t.me/s 频道')
+    p.add_argument('--port', type=int, default=8040)
+    p.add_argument('--pages', type=int, default=100, help='频道里的消息页数 (每页 PAGE_SPAN 条)')
+    p.add_argument('--latency', type=float, default=0.0, help='每次请求的模拟耗时 (秒)')
+    p = sub.add_parser('scrape', help='经假 t.me 的抓取/解析/入库吞吐')
+    p.add_argument('--pages', type=int, default=200, help='历史页数')
+    p.add_argument('--new-pages', type=int, default=10, help='增量抓取前频道新增的页数')
+    p.add_argument('--workers', type=int, help='回填解析进程数，默认 PARSE_WORKERS')
+    p.add_argument('--latency', type=float, default=0.0, help='假 t.me 每次请求的模拟耗时 (秒)')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('seed-db', help='用合成职位填充数据库')
+    p.add_argument('path')
+    p.add_argument('--rows', type=int, default=10000)
+    p.add_argument('--days', type=int, default=60, help='发布日期分布在最近多少天内')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('load', help='接口压测 (p50/p99 延迟、吞吐、服务端 RSS)')
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument('--db', help='在子进程里对这个数据库启动接口服务')
+    target.add_argument('--url', help='压测已经在运行的服务，例如 http://127.0.0.1:5000')
+    p.add_argument('--duration', type=float, default=20)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--send', action='store_true', help='混入投递请求，发往本进程启动的假 SMTP (需要 aiosmtpd)')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    p = sub.add_parser('suite', help='parse + scrape + seed-db + load，结果合并写入一个 JSON')
+    p.add_argument('--rows', type=int, default=10000)
+    p.add_argument('--duration', type=float, default=15)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--output', help='把结果写入 JSON 文件')
+    p.add_argument('--baseline', help='与之前写出的 JSON 结果对比')
+    args = parser.parse_args(argv)
+
+    if args.command == 'gen-corpus':
+        gen_corpus(args.directory, args.pages, args.seed)
+    elif args.command == 'save-corpus':
+        save_corpus(args.directory, args.pages)
+    elif args.command == 'parser-diff':
+        return parser_diff(args.directory, args.golden, args.write_golden)
+    elif args.command == 'parse':
+        report(bench_parse(args.messages, args.repeat, args.seed), args.output, args.baseline)
+    elif args.command == 'fake-gmail':
+        serve_fake_gmail(args.port, args.quota)
+    elif args.command == 'fake-smtp':
+        serve_fake_smtp(args.port, args.latency)
+    elif args.command == 'smtp':
+        report(bench_smtp(args.messages, args.concurrency, args.latency, args.size), args.output, args.baseline)
+    elif args.command == 'gmail':
+        report(bench_gmail(args.messages, args.concurrency, args.quota, args.size, args.rate), args.output, args.baseline)
+    elif args.command == 'fake-tme':
+        serve_fake_tme(args.port, args.pages, args.latency)
+    elif args.command == 'scrape':
+        report(bench_scrape(args.pages, args.new_pages, args.workers, args.seed, args.latency), args.output, args.baseline)
+    elif args.command == 'seed-db':
+        report(seed_db(args.path, args.rows, args.days, args.seed), args.output, args.baseline)
+    elif args.command == 'load':
+        report(bench_load(args.db, args.url, args.duration, args.concurrency, args.send, args.seed), args.output, args.baseline)
+    elif args.command == 'suite':
+        report(bench_suite(args.rows, args.duration, args.concurrency, args.seed), args.output, args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
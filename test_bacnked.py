@@ -0,0 +1,1625 @@
+"""bacnked 的回归测试
+
+每个用例使用 tmp_path 下的临时数据库 (use_database)，不碰真实的 jobs.db。
+运行: python -m pytest -q test_bacnked.py
+"""
+import collections
+import datetime
+import email
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import httplib2
+import pytest
+
+import bacnked
+import benchmark
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+def use_database(path):
+    """benchmark.use_database 之外，关掉快照的后台刷新：刷新线程会跨用例存活，需要时由用例自己打开"""
+    benchmark.use_database(path)
+    bacnked.SNAPSHOT_CHECK_INTERVAL = float('inf')
+
+def days_ago(n):
+    return (datetime.date.today() - datetime.timedelta(days=n)).strftime('%Y-%m-%d')
+
+def make_job(number, date, raw_content=None, email='', channel='testchan', **fields):
+    company = f"company{number}"
+    job = {
+        'id': f"{channel}/{number}",
+        'date': date,
+        'company': company,
+        'title': '后端工程师',
+        'email': email,
+        'tags': ['招聘', '后端工程师'],
+        'type': '全职',
+        # 互不相同的随机正文
+        'raw_content': raw_content if raw_content is not None else f"#招聘 {random.Random(number).getrandbits(512):x}",
+    }
+    job.update(fields)
+    return job
+
+def message_html(number, text, date, channel='DeJob_official'):
+    """t.me/s 页面上的一条消息"""
+    body = text.replace('\n', '<br/>')
+    return (f'<div class="tgme_widget_message_wrap js-widget_message_wrap">'
+            f'<div class="tgme_widget_message text_not_supported_wrap js-widget_message" data-post="{channel}/{number}">'
+            f'<div class="tgme_widget_message_text js-message_text" dir="auto">{body}</div>'
+            f'<div class="tgme_widget_message_footer"><a class="tgme_widget_message_date" href="https://t.me/{channel}/{number}">'
+            f'<time datetime="{date}T08:00:00+00:00" class="time">08:00</time></a></div></div></div>')
+
+def page_html(numbers, date=None, more_after=None):
+    """一页消息；more_after 不为空时带上 "加载更新消息" 的链接"""
+    messages = ''.join(message_html(n, f"项目: Acme{n}\n#招聘 #后端工程师\n投递邮箱: hr{n}@acme.io", date or days_ago(0))
+                       for n in numbers)
+    more = (f'<a class="tme_messages_more" data-after="{more_after}" href="/s/DeJob_official?after={more_after}"></a>'
+            if more_after else '')
+    return f'<html><body><section class="tgme_channel_history">{more}{messages}</section></body></html>'
+
+def page_all(filters, limit):
+    """按 next_cursor 翻完所有页，返回 id 列表"""
+    seen = []
+    cursor = None
+    while True:
+        page, next_cursor = bacnked.query_jobs(filters, limit=limit, cursor=cursor)
+        seen.extend(job['id'] for job in page)
+        if next_cursor is None: return seen
+        cursor = bacnked.decode_cursor(next_cursor)
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    use_database(path)
+    yield path
+
+@pytest.fixture
+def client(db):
+    return bacnked.create_app().test_client()
+
+# ================= 游标分页 =================
+def test_cursor_paging_has_no_duplicates_or_gaps(db):
+    # 每天多条，翻页边界会落在同一天内，依赖 (date, id) 的次序
+    jobs = [make_job(n, days_ago(n % 9)) for n in range(1, 121)]
+    bacnked.save_jobs_to_db(jobs)
+    filters = bacnked.parse_job_query({})['filters']
+    expected = [job['id'] for job in sorted(jobs, key=lambda j: (j['date'], j['id']), reverse=True)]
+
+    seen = []
+    cursor = None
+    while True:
+        page, next_cursor = bacnked.query_jobs(filters, limit=7, cursor=cursor)
+        seen.extend(job['id'] for job in page)
+        if next_cursor is None: break
+        cursor = bacnked.decode_cursor(next_cursor)
+        if len(seen) == 14:
+            # 翻页过程中抓到了新职位，已经翻过的部分不受影响
+            bacnked.save_jobs_to_db([make_job(999, days_ago(0))])
+    assert seen == expected
+    assert len(seen) == len(set(seen))
+
+def test_cursor_paging_with_filter(db):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n % 3), email=f'hr{n}@x.io' if n % 2 else '')
+                             for n in range(1, 41)])
+    filters = dict(bacnked.parse_job_query({})['filters'], has_email=True)
+    seen = page_all(filters, limit=4)
+    assert sorted(seen) == sorted(f'testchan/{n}' for n in range(1, 41, 2))
+    assert len(seen) == len(set(seen))
+
+def test_keyword_and_salary_filters(db):
+    bacnked.save_jobs_to_db([
+        make_job(1, days_ago(1), '远程办公，Go 开发', salary='2000U', salary_max=2000, tags=['招聘', 'Go开发']),
+        make_job(2, days_ago(1), '上海现场办公', salary='4000U', salary_max=4000, tags=['招聘', 'Dev Lead']),
+        make_job(3, days_ago(1), '远程，运营', salary='6k', salary_max=6000, tags=['招聘', '运营']),
+    ])
+
+    def ids(args):
+        query = bacnked.parse_job_query(args)
+        return sorted(job['id'] for job in bacnked.query_jobs(query['filters'], limit=10)[0])
+
+    # 任一标签包含任一关键词 (不区分大小写)
+    assert ids({'tag_contains': '开发,dev'}) == ['testchan/1', 'testchan/2']
+    # 每个关键词都要出现
+    assert ids({'contains': '远程'}) == ['testchan/1', 'testchan/3']
+    assert ids({'contains': '远程,go'}) == ['testchan/1']
+    # LIKE 通配符按字面匹配
+    assert ids({'contains': '%'}) == []
+    assert ids({'salary_min': '1000', 'salary_max': '3000'}) == ['testchan/1']
+    assert ids({'salary_min': '5000'}) == ['testchan/3']
+
+@pytest.mark.parametrize('args', [
+    {'days': '999999999999'},
+    {'days': '0'},
+    {'days': 'abc'},
+    {'date_from': '0001-01-01'},
+    {'date_to': '2024-13-01'},
+    {'limit': 'x'},
+    {'tag_contains': ','.join(str(n) for n in range(bacnked.MAX_TAG_KEYWORDS + 1))},
+])
+def test_invalid_query_args_are_rejected(client, args):
+    response = client.get('/api/jobs', query_string=args)
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+def test_date_arg_is_zero_padded():
+    query = bacnked.parse_job_query({'date_from': '1999-01-02', 'date_to': '2024-1-5'})
+    assert query['filters']['date_from'] == '1999-01-02'
+    assert query['filters']['date_to'] == '2024-01-05'
+
+# ================= 全文检索 =================
+def search_ids(q, **kwargs):
+    return sorted(job['id'] for job in bacnked.search_jobs(q, **kwargs))
+
+def test_search_trigram_bigram_and_like_terms(db):
+    bacnked.save_jobs_to_db([
+        make_job(1, days_ago(1), '招聘运营经理，负责社区增长', company='Acme', title='运营经理'),
+        make_job(2, days_ago(1), '前端开发，React 和 Go 均可', company='Beta', title='前端开发'),
+        make_job(3, days_ago(1), '后端开发，Rust 或 Go', company='Gamma', title='后端开发'),
+        make_job(4, days_ago(90), '运营专员，已经过期', company='Old', title='运营专员'),
+    ])
+    assert bacnked.search_indexes() == {'jobs_fts', 'jobs_bigram'}
+    # 三字及以上走 trigram，两字词走 jobs_bigram (不区分大小写)，单字走 LIKE
+    assert search_ids('运营经理') == ['testchan/1']
+    assert search_ids('运营') == ['testchan/1']
+    assert search_ids('go') == ['testchan/2', 'testchan/3']
+    assert search_ids('开发 前') == ['testchan/2']
+    assert search_ids('运营', days=120) == ['testchan/1', 'testchan/4']
+    # 与 /api/jobs 相同的筛选条件
+    assert search_ids('go', filters={'company': 'Gamma'}) == ['testchan/3']
+    results = bacnked.search_jobs('运营')
+    assert '<mark>运营</mark>' in results[0]['title_highlight']
+
+def test_search_index_follows_updates(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), '招聘运营', title='运营')])
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), '招聘前端', title='前端')])
+    assert search_ids('运营') == []
+    assert search_ids('前端') == ['testchan/1']
+
+def test_search_api(client):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), '招聘运营', title='运营', tags=['招聘', '运营'])])
+    response = client.get('/api/jobs/search', query_string={'q': '运营', 'fields': 'id,tags'})
+    assert response.status_code == 200
+    job, = response.get_json()['jobs']
+    assert job['id'] == 'testchan/1' and job['tags'] == ['招聘', '运营'] and 'company' not in job
+    assert client.get('/api/jobs/search').status_code == 400
+    assert client.get('/api/jobs/search', query_string={'q': '运营', 'days': '99999999'}).status_code == 400
+
+# ================= 增量抓取 =================
+class FakeResponse:
+    def __init__(self, text='', status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
+
+@pytest.fixture
+def channel(monkeypatch):
+    """把抓取器的 HTTP 请求换成按 URL 返回的假页面，记录请求过的 URL
+
+    pages 的值可以是页面文本、FakeResponse，或者按请求头返回 FakeResponse 的函数。
+    """
+    pages = {}
+    requested = []
+    def get(session, url, headers=None, **kwargs):
+        requested.append(url)
+        page = pages.get(url, page_html([]))
+        if callable(page): page = page(headers or {})
+        return page if isinstance(page, FakeResponse) else FakeResponse(page)
+    monkeypatch.setattr(bacnked.requests.Session, 'get', get)
+    monkeypatch.setattr(bacnked.TokenBucket, 'acquire', lambda self: None)
+    monkeypatch.setattr(bacnked.time, 'sleep', lambda seconds: None)
+    return pages, requested
+
+def channel_key(key, name='DeJob_official'):
+    """抓取游标按频道存在 scrape_state 里"""
+    return f'{key}:{name}'
+
+def saved_ids():
+    return sorted(job['id'] for job in bacnked.query_jobs({}, limit=100)[0])
+
+def test_incremental_fetch_skips_posts_below_high_water_mark(db, channel):
+    pages, requested = channel
+    base = 'https://t.me/s/DeJob_official'
+    bacnked.set_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID), 100)
+    # ?after= 返回的页面里混有高水位及以下的旧消息，只有更新的入库
+    pages[f'{base}?after=100'] = page_html([99, 100, 101, 102], more_after=102)
+    pages[f'{base}?after=102'] = page_html([103])
+
+    jobs = bacnked.WebScraper().fetch_jobs()
+    assert [job['id'] for job in jobs] == ['DeJob_official/101', 'DeJob_official/102', 'DeJob_official/103']
+    assert requested == [f'{base}?after=100', f'{base}?after=102']
+    assert saved_ids() == ['DeJob_official/101', 'DeJob_official/102', 'DeJob_official/103']
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '103'
+
+    # 稳态下一次请求，没有新消息时高水位不变
+    requested.clear()
+    assert bacnked.WebScraper().fetch_jobs() == []
+    assert requested == [f'{base}?after=103']
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '103'
+
+def test_high_water_mark_not_advanced_when_save_fails(db, channel, monkeypatch):
+    pages, _ = channel
+    bacnked.set_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID), 100)
+    pages['https://t.me/s/DeJob_official?after=100'] = page_html([101])
+    def fail(jobs): raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(bacnked, 'save_jobs_to_db', fail)
+    bacnked.WebScraper().fetch_jobs()
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '100'
+
+def test_initial_fetch_records_high_water_mark(db, channel):
+    pages, requested = channel
+    base = 'https://t.me/s/DeJob_official'
+    pages[base] = page_html([11, 12])
+    pages[f'{base}?before=11'] = page_html([9, 10], date=days_ago(100))
+    jobs = bacnked.WebScraper().fetch_jobs(lookback_days=60)
+    # 超过 lookback_days 的页面到此为止
+    assert sorted(job['id'] for job in jobs) == ['DeJob_official/11', 'DeJob_official/12']
+    assert requested == [base, f'{base}?before=11']
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '12'
+
+# ================= 页面抓取 =================
+def test_conditional_request_returns_not_modified(channel):
+    pages, requested = channel
+    url = 'https://t.me/s/DeJob_official?after=1'
+    seen_headers = []
+    def respond(headers):
+        seen_headers.append(headers)
+        if headers.get('If-None-Match') == '"v1"':
+            return FakeResponse(status_code=304)
+        return FakeResponse(page_html([2]), headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    pages[url] = respond
+
+    fetcher = bacnked.PageFetcher()
+    assert 'DeJob_official/2' in fetcher.fetch(url, conditional=True)
+    assert fetcher.fetch(url, conditional=True) is bacnked.NOT_MODIFIED
+    assert seen_headers[1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    # 非条件请求不带校验头，总是拿到完整页面
+    assert fetcher.fetch(url) != bacnked.NOT_MODIFIED
+    assert seen_headers[2] == {}
+
+def test_not_modified_page_skips_parsing(db, channel, monkeypatch):
+    pages, _ = channel
+    bacnked.set_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID), 100)
+    pages['https://t.me/s/DeJob_official?after=100'] = lambda headers: FakeResponse(status_code=304)
+    monkeypatch.setattr(bacnked.WebScraper, 'parse_page', staticmethod(lambda html: pytest.fail('304 不应解析')))
+    assert bacnked.WebScraper().fetch_jobs() == []
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '100'
+
+def test_fetch_retries_transient_errors(channel):
+    pages, requested = channel
+    url = 'https://t.me/s/DeJob_official'
+    responses = [FakeResponse(status_code=503, headers={'Retry-After': '2'}), FakeResponse(status_code=429),
+                 FakeResponse('ok')]
+    pages[url] = lambda headers: responses.pop(0)
+    assert bacnked.PageFetcher().fetch(url) == 'ok'
+    assert len(requested) == 3
+
+    # 非重试类的状态码立即失败
+    pages[url] = FakeResponse(status_code=404)
+    with pytest.raises(bacnked.FetchError):
+        bacnked.PageFetcher().fetch(url)
+    assert len(requested) == 4
+
+# ================= 解析引擎 =================
+def chunked(text, size=97):
+    """按固定长度切块，模拟流式输入；切点会落在标签和多字节字符中间"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def test_bs4_backend_extracts_message_records():
+    records, has_newer = bacnked.parse_page_bs4([read_fixture('tme_page.html')])
+    assert has_newer
+    assert [r.post_id for r in records] == [f'DeJob_official/{n}' for n in range(48101, 48109)]
+    by_id = {r.post_id: r for r in records}
+    # 纯图片消息没有正文
+    assert by_id['DeJob_official/48102'].text is None
+    # 取正文而不是引用的回复、转发头；<br> 转成换行，实体解码，注释不输出
+    reply = by_id['DeJob_official/48103']
+    assert reply.text.startswith('＃招聘 #运营经理 #兼职\n🔥 急招\n')
+    assert '可远程\n联系 ops@okx-ventures.com' in reply.text
+    assert '跨链桥 & 清算模块' in by_id['DeJob_official/48101'].text
+    assert by_id['DeJob_official/48101'].datetime == '2026-10-12T03:15:42+00:00'
+
+@pytest.mark.skipif('lxml' not in bacnked.PARSER_BACKENDS, reason='lxml 未安装')
+@pytest.mark.parametrize('size', [None, 97, 4096])
+def test_lxml_backend_matches_bs4(size):
+    html = read_fixture('tme_page.html')
+    expected = bacnked.parse_page_bs4([html])
+    assert bacnked.parse_page_lxml([html] if size is None else chunked(html, size)) == expected
+    # 两个引擎得到的 job_data 也完全相同
+    jobs = [bacnked.JobParser.parse_message(record) for record in expected[0]]
+    assert sum(job is not None for job in jobs) == 6
+
+def test_parser_backend_falls_back_without_lxml(tmp_path):
+    # 在子进程里屏蔽 lxml 再导入 bacnked：auto 退回 html.parser，显式指定 lxml 报错
+    script = '''
+import json, sys
+sys.modules['lxml'] = None
+import bacnked
+assert list(bacnked.PARSER_BACKENDS) == ['html.parser']
+assert bacnked.get_parser_backend('auto') is bacnked.parse_page_bs4
+try:
+    bacnked.get_parser_backend('lxml')
+except ValueError:
+    pass
+else:
+    raise AssertionError('lxml 未安装时不应可用')
+records, has_newer = bacnked.get_parser_backend()([open(sys.argv[1], encoding='utf-8').read()])
+print(json.dumps([list(records), has_newer]))
+'''
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(bacnked.__file__)), HTML_PARSER_BACKEND='auto')
+    result = subprocess.run([sys.executable, '-c', script, os.path.join(FIXTURES, 'tme_page.html')],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    records, has_newer = bacnked.parse_page_bs4([read_fixture('tme_page.html')])
+    assert json.loads(result.stdout.splitlines()[-1]) == [[list(r) for r in records], has_newer]
+
+# ================= JobParser 与基线解析器一致 =================
+FIXTURE_PAGES = sorted(f for f in os.listdir(FIXTURES) if f.endswith('.html'))
+
+def assert_matches_baseline(backend, page_html):
+    """backend + JobParser 的输出与冻结的基线解析器一致 (不比较 CHANGED_FIELDS 和基线没有的字段)"""
+    expected = benchmark.reference_parse(page_html)
+    actual = benchmark.backend_parse(backend, page_html)
+    assert len(actual) == len(expected)
+    for want, got in zip(expected, actual):
+        if want and got:
+            got = {k: v for k, v in got.items() if k in want}
+        assert got == want
+    return sum(job is not None for job in expected)
+
+@pytest.mark.parametrize('backend', sorted(bacnked.PARSER_BACKENDS))
+@pytest.mark.parametrize('page', FIXTURE_PAGES)
+def test_jobparser_matches_baseline_on_fixtures(backend, page):
+    assert assert_matches_baseline(bacnked.PARSER_BACKENDS[backend], read_fixture(page)) > 0
+
+@pytest.mark.parametrize('backend', sorted(bacnked.PARSER_BACKENDS))
+def test_jobparser_matches_baseline_on_synthetic_pages(backend):
+    rng = random.Random(7)
+    total = 10 * bacnked.PAGE_SPAN
+    for i in range(10):
+        assert_matches_baseline(bacnked.PARSER_BACKENDS[backend],
+                                benchmark.synthetic_page(rng, total - i * bacnked.PAGE_SPAN, total))
+
+# ================= 回填流水线 =================
+def serve_history(pages, numbers):
+    """按 t.me/s 的翻页规则提供 numbers 这些消息：?before=c 返回小于 c 的最新 PAGE_SPAN 条"""
+    base = 'https://t.me/s/DeJob_official'
+    numbers = sorted(numbers)
+    pages[base] = page_html(numbers[-bacnked.PAGE_SPAN:])
+    for cursor in range(2, numbers[-1] + 1):
+        pages[f'{base}?before={cursor}'] = page_html([n for n in numbers if n < cursor][-bacnked.PAGE_SPAN:])
+
+def test_backfill_saves_whole_history_across_gaps(db, channel, monkeypatch):
+    pages, _ = channel
+    # 41..55 被删除，预测的游标会落进空洞
+    history = [n for n in range(1, 101) if not 41 <= n <= 55]
+    serve_history(pages, history)
+    monkeypatch.setattr(bacnked, 'WRITE_BATCH_SIZE', 7)
+
+    assert bacnked.WebScraper().backfill(workers=2) == len(history)
+    assert sorted(job['id'] for job in bacnked.query_jobs({}, limit=200)[0]) == \
+        sorted(f'DeJob_official/{n}' for n in history)
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_BACKFILL_BEFORE)) == bacnked.BACKFILL_DONE
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_LAST_POST_ID)) == '100'
+    # 已完成的回填不再抓取
+    assert bacnked.WebScraper().backfill(workers=2) == 0
+
+def test_backfill_checkpoint_follows_committed_batches(db, channel, monkeypatch):
+    pages, _ = channel
+    serve_history(pages, range(1, 101))
+    monkeypatch.setattr(bacnked, 'WRITE_BATCH_SIZE', bacnked.PAGE_SPAN)
+    save = bacnked.save_jobs_to_db
+    calls = []
+    def flaky_save(jobs):
+        calls.append(len(jobs))
+        if len(calls) == 2: raise sqlite3.OperationalError('database is locked')
+        return save(jobs)
+    monkeypatch.setattr(bacnked, 'save_jobs_to_db', flaky_save)
+
+    with pytest.raises(sqlite3.OperationalError):
+        bacnked.WebScraper().backfill(workers=2)
+    # 只有第一批 (81..100) 入库，断点停在它之后
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_BACKFILL_BEFORE)) == '81'
+    assert len(bacnked.query_jobs({}, limit=200)[0]) == 20
+
+    # 从断点继续，补齐剩余部分
+    monkeypatch.setattr(bacnked, 'save_jobs_to_db', save)
+    assert bacnked.WebScraper().backfill(workers=2) == 80
+    assert len(bacnked.query_jobs({}, limit=200)[0]) == 100
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_BACKFILL_BEFORE)) == bacnked.BACKFILL_DONE
+
+def test_backfill_stops_resumably_on_fetch_error(db, channel):
+    pages, _ = channel
+    serve_history(pages, range(1, 101))
+    pages['https://t.me/s/DeJob_official?before=41'] = FakeResponse(status_code=404)
+
+    total = bacnked.WebScraper().backfill(workers=2)
+    assert total == 60
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_BACKFILL_BEFORE)) == '41'
+
+    pages['https://t.me/s/DeJob_official?before=41'] = page_html(range(21, 41))
+    assert bacnked.WebScraper().backfill(workers=2) == 40
+    assert bacnked.get_scrape_state(channel_key(bacnked.STATE_BACKFILL_BEFORE)) == bacnked.BACKFILL_DONE
+
+# ================= 写库 =================
+def stored_rows(db):
+    conn = sqlite3.connect(db)
+    try:
+        return {row[0]: row[1:] for row in conn.execute('SELECT id, title, updated_at, content_hash FROM jobs')}
+    finally:
+        conn.close()
+
+def test_writer_upserts_only_changed_rows(db):
+    jobs = [make_job(n, days_ago(1)) for n in range(1, 4)]
+    assert bacnked.save_jobs_to_db(jobs) == {'inserted': 3, 'updated': 0, 'unchanged': 0}
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE jobs SET updated_at = '2000-01-01 00:00:00'")
+    conn.commit()
+    conn.close()
+
+    jobs[1]['title'] = '前端工程师'
+    counts = bacnked.save_jobs_to_db(jobs + [make_job(4, days_ago(1))])
+    assert counts == {'inserted': 1, 'updated': 1, 'unchanged': 2}
+    rows = stored_rows(db)
+    assert rows['testchan/2'][0] == '前端工程师'
+    assert rows['testchan/2'][1] != '2000-01-01 00:00:00'
+    # 未变化的行不重写，updated_at 保持不变
+    assert rows['testchan/1'][1] == rows['testchan/3'][1] == '2000-01-01 00:00:00'
+    assert len({row[2] for row in rows.values()}) == 4
+
+def test_writer_uses_wal_and_rolls_back_failed_batch(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1))])
+    conn = sqlite3.connect(db)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.execute("""
+        CREATE TRIGGER reject_boom BEFORE INSERT ON jobs WHEN new.title = 'boom' BEGIN
+            SELECT RAISE(ABORT, 'boom');
+        END
+    """)
+    conn.commit()
+    conn.close()
+    # 批内任一行失败，整批回滚，前面的行也不应写入
+    with pytest.raises(sqlite3.IntegrityError):
+        bacnked.save_jobs_to_db([make_job(2, days_ago(1)), make_job(3, days_ago(1), title='boom')])
+    assert sorted(stored_rows(db)) == ['testchan/1']
+    assert bacnked.save_jobs_to_db([make_job(2, days_ago(1))])['inserted'] == 1
+
+# ================= 读连接池与快照 =================
+def test_read_pool_connections_are_read_only(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1))])
+    with bacnked.db_reader.connection() as conn:
+        assert conn.execute('PRAGMA query_only').fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('DELETE FROM jobs')
+    # 连接归还后被复用
+    with bacnked.db_reader.connection() as again:
+        assert again is conn
+
+def test_snapshot_holds_list_fields_and_find_jobs_falls_back(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1)), make_job(2, days_ago(200))])
+    snapshot = bacnked.get_snapshot()
+    assert list(snapshot.by_id) == ['testchan/1']
+    assert 'raw_content' not in snapshot.by_id['testchan/1']
+    # 快照外的旧职位从数据库补读，字段与快照一致
+    found = bacnked.find_jobs(['testchan/1', 'testchan/2', 'missing/1'])
+    assert sorted(found) == ['testchan/1', 'testchan/2']
+    assert set(found['testchan/2']) == set(bacnked.DEFAULT_JOB_FIELDS)
+
+def test_snapshot_refresh_merges_changed_jobs(db):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n)) for n in range(1, 6)])
+    before = bacnked.get_snapshot()
+
+    changed = [make_job(2, days_ago(2), title='前端工程师'), make_job(9, days_ago(0)), make_job(3, days_ago(100))]
+    bacnked.save_jobs_to_db(changed)
+    after = bacnked.refresh_snapshot()
+    assert after.version == before.version + 1
+    # 顺序与整体重建一致：date、id 倒序，移出时间窗口的职位被去掉
+    assert [job['id'] for job in after.jobs] == ['testchan/9', 'testchan/1', 'testchan/2', 'testchan/4', 'testchan/5']
+    assert after.by_id['testchan/2']['title'] == '前端工程师'
+    # 没有变化的职位直接复用旧快照里的对象，不重新读库
+    assert after.by_id['testchan/1'] is before.by_id['testchan/1']
+    assert after.change_version == bacnked.latest_change_version()
+    assert [job['id'] for job in after.jobs] == [job['id'] for job in bacnked.refresh_snapshot(full=True).jobs]
+
+# ================= 响应缓存 =================
+def test_jobs_response_etag_and_compression(client):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 30)])
+    first = client.get('/api/jobs?limit=20')
+    assert first.status_code == 200
+    etag = first.headers['ETag'].strip('"')
+    assert client.get('/api/jobs?limit=20', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+
+    zipped = client.get('/api/jobs?limit=20', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(zipped.data) == first.data
+    assert len(first.get_json()['jobs']) == 20
+
+def test_jobs_response_cache_follows_database_writes(client):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1))])
+    assert [job['id'] for job in client.get('/api/jobs').get_json()['jobs']] == ['testchan/1']
+    # 不经过快照刷新的写入同样让缓存失效
+    bacnked.save_jobs_to_db([make_job(2, days_ago(0))])
+    assert [job['id'] for job in client.get('/api/jobs').get_json()['jobs']] == ['testchan/2', 'testchan/1']
+    # 内容没有变化的写入不改变数据版本
+    version = bacnked.data_version()
+    bacnked.save_jobs_to_db([make_job(2, days_ago(0))])
+    assert bacnked.data_version() == version
+
+# ================= 投递队列 =================
+SMTP_SECRET = 'Zq7-smtp-auth-code'
+
+class FakeSMTPSession:
+    """按命令应答的假 SMTP 会话，收到的邮件按 DATA 的字节还原后记在 sent 里
+
+    extensions 控制是否声明 PIPELINING；reject 里的收件人在 RCPT 时被拒；
+    errors 里的异常按顺序在下一次发信开始时抛出。
+    """
+    def __init__(self, server, password):
+        self.server = server
+        self.password = password
+        self.replies = collections.deque()
+        self.data = None
+        self.recipients = 0
+        self.closed = False
+        self.docmds = 0
+
+    def ehlo_or_helo_if_needed(self):
+        if self.server.errors: raise self.server.errors.pop(0)
+
+    def has_extn(self, name):
+        return name.lower() in self.server.extensions
+
+    def _command(self, command):
+        verb = command[:4].upper()
+        if verb == 'MAIL':
+            self.recipients = 0
+            return 250, b'ok'
+        if verb == 'RCPT':
+            if any(rejected in command for rejected in self.server.reject): return 550, b'no such user'
+            self.recipients += 1
+            return 250, b'ok'
+        if verb == 'DATA':
+            if not self.recipients: return 503, b'no valid recipients'
+            self.data = []
+            return 354, b'go ahead'
+        raise AssertionError(command)
+
+    def docmd(self, command):
+        self.docmds += 1
+        return self._command(command)
+
+    def send(self, data):
+        if isinstance(data, str):
+            self.replies.extend(self._command(c) for c in data.split('\r\n')[:-1])
+            return
+        self.data.append(data)
+        raw = b''.join(self.data)
+        if raw.endswith(b'\r\n.\r\n'):
+            self.data = None
+            if raw != b'.\r\n':
+                self.server.sent.append(email.message_from_bytes(re.sub(rb'(?m)^\.\.', b'.', raw[:-3])))
+            self.replies.append((250, b'queued'))
+
+    def getreply(self):
+        return self.replies.popleft()
+
+    def rset(self):
+        return 250, b'ok'
+
+    def noop(self):
+        return 250, b'ok'
+
+    def close(self):
+        self.closed = True
+
+    def quit(self):
+        self.closed = True
+
+class FakeSMTP:
+    """代替 open_smtp：记录每次登录，返回 FakeSMTPSession"""
+    def __init__(self):
+        self.logins = []
+        self.sessions = []
+        self.sent = []
+        self.errors = []
+        self.reject = set()
+        self.extensions = {'pipelining'}
+
+    def open(self, host, port, user, password):
+        self.logins.append((host, port, user, password))
+        self.sessions.append(FakeSMTPSession(self, password))
+        return self.sessions[-1]
+
+@pytest.fixture
+def sending(db, monkeypatch):
+    """不启动后台线程的投递队列，由 drain() 在当前线程里发送；SMTP 换成 FakeSMTP"""
+    queue = bacnked.SendQueue(workers=0)
+    monkeypatch.setattr(bacnked, 'send_queue', queue)
+    monkeypatch.setattr(bacnked, 'SEND_RATE', 1000)
+    monkeypatch.setattr(bacnked, 'SEND_BURST', 100)
+    smtp = FakeSMTP()
+    monkeypatch.setattr(bacnked, 'open_smtp', smtp.open)
+    monkeypatch.setattr(bacnked, 'smtp_pool', bacnked.SmtpPool())
+    return queue, smtp
+
+def drain(queue):
+    while True:
+        task, _ = queue._claim()
+        if task is None: return
+        queue._process(task)
+
+def post_resume(client, job_ids, **form):
+    data = {'resume': (io.BytesIO(b'%PDF-1.4 resume'), 'cv.pdf'), 'smtp_user': 'me@example.com',
+            'smtp_pass': SMTP_SECRET, 'jobIds': json.dumps(job_ids)}
+    data.update(form)
+    return client.post('/api/send-resume', data=data, content_type='multipart/form-data')
+
+def batch_row(db, batch_id):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute('SELECT status, resume, smtp_pass FROM send_batches WHERE id = ?', (batch_id,)).fetchone()
+    finally:
+        conn.close()
+
+def test_send_resume_queues_and_delivers(client, sending, db):
+    queue, smtp = sending
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), email='hr1@x.io'), make_job(2, days_ago(1))])
+    resp = post_resume(client, ['testchan/1', 'testchan/2', 'testchan/1', 'nope/1'])
+    assert resp.status_code == 202
+    body = resp.get_json()
+    # 去重后 3 个 id，只有 1 个有邮箱
+    assert (body['queued'], body['skipped']) == (1, 2)
+
+    drain(queue)
+    assert [m['To'] for m in smtp.sent] == ['hr1@x.io']
+    assert smtp.logins[-1] == ('smtp.qq.com', 587, 'me@example.com', SMTP_SECRET)
+    status = client.get(f"/api/send-batches/{body['batch_id']}").get_json()
+    assert status['status'] == 'done' and status['counts']['sent'] == 1
+    # 批次结束后简历和授权码都不再保留
+    assert batch_row(db, body['batch_id']) == ('done', None, None)
+
+def test_smtp_password_never_reaches_disk_in_plaintext(client, sending, db, tmp_path):
+    queue, smtp = sending
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), email='hr1@x.io')])
+    batch_id = post_resume(client, ['testchan/1']).get_json()['batch_id']
+
+    stored = batch_row(db, batch_id)[2]
+    assert stored and SMTP_SECRET not in stored
+    key = (tmp_path / 'jobs.db.key').read_bytes()
+    for path in tmp_path.iterdir():
+        if path.name.startswith('jobs.db') and path.suffix != '.key':
+            data = path.read_bytes()
+            assert SMTP_SECRET.encode() not in data
+            assert key not in data
+    # 发送线程能解密出原来的授权码
+    drain(queue)
+    assert smtp.logins[-1][3] == SMTP_SECRET
+
+@pytest.mark.parametrize('port', ['abc', '0', '70000'])
+def test_send_resume_rejects_invalid_port(client, sending, port):
+    resp = post_resume(client, ['testchan/1'], smtp_port=port)
+    assert resp.status_code == 400
+    assert 'smtp_port' in resp.get_json()['msg']
+
+def test_send_retries_transient_errors_and_fails_permanent_ones(client, sending, db):
+    queue, smtp = sending
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), email='hr1@x.io')])
+    batch_id = post_resume(client, ['testchan/1']).get_json()['batch_id']
+
+    smtp.errors = [bacnked.smtplib.SMTPResponseException(421, b'try later'),
+                   bacnked.smtplib.SMTPResponseException(550, b'mailbox unavailable')]
+    drain(queue)
+    task = queue.status(batch_id)['tasks'][0]
+    assert (task['status'], task['attempts']) == ('pending', 1)
+    assert task['next_attempt_at'] > bacnked.time.time()
+
+    conn = sqlite3.connect(db)
+    conn.execute('UPDATE send_tasks SET next_attempt_at = 0')
+    conn.commit()
+    conn.close()
+    drain(queue)
+    status = queue.status(batch_id)
+    assert status['tasks'][0]['status'] == 'failed' and status['tasks'][0]['attempts'] == 2
+    assert batch_row(db, batch_id) == ('done', None, None)
+
+def test_send_queue_start_closes_finished_batches(db):
+    queue = bacnked.SendQueue(workers=0)
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO send_batches (id, provider, resume, smtp_pass) VALUES ('b1', 'smtp', x'00', 'token')")
+    conn.execute("INSERT INTO send_tasks (batch_id, job_id, email, status) VALUES ('b1', 'x/1', 'a@x.io', 'sent')")
+    conn.execute("INSERT INTO send_batches (id, provider) VALUES ('b2', 'smtp')")
+    conn.execute("INSERT INTO send_tasks (batch_id, job_id, email, status) VALUES ('b2', 'x/2', 'b@x.io', 'sending')")
+    conn.commit()
+    conn.close()
+    queue.start('worker-a')
+    assert batch_row(db, 'b1') == ('done', None, None)
+    # 进程退出时正在发送的任务重新排队
+    assert queue.status('b2')['tasks'][0]['status'] == 'pending'
+
+def task_rows(db):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute('SELECT status, claimed_by FROM send_tasks ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+def test_send_queue_recovery_across_schedulers(db):
+    first, second = bacnked.SendQueue(workers=0), bacnked.SendQueue(workers=0)
+    first.owner, second.owner = 'worker-a', 'worker-b'
+    assert bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-a', 60)
+    batch_id = first.enqueue('smtp', [{'id': 'x/1', 'email': 'a@x.io'}], 'cv.pdf', b'%PDF')
+    # enqueue 只登记任务，不在 web 进程里启动发送线程
+    assert first.threads == []
+    task, _ = first._claim()
+    assert task_rows(db) == [('sending', 'worker-a')]
+
+    # 认领者的租约仍然有效，任务可能还在发送，不能恢复
+    assert second.recover() == 0
+    # worker-a 卡住超过租约时间，worker-b 接管后重新排队
+    bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-a', -1)
+    assert bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-b', 60)
+    assert second.recover() == 1
+    assert task_rows(db) == [('pending', None)]
+    # worker-a 之后才发完，结果被丢弃，不会覆盖 worker-b 的状态
+    first._finish(task, 'sent', 1, 0, None)
+    assert task_rows(db) == [('pending', None)]
+
+    retry, _ = second._claim()
+    assert retry.id == task.id and task_rows(db) == [('sending', 'worker-b')]
+    second._finish(retry, 'sent', 1, 0, None)
+    assert second.status(batch_id)['status'] == 'done'
+
+# ================= 简历模板 =================
+def test_resume_template_renders_valid_messages_sharing_one_attachment():
+    resume = bytes(range(256)) * 40
+    template = bacnked.ResumeTemplate('cv.pdf', resume)
+    first = template.render('me@example.com', 'a@x.io', '后端')
+    second = template.render('me@example.com', 'b@x.io', '.前端')
+    # 附件段对所有收件人是同一个对象
+    assert first[1] is second[1]
+
+    for parts, to in ((first, 'a@x.io'), (second, 'b@x.io')):
+        message = email.message_from_bytes(b''.join(parts))
+        assert message['To'] == to
+        body, attachment = message.get_payload()
+        assert '职位非常感兴趣' in body.get_payload(decode=True).decode('utf-8')
+        assert attachment.get_filename() == 'cv.pdf'
+        assert attachment.get_payload(decode=True) == resume
+
+def test_smtp_send_parts_delivers_template_through_data(sending):
+    _, smtp = sending
+    template = bacnked.ResumeTemplate('cv.pdf', b'%PDF-1.4\n.hidden line\n')
+    session = smtp.open('smtp.x.io', 587, 'me@example.com', 'pw')
+    bacnked.smtp_send_parts(session, 'me@example.com', 'a@x.io', template.render('me@example.com', 'a@x.io', '运营'))
+    attachment = smtp.sent[0].get_payload()[1]
+    assert attachment.get_payload(decode=True) == b'%PDF-1.4\n.hidden line\n'
+
+def test_chained_reader_reads_and_seeks_across_parts():
+    parts = [b'head-', b'attachment', b'-end']
+    reader = bacnked.ChainedReader(parts)
+    assert reader.size == len(b''.join(parts))
+    assert reader.read(7) == b'head-at'
+    reader.seek(-6, io.SEEK_END)
+    assert reader.read() == b'nt-end'
+    reader.seek(3)
+    assert reader.read(100) == b''.join(parts)[3:]
+    assert reader.read(1) == b''
+
+# ================= Gmail 客户端与限流 =================
+def utcnow():
+    # google-auth 的 expiry 是不带时区的 UTC 时间
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+class FakeCredentials:
+    def __init__(self, expires_in=3600):
+        self.refresh_token = 'refresh'
+        self.expiry = utcnow() + datetime.timedelta(seconds=expires_in)
+        self.refreshed = 0
+
+    @property
+    def valid(self):
+        return self.expiry > utcnow()
+
+    def refresh(self, request):
+        self.refreshed += 1
+        self.expiry = utcnow() + datetime.timedelta(hours=1)
+
+    def to_json(self):
+        return json.dumps({'refresh_token': self.refresh_token})
+
+@pytest.fixture
+def gmail(tmp_path, monkeypatch):
+    """token 文件放在 tmp_path，读取结果换成 FakeCredentials，记录读取次数"""
+    token_file = tmp_path / 'gmail_token.json'
+    token_file.write_text('{}')
+    loads = []
+    def load(path, scopes):
+        loads.append(path)
+        return FakeCredentials()
+    monkeypatch.setattr(bacnked.Credentials, 'from_authorized_user_file', staticmethod(load))
+    return bacnked.GmailClient(token_file=str(token_file)), token_file, loads
+
+def test_gmail_credentials_reload_only_when_token_file_changes(gmail):
+    client, token_file, loads = gmail
+    creds = client.credentials()
+    assert client.credentials() is creds
+    assert len(loads) == 1
+    # 文件被其他进程改写后重新读取
+    stat = token_file.stat()
+    os.utime(token_file, (stat.st_atime, stat.st_mtime + 10))
+    assert client.credentials() is not creds
+    assert len(loads) == 2
+
+def test_gmail_credentials_refresh_before_expiry(gmail):
+    client, token_file, loads = gmail
+    creds = client.credentials()
+    creds.expiry = utcnow() + datetime.timedelta(seconds=bacnked.GMAIL_REFRESH_MARGIN // 2)
+    assert client.credentials() is creds
+    assert creds.refreshed == 1
+    # 刷新后的令牌写回文件，但不会因为自己写文件而重新读取
+    assert json.loads(token_file.read_text()) == {'refresh_token': 'refresh'}
+    assert client.credentials() is creds and len(loads) == 1
+
+def http_error(status, retry_after=None, reason=None):
+    headers = {'status': status}
+    if retry_after is not None: headers['retry-after'] = retry_after
+    content = json.dumps({'error': {'errors': [{'reason': reason}] if reason else []}}).encode()
+    return bacnked.HttpError(httplib2.Response(headers), content)
+
+def test_gmail_rate_limit_detection():
+    assert bacnked.gmail_rate_limited(http_error(429))
+    assert bacnked.gmail_rate_limited(http_error(403, reason='userRateLimitExceeded'))
+    assert not bacnked.gmail_rate_limited(http_error(403, reason='insufficientPermissions'))
+    assert not bacnked.gmail_rate_limited(http_error(500))
+
+def test_gmail_rate_limit_pauses_provider_without_using_attempts(sending, monkeypatch):
+    queue, _ = sending
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1), email=f'hr{n}@x.io') for n in (1, 2)])
+    batch_id = queue.enqueue('gmail', bacnked.select_send_targets(['testchan/1', 'testchan/2']), 'cv.pdf', b'%PDF')
+    def rate_limited(batch, task): raise http_error(429, retry_after='30')
+    monkeypatch.setattr(queue, '_send', rate_limited)
+
+    drain(queue)
+    tasks = queue.status(batch_id)['tasks']
+    # 第一封被限流后整个 Gmail 令牌桶暂停，第二封不再尝试；都不计入重试次数
+    assert [t['status'] for t in tasks] == ['pending', 'pending']
+    assert [t['attempts'] for t in tasks] == [0, 0]
+    assert queue._bucket('gmail').try_acquire() > 20
+
+# ================= SMTP 连接池 =================
+def send_via_pool(password='pw', to='a@x.io'):
+    template = bacnked.ResumeTemplate('cv.pdf', b'%PDF')
+    with bacnked.smtp_pool.connection('smtp.x.io', 587, 'me@example.com', password) as server:
+        bacnked.smtp_send_parts(server, 'me@example.com', to, template.render('me@example.com', to, '运营'))
+
+def test_smtp_pool_reuses_login_per_password(sending):
+    _, smtp = sending
+    send_via_pool()
+    send_via_pool()
+    assert len(smtp.logins) == 1 and len(smtp.sent) == 2
+    # 换了密码不复用别人登录好的会话，旧连接被关闭
+    send_via_pool(password='other')
+    assert [login[3] for login in smtp.logins] == ['pw', 'other']
+    assert smtp.sessions[0].closed
+
+@pytest.mark.parametrize('pipelining', [True, False])
+def test_smtp_send_parts_with_and_without_pipelining(sending, pipelining):
+    _, smtp = sending
+    if not pipelining: smtp.extensions.clear()
+    send_via_pool()
+    assert [m['To'] for m in smtp.sent] == ['a@x.io']
+    # 支持 PIPELINING 时三条命令一次写出，不逐条 docmd
+    assert smtp.sessions[0].docmds == (0 if pipelining else 3)
+
+def test_smtp_pool_keeps_session_after_rejection_and_drops_it_on_421(sending):
+    _, smtp = sending
+    smtp.reject.add('bad@x.io')
+    with pytest.raises(bacnked.smtplib.SMTPRecipientsRefused):
+        send_via_pool(to='bad@x.io')
+    send_via_pool()
+    assert len(smtp.logins) == 1 and len(smtp.sent) == 1
+
+    smtp.errors.append(bacnked.smtplib.SMTPResponseException(421, b'closing'))
+    with pytest.raises(bacnked.smtplib.SMTPResponseException):
+        send_via_pool()
+    send_via_pool()
+    assert len(smtp.logins) == 2 and smtp.sessions[0].closed
+
+# ================= 去重 =================
+POSTING = ("{company} 招聘 {title}\n项目: {company}\n薪资: 3000-5000U\n"
+           "岗位职责: 负责交易所核心撮合引擎的设计与开发，参与风控和清结算系统的重构。\n"
+           "任职要求: 三年以上 Go 或 Rust 经验，熟悉分布式系统，有加密货币行业经验优先。\n"
+           "投递邮箱: hr@{company}.io\n#招聘 #{title}")
+
+def canonical_ids(db):
+    conn = sqlite3.connect(db)
+    try:
+        return dict(conn.execute('SELECT id, canonical_id FROM jobs'))
+    finally:
+        conn.close()
+
+def test_dedup_clusters_reposts(db):
+    original = POSTING.format(company='acme', title='后端工程师')
+    bacnked.save_jobs_to_db([
+        make_job(1, days_ago(3), original),
+        # 换了消息 id 重发，只改了链接和标点
+        make_job(2, days_ago(1), original.replace('投递邮箱:', '投递邮箱：') + '\nhttps://t.me/acme_jobs'),
+        make_job(3, days_ago(2)),
+    ])
+    # 同一批里的重复同样能匹配上
+    bacnked.save_jobs_to_db([make_job(4, days_ago(2), original + '!!'), make_job(5, days_ago(2))])
+
+    # 日期最新的一条是代表行，其余指向它
+    assert canonical_ids(db) == {'testchan/1': 'testchan/2', 'testchan/2': None, 'testchan/3': None,
+                                 'testchan/4': 'testchan/2', 'testchan/5': None}
+    jobs, _ = bacnked.query_jobs(bacnked.parse_job_query({})['filters'])
+    assert [job['id'] for job in jobs] == ['testchan/2', 'testchan/5', 'testchan/3']
+    jobs, _ = bacnked.query_jobs(bacnked.parse_job_query({'include_duplicates': 'true'})['filters'])
+    assert len(jobs) == 5
+
+def test_dedup_keeps_distinct_postings_apart(db):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 30)])
+    assert not any(canonical_ids(db).values())
+
+def test_snapshot_merge_rereads_cluster_members(db):
+    original = POSTING.format(company='acme', title='运营')
+    bacnked.save_jobs_to_db([make_job(1, days_ago(3), original)])
+    bacnked.refresh_snapshot()
+    # 新的重发成为代表行，旧行的 canonical_id 在快照里也要跟着变
+    bacnked.save_jobs_to_db([make_job(2, days_ago(1), original + '\nhttps://t.me/acme')])
+    snapshot = bacnked.refresh_snapshot()
+    assert snapshot.by_id['testchan/1']['canonical_id'] == 'testchan/2'
+    assert snapshot.by_id['testchan/2']['canonical_id'] is None
+
+def test_send_targets_pick_one_posting_per_cluster(db):
+    original = POSTING.format(company='acme', title='运营')
+    bacnked.save_jobs_to_db([make_job(1, days_ago(3), original, email='hr@acme.io'),
+                             make_job(2, days_ago(1), original + '!', email='hr@acme.io'),
+                             make_job(3, days_ago(1), email='hr3@x.io')])
+    targets = bacnked.select_send_targets(['testchan/1', 'testchan/2', 'testchan/3'])
+    assert [job['id'] for job in targets] == ['testchan/1', 'testchan/3']
+
+def test_dedup_pending_signs_old_rows_in_batches(db):
+    original = POSTING.format(company='acme', title='运营')
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n), original + '!' * n) for n in range(1, 6)]
+                            + [make_job(9, days_ago(1), '')])
+    # 模拟引入去重之前的旧库：没有签名也没有分簇
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute('UPDATE jobs SET minhash = NULL, canonical_id = NULL')
+        conn.execute('DELETE FROM job_lsh')
+    conn.close()
+
+    # 正文为空的行算不出签名，不会被反复处理
+    assert list(bacnked.job_writer.dedup_batches(batch_size=2)) == [2, 2, 2]
+    assert canonical_ids(db) == {'testchan/1': None, 'testchan/2': 'testchan/1', 'testchan/3': 'testchan/1',
+                                 'testchan/4': 'testchan/1', 'testchan/5': 'testchan/1', 'testchan/9': None}
+    assert bacnked.job_writer.dedup_pending() == 1
+
+# ================= 结构化薪资与地点 =================
+@pytest.mark.parametrize('text, expected', [
+    ('项目: Acme\n薪资: 15-25K/月\n工作地点：上海 (混合办公)',
+     {'salary_min': 15000, 'salary_max': 25000, 'salary_currency': 'CNY', 'salary_period': 'month',
+      'salary_usd_month': 3500, 'location': '上海 (混合办公)', 'is_remote': 0, 'work_mode': 'hybrid'}),
+    ('Company: Foo\nSalary: $50/hour\nFully remote',
+     {'salary_min': 50, 'salary_max': 50, 'salary_currency': 'USD', 'salary_period': 'hour',
+      'salary_usd_month': 8700, 'location': '远程', 'is_remote': 1, 'work_mode': 'remote'}),
+    ('项目: Baz\n薪资面议\n办公地点: 新加坡',
+     {'salary_min': None, 'salary_max': None, 'salary_currency': None, 'salary_period': None,
+      'salary_usd_month': None, 'location': '新加坡', 'is_remote': 0, 'work_mode': 'onsite'}),
+])
+def test_parser_extracts_salary_range_and_work_mode(text, expected):
+    _, salary_line, _ = bacnked.JobParser.scan_lines(text)
+    assert bacnked.JobParser.structured_fields(text, [], salary_line) == expected
+
+def test_structured_filters_after_backfill(db, monkeypatch):
+    bacnked.save_jobs_to_db([
+        make_job(1, days_ago(1), '项目: A\n薪资: 3000-5000U\n#远程'),
+        make_job(2, days_ago(1), '项目: B\n薪资: 20-30K\n工作地点: 深圳'),
+        make_job(3, days_ago(1), '项目: C\n薪资: 2000U\n混合办公'),
+    ])
+    # 模拟引入结构化字段之前写入的旧行
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute('UPDATE jobs SET parsed_version = NULL, salary_max = NULL, salary_usd_month = NULL, work_mode = NULL')
+    conn.close()
+    assert bacnked.job_writer.backfill_structured_fields(batch_size=2) == 3
+
+    def ids(args):
+        query = bacnked.parse_job_query(args)
+        return sorted(job['id'] for job in bacnked.query_jobs(query['filters'])[0])
+
+    assert ids({'work_mode': 'remote'}) == ['testchan/1'] == ids({'remote': 'true'})
+    assert ids({'work_mode': 'onsite'}) == ['testchan/2']
+    # 30K 人民币约合 4200 美元/月
+    assert ids({'salary_usd_min': '4000'}) == ['testchan/1', 'testchan/2']
+    assert ids({'salary_min': '10000'}) == ['testchan/2']
+
+    # 汇率表变化后只重算美元月薪，不再重新解析
+    monkeypatch.setitem(bacnked.SALARY_RATES, 'CNY', 0.1)
+    assert bacnked.job_writer.backfill_structured_fields() == 0
+    assert ids({'salary_usd_min': '4000'}) == ['testchan/1']
+
+def test_invalid_work_mode_is_rejected(client):
+    response = client.get('/api/jobs', query_string={'work_mode': 'moon'})
+    assert response.status_code == 400
+    assert 'work_mode' in response.get_json()['msg']
+
+# ================= 迁移 =================
+# 基线版本 (a8ed4e2) 的 init_db 建出的表，没有 user_version
+BASELINE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        company TEXT,
+        title TEXT,
+        salary TEXT,
+        date TEXT,
+        email TEXT,
+        location TEXT,
+        raw_content TEXT,
+        tags TEXT,
+        type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_date ON jobs(date DESC);
+    CREATE INDEX IF NOT EXISTS idx_company ON jobs(company);
+    CREATE INDEX IF NOT EXISTS idx_type ON jobs(type);
+'''
+
+def test_migrate_baseline_schema(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    posting = POSTING.format(company='acme', title='后端工程师')
+    conn.executemany('''
+        INSERT INTO jobs (id, company, title, salary, date, email, location, raw_content, tags, type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        ('testchan/1', 'Acme', '后端工程师', '5000U', days_ago(1), 'a@acme.io', '远程', posting,
+         '["招聘", "后端工程师"]', '全职'),
+        ('testchan/2', 'Acme', '后端工程师', '5000U', days_ago(0), 'a@acme.io', '远程', posting + ' ',
+         '["招聘", "后端工程师"]', '全职'),
+        ('testchan/3', 'Other', '运营', '面议', days_ago(2), '', '远程', make_job(3, days_ago(2))['raw_content'],
+         '["招聘", "运营"]', '全职'),
+    ])
+    conn.commit()
+    conn.close()
+
+    use_database(path)
+    # 再执行一次 init_db 不会重复迁移
+    bacnked.init_db()
+    with bacnked.db_reader.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(bacnked.SCHEMA_MIGRATIONS)
+        rows = dict(conn.execute('SELECT id, date_ts FROM jobs'))
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        tags = conn.execute("SELECT COUNT(*) FROM job_tags WHERE tag = '运营'").fetchone()[0]
+    assert rows['testchan/3'] == bacnked.date_to_ts(days_ago(2))
+    assert 'idx_canonical_date_ts' in indexes and 'idx_date' not in indexes
+    assert tags == 1
+
+    # 旧数据没有签名，补算后两条重发的招聘归为一簇，较新的一条是代表行
+    assert bacnked.job_writer.dedup_pending(batch_size=2) == 3
+    jobs, _ = bacnked.query_jobs(bacnked.parse_job_query({})['filters'])
+    assert [job['id'] for job in jobs] == ['testchan/2', 'testchan/3']
+    assert [job['id'] for job in bacnked.query_jobs(bacnked.parse_job_query({'tag': '运营'})['filters'])[0]] \
+        == ['testchan/3']
+
+def test_migrate_rejects_newer_database(db):
+    conn = sqlite3.connect(db, isolation_level=None)
+    conn.execute(f'PRAGMA user_version = {len(bacnked.SCHEMA_MIGRATIONS) + 1}')
+    with pytest.raises(RuntimeError):
+        bacnked.migrate(conn)
+    conn.close()
+
+@pytest.mark.parametrize('args', [{}, {'tag': '运营'}])
+def test_default_list_query_walks_canonical_index_without_sorting(db, args):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n % 5)) for n in range(1, 50)])
+    where, params = bacnked.job_filter_sql(bacnked.parse_job_query(args)['filters'])
+    where.append('(date_ts, id) < (?, ?)')
+    params.extend([bacnked.date_to_ts(days_ago(1)), 'testchan/9'])
+    with bacnked.db_reader.connection() as conn:
+        plan = ' / '.join(row[-1] for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE {' AND '.join(where)} ORDER BY date_ts DESC, id DESC LIMIT 10",
+            params))
+    assert 'idx_canonical_date_ts' in plan and 'TEMP B-TREE' not in plan
+
+def test_date_string_cursor_is_rejected(client):
+    cursor = bacnked.base64.urlsafe_b64encode(json.dumps([days_ago(1), 'testchan/1']).encode()).decode()
+    response = client.get('/api/jobs', query_string={'cursor': cursor})
+    assert response.status_code == 400
+
+# ================= 分面计数 =================
+def facet_counts(filters, facets=('type', 'tag', 'company')):
+    return {facet: {item['value']: item['count'] for item in values}
+            for facet, values in bacnked.query_facets(filters, facets).items()}
+
+def test_facet_summary_matches_group_by_and_follows_writes(db):
+    original = POSTING.format(company='acme', title='运营')
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n % 4), type='全职' if n % 3 else '兼职', tags=['招聘', f't{n % 2}'])
+                             for n in range(1, 13)]
+                            + [make_job(20, days_ago(2), original), make_job(21, days_ago(1), original + '!')])
+    # 改标签、改类型都要挪动计数；清理旧数据后计数跟着减少
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), type='兼职', tags=['招聘', 't9'])])
+    filters = bacnked.parse_job_query({'days': '3'})['filters']
+    summary = facet_counts(filters)
+    # 额外的筛选条件 (has_email=false 对所有行成立) 让查询退回到在 jobs 上 GROUP BY
+    assert summary == facet_counts(dict(filters, has_email=False))
+    assert summary['tag']['t9'] == 1
+    # 重复簇只计代表行
+    assert summary['company'].get('company20', 0) + summary['company'].get('company21', 0) == 1
+    with_duplicates = facet_counts(dict(filters, include_duplicates=True))
+    assert with_duplicates == facet_counts(dict(filters, include_duplicates=True, has_email=False))
+    assert with_duplicates['tag']['招聘'] == summary['tag']['招聘'] + 1
+
+    bacnked.cleanup_old_jobs(2)
+    assert facet_counts(filters) == facet_counts(dict(filters, has_email=False))
+    with bacnked.db_reader.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM job_facets WHERE n <= 0').fetchone()[0] == 0
+
+def test_facets_api(client):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1), type='全职' if n % 2 else '兼职') for n in range(1, 6)])
+    response = client.get('/api/facets', query_string={'facets': 'type'})
+    assert response.get_json()['facets'] == {'type': [{'value': '全职', 'count': 3}, {'value': '兼职', 'count': 2}]}
+    again = client.get('/api/facets', query_string={'facets': 'type'},
+                       headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    # 写入后缓存作废
+    bacnked.save_jobs_to_db([make_job(9, days_ago(1), type='兼职')])
+    assert client.get('/api/facets', query_string={'facets': 'type'},
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+    assert client.get('/api/facets', query_string={'facets': 'salary'}).status_code == 400
+
+# ================= 变更流 =================
+def test_change_feed_coalesces_and_reports_deletes(db):
+    original = POSTING.format(company='acme', title='运营')
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1)), make_job(2, days_ago(100)), make_job(3, days_ago(3), original)])
+    since = bacnked.latest_change_version()
+    # 改两次只报一次；被清理的报 delete；被新重发归入簇的旧行对默认列表也是 delete
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), title='前端工程师')])
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), title='测试工程师')])
+    bacnked.cleanup_old_jobs(90)
+    bacnked.save_jobs_to_db([make_job(4, days_ago(1), original + '!')])
+
+    feed = bacnked.changes_since(since)
+    assert not feed['reset'] and not feed['has_more']
+    assert feed['version'] == bacnked.latest_change_version()
+    ops = {change['id']: change for change in feed['changes']}
+    assert [change['id'] for change in feed['changes']].count('testchan/1') == 1
+    assert ops['testchan/1']['job']['title'] == '测试工程师'
+    assert ops['testchan/2']['op'] == 'delete'
+    assert ops['testchan/3']['op'] == 'delete' and ops['testchan/4']['op'] == 'upsert'
+    assert bacnked.changes_since(since, include_duplicates=True)['changes'][-1]['op'] == 'upsert'
+    # 分批取：has_more 时接着用返回的 version
+    first = bacnked.changes_since(since, limit=2)
+    assert first['has_more'] and bacnked.changes_since(first['version'])['version'] == feed['version']
+
+def test_change_feed_resets_when_since_cannot_be_served(db):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 4)])
+    latest = bacnked.latest_change_version()
+    assert bacnked.changes_since(latest + 5)['reset']
+    with bacnked.job_writer.transaction() as conn:
+        conn.execute('DELETE FROM job_changes WHERE version <= 2')
+    assert bacnked.changes_since(0) == {"version": latest, "reset": True, "has_more": False, "changes": []}
+    assert not bacnked.changes_since(2)['reset']
+
+def test_snapshot_refresh_without_changes_or_with_too_many(db, monkeypatch):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 6)])
+    before = bacnked.refresh_snapshot()
+    assert bacnked.refresh_snapshot() is before
+    # 变更超过 CHANGE_FEED_LIMIT 条时整体重建
+    monkeypatch.setattr(bacnked, 'CHANGE_FEED_LIMIT', 2)
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1), title='前端工程师') for n in range(1, 4)])
+    after = bacnked.refresh_snapshot()
+    assert after.by_id['testchan/5'] is not before.by_id['testchan/5']
+    assert after.change_version == bacnked.latest_change_version()
+
+def test_get_snapshot_picks_up_writes_in_background(db, monkeypatch):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1))])
+    first = bacnked.get_snapshot()
+    monkeypatch.setattr(bacnked, 'SNAPSHOT_CHECK_INTERVAL', 0)
+    # 另一个进程的写连接写入，本进程只能从 job_changes 发现
+    other = bacnked.JobWriter(db)
+    other.save([make_job(2, days_ago(1))])
+    other.close()
+    assert bacnked.get_snapshot() is first
+    deadline = time.monotonic() + 5
+    while bacnked._snapshot is first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert 'testchan/2' in bacnked.get_snapshot().by_id
+
+def test_jobs_etag_follows_writes_from_other_writers(client, db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1))])
+    first = client.get('/api/jobs')
+    assert first.get_json()['change_version'] == bacnked.latest_change_version()
+    other = bacnked.JobWriter(db)
+    other.save([make_job(2, days_ago(1))])
+    other.close()
+    again = client.get('/api/jobs', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert [job['id'] for job in again.get_json()['jobs']] == ['testchan/2', 'testchan/1']
+
+def test_change_endpoints(client, monkeypatch):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 4)])
+    latest = bacnked.latest_change_version()
+    feed = client.get('/api/jobs/changes', query_string={'since': 0, 'fields': 'id,title'}).get_json()
+    assert feed['version'] == latest and set(feed['changes'][0]['job']) == {'id', 'title'}
+    assert client.get('/api/jobs/changes', query_string={'since': 'x'}).status_code == 400
+    assert client.get('/api/jobs/changes').status_code == 400
+
+    monkeypatch.setattr(bacnked, 'STREAM_MAX_AGE', 0.2)
+    monkeypatch.setattr(bacnked, 'STREAM_POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(bacnked, '_stream_slots', threading.BoundedSemaphore(1))
+    # 连接到期后服务端结束，最后一条消息只带 id，浏览器重连时从这里继续
+    body = client.get('/api/jobs/stream', query_string={'since': 0}, buffered=True).get_data(as_text=True)
+    assert 'event: changes' in body and body.endswith(f"id: {latest}\n\n")
+    # Last-Event-ID 优先于 since：重连时页面 URL 里的 since 已经过时
+    body = client.get('/api/jobs/stream', query_string={'since': 0},
+                      headers={'Last-Event-ID': str(latest)}, buffered=True).get_data(as_text=True)
+    assert 'event: changes' not in body
+    # 名额在连接结束时归还；占满时返回 503
+    assert bacnked._stream_slots.acquire(blocking=False)
+    busy = client.get('/api/jobs/stream')
+    assert busy.status_code == 503 and busy.headers['Retry-After']
+    bacnked._stream_slots.release()
+
+# ================= 调度租约 =================
+def test_lease_takeover(db):
+    writer = bacnked.job_writer
+    assert writer.acquire_lease('scheduler', 'worker-a', 60)
+    assert not writer.acquire_lease('scheduler', 'worker-b', 60)
+    # 持有者可以续约
+    assert writer.acquire_lease('scheduler', 'worker-a', 60)
+
+    writer.acquire_lease('scheduler', 'worker-a', -1)
+    assert writer.acquire_lease('scheduler', 'worker-b', 60)
+    assert not writer.acquire_lease('scheduler', 'worker-a', 60)
+
+    writer.release_lease('scheduler', 'worker-a')
+    assert not writer.acquire_lease('scheduler', 'worker-a', 60)
+    writer.release_lease('scheduler', 'worker-b')
+    assert writer.acquire_lease('scheduler', 'worker-a', 60)
+
+class StopLoop(Exception):
+    pass
+
+class FakeChannelScheduler:
+    def __init__(self, calls):
+        self.calls = calls
+        self.states = {'DeJob_official': None}
+
+    def restore(self):
+        self.calls.append('restore')
+
+    def run_due(self):
+        self.calls.append('run_due')
+        return 60
+
+def run_one_round(monkeypatch, owner):
+    """执行 background_update 的一轮循环，在第一次 sleep 时退出"""
+    def sleep(seconds): raise StopLoop
+    with monkeypatch.context() as patch:
+        patch.setattr(bacnked.time, 'sleep', sleep)
+        with pytest.raises(StopLoop):
+            bacnked.background_update(owner)
+
+def test_background_update_works_only_while_holding_the_lease(db, monkeypatch):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(1)) for n in range(1, 4)])
+    # 引入去重之前的旧数据没有签名
+    conn = sqlite3.connect(db)
+    conn.execute('UPDATE jobs SET minhash = NULL')
+    conn.commit()
+    conn.close()
+    calls = []
+    monkeypatch.setattr(bacnked, 'get_channel_scheduler', lambda: FakeChannelScheduler(calls))
+    monkeypatch.setattr(bacnked.send_queue, 'start', lambda owner: calls.append(owner))
+    assert bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-b', 60)
+
+    # 别的进程持有租约：不抓取、不启动投递
+    run_one_round(monkeypatch, 'worker-a')
+    assert calls == []
+
+    # 租约过期后接管：恢复频道状态、启动投递、派发到期频道，并推进一批去重签名；退出循环时释放租约
+    bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-b', -1)
+    run_one_round(monkeypatch, 'worker-a')
+    assert calls == ['restore', 'worker-a', 'run_due']
+    assert all(minhash_filled(db))
+    assert bacnked.job_writer.acquire_lease(bacnked.SCHEDULER_LEASE, 'worker-b', 60)
+
+def minhash_filled(db):
+    conn = sqlite3.connect(db)
+    try:
+        return [row[0] is not None for row in conn.execute('SELECT minhash FROM jobs')]
+    finally:
+        conn.close()
+
+# ================= 频道调度 =================
+def test_load_channels_skips_invalid_entries_and_falls_back(tmp_path, monkeypatch):
+    path = tmp_path / 'channels.json'
+    monkeypatch.setattr(bacnked, 'CHANNELS_FILE', str(path))
+    monkeypatch.setenv('SCRAPE_CHANNELS', 'chan_a:2,chan_b')
+    assert [(c.name, c.priority) for c in bacnked.load_channels()] == [('chan_a', 2.0), ('chan_b', 1.0)]
+
+    path.write_text(json.dumps([{'name': 'good', 'priority': 3, 'min_interval': 30}, {'priority': 1},
+                                {'name': 'bad', 'priority': 'high'}, {'name': '  '}, 'plain']))
+    good, plain = bacnked.load_channels()
+    assert (good.name, good.priority, good.min_interval) == ('good', 3.0, 30.0)
+    assert plain.name == 'plain'
+
+    # 文件本身无效时整体退回环境变量，不让进程起不来
+    for content in ('not json', '{"name": "good"}'):
+        path.write_text(content)
+        assert [c.name for c in bacnked.load_channels()] == ['chan_a', 'chan_b']
+
+def test_channel_config_is_reread_only_when_the_file_changes(client, tmp_path, monkeypatch):
+    path = tmp_path / 'channels.json'
+    path.write_text(json.dumps(['chan_a']))
+    monkeypatch.setattr(bacnked, 'CHANNELS_FILE', str(path))
+    monkeypatch.setattr(bacnked, '_channels_cache', (False, []))
+    loads = []
+    load = bacnked.load_channels
+    monkeypatch.setattr(bacnked, 'load_channels', lambda: loads.append(1) or load())
+    bacnked.job_writer.save_channel_status(bacnked.ChannelState(bacnked.ChannelConfig('chan_a', 1, 60, 3600), None).status())
+
+    for _ in range(3):
+        channels = client.get('/api/channels').get_json()['channels']
+        assert [(c['channel'], c['configured']) for c in channels] == [('chan_a', True)]
+    assert len(loads) == 1
+
+    path.write_text(json.dumps(['chan_b']))
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert [c['configured'] for c in client.get('/api/channels').get_json()['channels']] == [False]
+    assert len(loads) == 2
+
+def test_channel_interval_follows_post_rate(db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(bacnked.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(bacnked.random, 'uniform', lambda low, high: 1.0)
+    scheduler = bacnked.ChannelScheduler([bacnked.ChannelConfig('chan', 1.0, 10, 1000)], workers=1)
+    state = scheduler.states['chan']
+    try:
+        def poll(results):
+            for posts, error in results:
+                monkeypatch.setattr(state.scraper, 'poll', lambda days: {'jobs': [], 'posts': posts, 'error': error})
+                scheduler._poll(state)
+                yield state.interval
+                clock[0] += 100
+
+        # 首次轮询没有速率，用 min_interval；每 100 秒 5 条 → 每 20 秒一条；出错时翻倍；
+        # 没有新消息时 EWMA 速率下降，间隔随之变长
+        intervals = list(poll([(0, None), (5, None), (0, 'HTTP 500'), (0, None)]))
+        assert intervals[:3] == [10, 20, 40]
+        assert intervals[3] == pytest.approx(1 / (0.7 * 0.05))
+        assert state.next_poll_at == clock[0] - 100 + intervals[3]
+
+        # 接管调度的进程读回保存的状态
+        restored = bacnked.ChannelScheduler([bacnked.ChannelConfig('chan', 1.0, 10, 1000)], workers=1)
+        restored.restore()
+        assert restored.states['chan'].interval == pytest.approx(intervals[3])
+        assert restored.states['chan'].polls == 4
+        restored.executor.shutdown()
+    finally:
+        scheduler.executor.shutdown()
+
+def test_jobs_channel_filter(client):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), channel='chan_a'), make_job(2, days_ago(1), channel='chan_b')])
+    response = client.get('/api/jobs', query_string={'channel': 'chan_b'})
+    assert [job['id'] for job in response.get_json()['jobs']] == ['chan_b/2']
+
+# ================= 日志与指标 =================
+def test_histogram_renders_cumulative_buckets():
+    histogram = bacnked.Histogram('test_latency_seconds', '测试', ('route',), buckets=(0.1, 1))
+    try:
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, route='/a')
+        lines = [line for line in bacnked.render_metrics().splitlines() if line.startswith('test_latency')]
+        assert lines == [
+            'test_latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'test_latency_seconds_bucket{route="/a",le="1"} 2',
+            'test_latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'test_latency_seconds_sum{route="/a"} 5.55',
+            'test_latency_seconds_count{route="/a"} 3',
+        ]
+    finally:
+        bacnked.METRICS.remove(histogram)
+
+def test_metrics_endpoint_records_requests(client):
+    assert client.get('/api/jobs').status_code == 200
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'easyjob_http_request_seconds_count{endpoint="/api/jobs",method="GET",status="200"}' in body
+    assert 'easyjob_db_query_seconds_count{query="jobs"}' in body
+
+def test_worker_metrics_server_listens_on_localhost_by_default():
+    assert bacnked.WORKER_METRICS_PORT == 0
+    server = bacnked.serve_metrics(0)
+    try:
+        host, port = server.server_address
+        assert host == '127.0.0.1'
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+            assert b'# TYPE easyjob_scrape_fetch_seconds histogram' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_json_log_format_keeps_extra_fields():
+    record = logging.LogRecord('easyjob', logging.WARNING, __file__, 1, '抓取失败 %s', ('x',), None)
+    record.channel = 'DeJob_official'
+    entry = json.loads(bacnked.JsonLogFormatter().format(record))
+    assert entry['level'] == 'warning' and entry['msg'] == '抓取失败 x' and entry['channel'] == 'DeJob_official'
+
+def test_profile_header_returns_report_only_when_enabled(client, monkeypatch):
+    assert client.get('/api/jobs', headers={'X-Profile': '1'}).is_json
+    monkeypatch.setattr(bacnked, 'PROFILING_ENABLED', True)
+    response = client.get('/api/jobs', headers={'X-Profile': '1'})
+    assert response.mimetype == 'text/plain' and response.headers['X-Profile-Backend']
+
+# ================= 列式格式与详情接口 =================
+def decode_columnar(page):
+    """与 index.html 的 decodeColumnar 相同的还原逻辑"""
+    jobs = [{} for _ in range(page['count'])]
+    for field, column in zip(page['fields'], page['columns']):
+        values = page['dicts'].get(field)
+        for job, value in zip(jobs, column):
+            if values is None: job[field] = value
+            elif field == 'tags': job[field] = [values[i] for i in value]
+            else: job[field] = None if value is None else values[value]
+    return jobs
+
+def test_columnar_format_round_trips(client):
+    bacnked.save_jobs_to_db([make_job(n, days_ago(n % 3), company='Acme' if n % 2 else 'Globex')
+                             for n in range(1, 8)])
+    args = {'fields': 'id,company,tags,work_mode,date', 'limit': 5}
+    plain = client.get('/api/jobs', query_string=args).get_json()
+    page = client.get('/api/jobs', query_string={**args, 'format': 'columnar'}).get_json()
+    assert decode_columnar(page) == plain['jobs']
+    assert page['next_cursor'] == plain['next_cursor'] and page['change_version'] == plain['change_version']
+    assert sorted(page['dicts']['company']) == ['Acme', 'Globex']
+    assert client.get('/api/jobs', query_string={'format': 'xml'}).status_code == 400
+    if bacnked.msgpack is None:
+        assert client.get('/api/jobs', query_string={'format': 'msgpack'}).status_code == 400
+
+def test_job_detail_endpoints(client):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(1), '正文一'), make_job(2, days_ago(1), '正文二')])
+    response = client.get('/api/jobs/details', query_string={'ids': 'testchan/2,testchan/9,testchan/2,testchan/1'})
+    assert response.status_code == 200 and response.is_json
+    data = response.get_json()
+    assert [(job['id'], job['raw_content']) for job in data['jobs']] == [('testchan/2', '正文二'), ('testchan/1', '正文一')]
+    assert data['missing'] == ['testchan/9']
+
+    job = client.get('/api/jobs/testchan/1').get_json()
+    assert job['raw_content'] == '正文一' and job['company'] == 'company1'
+    assert client.get('/api/jobs/testchan/9').status_code == 404
+    assert client.get('/api/jobs/details').status_code == 400
+    too_many = ','.join(f'testchan/{n}' for n in range(bacnked.MAX_DETAIL_IDS + 1))
+    assert client.get('/api/jobs/details', query_string={'ids': too_many}).status_code == 400
+
+# ================= 数据保留与归档 =================
+def archived_rows():
+    conn = sqlite3.connect(bacnked.archive_store.path)
+    try:
+        return conn.execute('SELECT id, title FROM archived_jobs ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+def test_archive_moves_expired_jobs_and_serves_details(client):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(100), '旧正文'), make_job(2, days_ago(1), '新正文')])
+    assert bacnked.cleanup_old_jobs(90) == 1
+    assert saved_ids() == ['testchan/2']
+    assert archived_rows() == [('testchan/1', '后端工程师')]
+
+    job = client.get('/api/jobs/testchan/1').get_json()
+    assert job['raw_content'] == '旧正文' and job['archived'] is True
+    data = client.get('/api/jobs/details', query_string={'ids': 'testchan/1,testchan/2'}).get_json()
+    assert [(job['id'], job['raw_content']) for job in data['jobs']] == [('testchan/1', '旧正文'), ('testchan/2', '新正文')]
+
+def test_archive_keeps_rows_updated_while_archiving(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(100)), make_job(2, days_ago(100))])
+    store = bacnked.archive_store.store
+    def store_then_update(jobs):
+        store(jobs)
+        # 归档写入之后、主库删除之前，抓取更新了其中一行
+        bacnked.save_jobs_to_db([make_job(2, days_ago(100), title='运营')])
+    bacnked.archive_store.store = store_then_update
+    assert bacnked.archive_expired(90) == 1
+    del bacnked.archive_store.store
+    with bacnked.db_reader.connection() as conn:
+        assert conn.execute('SELECT id, title FROM jobs').fetchall() == [('testchan/2', '运营')]
+    # 下一次归档覆盖归档库里的旧版本，索引里也不留旧标题
+    assert bacnked.archive_expired(90) == 1
+    assert archived_rows() == [('testchan/1', '后端工程师'), ('testchan/2', '运营')]
+    assert [job['id'] for job in bacnked.archive_store.search(['后端工程师'], {}, 10)] == ['testchan/1']
+
+def test_archive_search_uses_title_and_company_indexes(client):
+    bacnked.save_jobs_to_db([
+        make_job(1, days_ago(200), '正文里没有关键词', title='区块链运营', company='Acme', type='全职'),
+        make_job(2, days_ago(150), title='后端工程师', company='Acme Labs', type='兼职'),
+        make_job(3, days_ago(120), title='区块链运营', company='Globex', type='兼职'),
+        make_job(4, days_ago(1), title='区块链运营', company='Initech'),
+    ])
+    bacnked.cleanup_old_jobs(90)
+
+    def search(**args):
+        response = client.get('/api/jobs/search', query_string=args)
+        return response.status_code, [(job['id'], job.get('archived', False)) for job in response.get_json().get('jobs', [])]
+
+    # 超过保留期的 days 自动带上归档结果，排在在线结果后面、按日期倒序
+    assert search(q='区块链运营', days=365) == (200, [('testchan/4', False), ('testchan/3', True), ('testchan/1', True)])
+    assert search(q='区块链运营')[1] == [('testchan/4', False)]
+    assert search(q='区块链运营', days=365, archive='false')[1] == [('testchan/4', False)]
+    # 两字词和公司名匹配走明文列的 LIKE；归档库支持的筛选条件
+    assert search(q='运营 Acme', days=365)[1] == [('testchan/1', True)]
+    assert search(q='Acme', days=365, type='兼职')[1] == [('testchan/2', True)]
+    assert search(q='区块链', days=170)[1] == [('testchan/4', False), ('testchan/3', True)]
+    # 归档库没有标签等列：显式要求归档时拒绝，自动打开时跳过归档库
+    assert search(q='区块链运营', days=365, archive='true', tag='招聘')[0] == 400
+    assert search(q='区块链运营', days=365, tag='招聘')[1] == [('testchan/4', False)]
+    assert search(q='区块链运营', archive='maybe')[0] == 400
+
+    with bacnked.archive_store.reader() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT codec, payload FROM archived_jobs WHERE date_ts >= 0 AND "
+            "rowid IN (SELECT rowid FROM archived_fts WHERE archived_fts MATCH '\"区块链\"') ORDER BY date_ts DESC, id DESC LIMIT 5"))
+    # 按 trigram 索引或日期索引查找，不逐行扫描 (解压) 整个归档表
+    assert 'archived_fts' in plan and 'SCAN archived_jobs' not in plan
+
+def test_maintenance_records_its_run(db):
+    bacnked.save_jobs_to_db([make_job(1, days_ago(100)), make_job(2, days_ago(1))])
+    assert bacnked.maintenance_due_at() == bacnked.MAINTENANCE_INTERVAL
+    assert bacnked.run_maintenance() == 1
+    assert bacnked.maintenance_due_at() > time.time()
+    assert [job['id'] for job in bacnked.get_snapshot().jobs] == ['testchan/2']
+
+# ================= 基准工具 =================
+@pytest.fixture
+def fake_tme():
+    server = benchmark.start_fake_tme(pages=3)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_fake_tme_serves_initial_not_modified_and_incremental_pages(db, fake_tme):
+    scraper = bacnked.WebScraper(fetcher=bacnked.PageFetcher(rate=1e6, burst=1000))
+    scraper.base_url = fake_tme.channel_url()
+
+    first = scraper.fetch_jobs(lookback_days=3650)
+    numbers = {int(job['id'].split('/')[1]) for job in first}
+    assert first and max(numbers) <= fake_tme.total
+    assert bacnked.get_scrape_state(scraper.state_key(bacnked.STATE_LAST_POST_ID)) == str(fake_tme.total)
+
+    # 频道没有新消息：条件请求拿到 304，不产生新职位
+    requests_before = fake_tme.requests
+    assert scraper.fetch_jobs(lookback_days=3650) == []
+    assert fake_tme.requests - requests_before == 1
+
+    last = fake_tme.total
+    fake_tme.total += bacnked.PAGE_SPAN
+    new = scraper.fetch_jobs(lookback_days=3650)
+    assert new and all(last < int(job['id'].split('/')[1]) <= fake_tme.total for job in new)
+
+def test_seed_db_appends_with_continued_numbering(tmp_path):
+    path = str(tmp_path / 'seed.db')
+    first = benchmark.seed_db(path, 50, days=30, seed=1, batch_size=40)
+    second = benchmark.seed_db(path, 20, days=30, seed=2, batch_size=40)
+    assert (first['seed_rows'], second['seed_rows']) == (50.0, 20.0)
+    with bacnked.db_reader.connection() as conn:
+        ids = [row[0] for row in conn.execute('SELECT id FROM jobs')]
+        oldest = conn.execute('SELECT MIN(date_ts) FROM jobs').fetchone()[0]
+    # 第二次接着最大序号编号，不覆盖已有的行
+    assert len(ids) == len(set(ids)) == 70
+    assert oldest >= bacnked.date_to_ts(days_ago(29))
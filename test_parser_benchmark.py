@@ -0,0 +1,35 @@
+"""解析吞吐的 pytest-benchmark 用例 (需要 pip install pytest-benchmark，未安装时跳过)
+
+运行: python -m pytest -q test_parser_benchmark.py --benchmark-only
+与上次结果对比: --benchmark-autosave 之后加 --benchmark-compare
+"""
+import random
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import bacnked
+# 与 pytest-benchmark 的 benchmark fixture 重名，换个名字导入
+import benchmark as tools
+
+PAGES = 20
+
+@pytest.fixture(scope='module')
+def pages():
+    rng = random.Random(1)
+    total = PAGES * bacnked.PAGE_SPAN
+    return [tools.synthetic_page(rng, total - i * bacnked.PAGE_SPAN, total) for i in range(PAGES)]
+
+def test_jobparser_throughput(benchmark, pages):
+    records = [r for page_html in pages for r in bacnked.parse_page_bs4([page_html])[0]]
+    jobs = benchmark(lambda: [bacnked.JobParser.parse_message(r) for r in records])
+    assert any(jobs)
+
+@pytest.mark.parametrize('backend', sorted(bacnked.PARSER_BACKENDS))
+def test_page_to_jobs_throughput(benchmark, pages, backend):
+    parse_page = bacnked.PARSER_BACKENDS[backend]
+    def run():
+        return [bacnked.JobParser.parse_message(r) for page_html in pages for r in parse_page([page_html])[0]]
+    jobs = benchmark(run)
+    assert len(jobs) == PAGES * bacnked.PAGE_SPAN
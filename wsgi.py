@@ -0,0 +1,16 @@
+"""生产环境的 WSGI 入口
+
+web 进程只处理请求，可以开多个 worker 利用多核，例如:
+    gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5000 wsgi:app
+/api/jobs/stream (SSE) 每个连接占住一个线程，因此需要线程型 worker。每个进程同时最多
+STREAM_MAX_CLIENTS (默认 8) 个推送连接，--threads 要比它大，留出线程处理普通请求；
+超出的连接返回 503，前端改为轮询 /api/jobs/changes。每个连接最长 STREAM_MAX_AGE (默认 45) 秒，
+到期后浏览器带 Last-Event-ID 重连，连接会在各 worker 之间重新分布。
+
+数据库迁移、定时抓取和投递队列在单独的进程里运行，先于 web 启动:
+    python bacnked.py --worker
+多台机器或多个 --worker 同时运行时，通过数据库里的租约保证只有一个在抓取。
+"""
+from bacnked import create_app
+
+app = create_app()